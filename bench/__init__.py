@@ -0,0 +1,13 @@
+"""
+Бенчмарк API: приложение запускается внутри процесса поверх поддельных
+эластика и редиса с синтетическим каталогом. Запуск: python -m bench --help
+"""
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+SRC_DIR = ROOT_DIR / 'src'
+
+# модули приложения импортируются так же, как при запуске src/main.py
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
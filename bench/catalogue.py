@@ -0,0 +1,91 @@
+import random
+import uuid
+from typing import Dict, List
+
+# на какой индекс ссылаются вложенные объекты фильма
+REFERENCES = {
+    'genres': 'genres',
+    'actors': 'persons',
+    'writers': 'persons',
+    'directors': 'persons',
+}
+# сколько вложенных объектов бывает у фильма
+NESTED_COUNTS = {
+    'genres': (1, 3),
+    'actors': (2, 8),
+    'writers': (1, 2),
+    'directors': (1, 1),
+}
+SHORT_TEXT_FIELDS = {'title', 'name', 'type'}
+SYLLABLES = ['ka', 'ri', 'mo', 'ne', 'ta', 'lo', 'vi', 'sa', 'du',
+             'pe', 'zo', 'mi', 'ra', 'ko', 'li', 'an', 'tor', 'sel']
+
+
+class Catalogue:
+    """
+    Синтетический каталог, сгенерированный по маппингам индексов.
+    Персоны и жанры в фильмах берутся из сгенерированных индексов persons
+    и genres, популярность персон распределена по степенному закону,
+    как в настоящем каталоге.
+    """
+
+    def __init__(self, mappings: Dict[str, dict], films: int, persons: int, genres: int, seed: int = 1):
+        self.mappings = mappings
+        self.rnd = random.Random(seed)
+        self.words = self._make_words(3000)
+        self.docs: Dict[str, List[dict]] = {}
+        sizes = {'genres': genres, 'persons': persons, 'movies': films}
+        # сначала индексы, на которые ссылаются фильмы
+        for index in ('genres', 'persons', 'movies'):
+            self.docs[index] = [self._make_doc(index, mappings[index]) for _ in range(sizes[index])]
+
+    def _make_words(self, count: int) -> List[str]:
+        words = set()
+        while len(words) < count:
+            words.add(''.join(self.rnd.choice(SYLLABLES) for _ in range(self.rnd.randint(2, 4))))
+        return sorted(words)
+
+    def _text(self, min_words: int, max_words: int) -> str:
+        return ' '.join(self.rnd.choice(self.words) for _ in range(self.rnd.randint(min_words, max_words)))
+
+    def _pick(self, index: str, count: int) -> List[dict]:
+        docs = self.docs[index]
+        count = min(count, len(docs))
+        picked = {}
+        while len(picked) < count:
+            # степенное распределение: первые документы индекса встречаются чаще
+            position = min(int(self.rnd.paretovariate(1.2)) - 1, len(docs) - 1)
+            if self.rnd.random() < 0.5:
+                position = self.rnd.randrange(len(docs))
+            picked[position] = docs[position]
+        return list(picked.values())
+
+    def _make_doc(self, index: str, properties: Dict[str, dict]) -> dict:
+        doc = {}
+        for field, mapping in properties.items():
+            field_type = mapping.get('type')
+            if field == 'id':
+                doc[field] = str(uuid.UUID(int=self.rnd.getrandbits(128), version=4))
+            elif field_type == 'nested':
+                low, high = NESTED_COUNTS.get(field, (1, 3))
+                refs = self._pick(REFERENCES[field], self.rnd.randint(low, high))
+                doc[field] = [{key: ref[key] for key in mapping['properties']} for ref in refs]
+            elif field_type == 'float':
+                doc[field] = round(self.rnd.uniform(1, 10), 1)
+            elif field_type in ('integer', 'long'):
+                doc[field] = self.rnd.randint(0, 10000)
+            elif field_type == 'keyword':
+                doc[field] = self.rnd.choice(self.words)
+            elif field in SHORT_TEXT_FIELDS:
+                doc[field] = self._text(1, 3)
+            elif field.endswith('_names'):
+                # заполняется по вложенным объектам ниже
+                continue
+            else:
+                doc[field] = self._text(10, 30)
+        # <роль>_names - имена из вложенного поля <роль>, как их пишет ETL
+        for field in properties:
+            nested = field[:-len('_names')]
+            if field.endswith('_names') and nested in doc:
+                doc[field] = ' '.join(ref['name'] for ref in doc[nested])
+        return doc
@@ -0,0 +1,95 @@
+"""
+Размер значений в редисе и стоимость кодирования и чтения
+для каждого формата из cache.codec, по типам объектов.
+
+Запуск: python -m bench.codecs [--films 2000] [--threshold 1024] [--level 3]
+"""
+import argparse
+import time
+from typing import Callable, List
+
+from bench.catalogue import Catalogue
+from bench.schema import load_mappings
+from api.v1.models import FilmShort as ApiFilmShort, PaginatedFilmShortList
+from cache import codec as codecs
+from cache.entry import make_entry, pack_entry
+from models.fast import construct, dumps
+from models.film import Film, FilmShort
+from models.genre import Genre
+from models.person import Person
+
+
+def _per_item(fn: Callable[[], object], count: int, repeat: int = 5) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best / count * 1e6
+
+
+def _list_pages(films: List[FilmShort], page_size: int) -> List[bytes]:
+    pages = []
+    for start in range(0, len(films), page_size):
+        page = PaginatedFilmShortList.construct(
+            page_number=start // page_size + 1,
+            count=page_size,
+            total_pages=len(films) // page_size,
+            next_cursor=None,
+            result=[ApiFilmShort.construct(id=film.id, title=film.title, imdb_rating=film.imdb_rating)
+                    for film in films[start:start + page_size]],
+        )
+        pages.append(pack_entry(make_entry(dumps(page), 0, 0)))
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m bench.codecs', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--films', type=int, default=2000)
+    parser.add_argument('--threshold', type=int, default=1024, help='CACHE_COMPRESSION_THRESHOLD')
+    parser.add_argument('--level', type=int, default=3, help='CACHE_COMPRESSION_LEVEL')
+    args = parser.parse_args()
+
+    catalogue = Catalogue(load_mappings(), films=args.films, persons=max(1, args.films // 2), genres=30)
+    objects = {
+        'film': [construct(Film, doc) for doc in catalogue.docs['movies']],
+        'film short': [construct(FilmShort, doc) for doc in catalogue.docs['movies']],
+        'person': [construct(Person, doc) for doc in catalogue.docs['persons']],
+        'genre': [construct(Genre, doc) for doc in catalogue.docs['genres']],
+    }
+    # готовые ответы API кодируются без сериализации, только сжимаются
+    pages = _list_pages(objects['film short'], 50)
+
+    formats = [(serializer, compression)
+               for serializer in codecs.SERIALIZERS for compression in codecs.COMPRESSIONS]
+    print(f'threshold {args.threshold} bytes, level {args.level}; '
+          f'bytes per value, saved vs orjson without compression, microseconds per value')
+    print(f"{'entity':<22}{'format':<16}{'bytes':>9}{'saved':>8}{'encode':>9}{'decode':>9}")
+    for entity in list(objects) + ['response page (50)']:
+        baseline = None
+        for serializer, compression in formats:
+            try:
+                codec = codecs.Codec(serializer, compression, args.threshold, args.level)
+            except codecs.CodecError:
+                continue
+            if entity in objects:
+                items = objects[entity]
+                encoded = [codec.dumps(obj) for obj in items]
+                encode_us = _per_item(lambda: [codec.dumps(obj) for obj in items], len(items))
+                decode_us = _per_item(lambda: [codec.loads(data) for data in encoded], len(encoded))
+            else:
+                if serializer != 'orjson':
+                    continue
+                encoded = [codec.pack(page) for page in pages]
+                encode_us = _per_item(lambda: [codec.pack(page) for page in pages], len(pages))
+                decode_us = _per_item(lambda: [codec.unpack(data) for data in encoded], len(encoded))
+            size = sum(map(len, encoded)) / len(encoded)
+            baseline = baseline or size
+            name = serializer if entity in objects else 'raw'
+            print(f'{entity:<22}{name + "+" + compression:<16}{size:>9.0f}{(1 - size / baseline) * 100:>7.1f}%'
+                  f'{encode_us:>9.2f}{decode_us:>9.2f}')
+
+
+if __name__ == '__main__':
+    main()
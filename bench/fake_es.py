@@ -0,0 +1,596 @@
+import asyncio
+import bisect
+import re
+from collections import Counter
+from functools import total_ordering
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import orjson
+
+_TOKEN = re.compile(r'\w+', re.U)
+
+
+def _tokens(value: Any) -> List[str]:
+    return _TOKEN.findall(str(value).lower())
+
+
+@total_ordering
+class _Desc:
+    """
+    Значение сортировки по убыванию: сравнивается наоборот,
+    чтобы ключи сортировки можно было искать бисекцией.
+    """
+    __slots__ = ('value', )
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return self.value > other.value
+
+
+class FakeIndex:
+    """
+    Индекс поддельного эластика: документы в памяти и инвертированные
+    индексы по полям, которые строятся при первом запросе к полю.
+    Текстовые поля разбиваются на слова, keyword-поля хранятся целиком.
+    """
+
+    def __init__(self, name: str, docs: List[dict], properties: Dict[str, dict]):
+        self.name = name
+        self.docs = docs
+        self.properties = properties
+        self.positions = {doc['id']: position for position, doc in enumerate(docs)}
+        self._postings: Dict[str, Dict[str, List[int]]] = {}
+        self._source_paths: Dict[str, List[str]] = {}
+        self._completions: Dict[str, List[Tuple[str, int]]] = {}
+
+    def field_type(self, path: str) -> Optional[str]:
+        properties, mapping = self.properties, None
+        parts = path.split('.')
+        for part in parts:
+            if part in properties:
+                mapping = properties[part]
+                properties = mapping.get('properties', {})
+            elif mapping is not None and part in mapping.get('fields', {}):
+                # под-поле вроде title.raw
+                return mapping['fields'][part].get('type')
+            else:
+                return None
+        return mapping.get('type') if mapping else None
+
+    def source_path(self, path: str) -> List[str]:
+        """
+        Путь в документе для поля маппинга: у под-полей (title.raw) - путь родителя.
+        """
+        if path not in self._source_paths:
+            properties, result = self.properties, []
+            for part in path.split('.'):
+                if part not in properties:
+                    break
+                result.append(part)
+                properties = properties[part].get('properties', {})
+            self._source_paths[path] = result
+        return self._source_paths[path]
+
+    def completions(self, path: str) -> List[Tuple[str, int]]:
+        """
+        Отсортированные пары (текст в нижнем регистре, позиция) для completion-поля.
+        """
+        if path not in self._completions:
+            field, = self.source_path(path)
+            self._completions[path] = sorted(
+                (doc[field].lower(), position) for position, doc in enumerate(self.docs)
+                if isinstance(doc.get(field), str))
+        return self._completions[path]
+
+    def values(self, position: int, path: str) -> List[Any]:
+        current = [self.docs[position]]
+        for part in self.source_path(path):
+            values = []
+            for item in current:
+                if isinstance(item, dict) and item.get(part) is not None:
+                    value = item[part]
+                    values.extend(value if isinstance(value, list) else [value])
+            current = values
+        return current
+
+    def postings(self, path: str) -> Dict[str, List[int]]:
+        if path not in self._postings:
+            keyword = self.field_type(path) in ('keyword', 'float', 'integer', 'long', 'completion')
+            postings: Dict[str, List[int]] = {}
+            for position in range(len(self.docs)):
+                terms = set()
+                for value in self.values(position, path):
+                    terms.update([str(value)] if keyword else _tokens(value))
+                for term in terms:
+                    postings.setdefault(term, []).append(position)
+            self._postings[path] = postings
+        return self._postings[path]
+
+    def is_keyword(self, path: str) -> bool:
+        return self.field_type(path) != 'text'
+
+
+class FakeElasticsearch:
+    """
+    Поддельный AsyncElasticsearch для бенчмарка: поддерживает запросы,
+    которые делают сервисы (search с сортировкой, from/size и search_after,
+    point-in-time, mget, msearch, count, агрегации и completion suggester).
+    Результаты поиска по одинаковому запросу и сортировке запоминаются,
+    чтобы стоимость самого поддельного эластика не искажала замеры.
+    latency - искусственная задержка каждого запроса, как сетевой round-trip.
+    """
+
+    def __init__(self, indices: Dict[str, FakeIndex], latency: float = 0.0):
+        self.indices = indices
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._results: Dict[Tuple, Tuple[List[int], List[tuple], Dict[int, float]]] = {}
+        self._pits: Dict[str, str] = {}
+
+    async def _round_trip(self, operation: str, index: Optional[str]):
+        self.calls[(operation, index)] += 1
+        await asyncio.sleep(self.latency)
+
+    # запросы
+
+    def _match(self, index: FakeIndex, query: Optional[dict]) -> Optional[Dict[int, float]]:
+        """
+        Возвращает найденные документы как позиция -> релевантность,
+        None - все документы индекса.
+        """
+        if not query or 'match_all' in query:
+            return None
+        (kind, clause), = query.items()
+        if kind == 'bool':
+            return self._match_bool(index, clause)
+        if kind == 'nested':
+            # вложенные поля проиндексированы по полному пути, отдельный контекст не нужен
+            return self._match(index, clause['query'])
+        if kind in ('match', 'match_phrase', 'match_phrase_prefix'):
+            (field, value), = clause.items()
+            if isinstance(value, dict):
+                value = value['query']
+            return self._match_terms(index, field, value, prefix=kind == 'match_phrase_prefix')
+        if kind == 'multi_match':
+            scores: Dict[int, float] = {}
+            for field in clause['fields']:
+                field, _, boost = field.partition('^')
+                for position, score in self._match_terms(index, field, clause['query']).items():
+                    scores[position] = scores.get(position, 0) + score * float(boost or 1)
+            return scores
+        if kind == 'term':
+            (field, value), = clause.items()
+            if isinstance(value, dict):
+                value = value['value']
+            return {position: 1.0 for position in index.postings(field).get(str(value), [])}
+        if kind == 'terms':
+            (field, values), = clause.items()
+            postings = index.postings(field)
+            return {position: 1.0 for value in values for position in postings.get(str(value), [])}
+        if kind == 'ids':
+            return {index.positions[doc_id]: 1.0 for doc_id in clause['values'] if doc_id in index.positions}
+        if kind == 'prefix':
+            (field, value), = clause.items()
+            if isinstance(value, dict):
+                value = value['value']
+            return self._match_prefix(index, field, str(value).lower())
+        if kind == 'range':
+            (field, bounds), = clause.items()
+            return {position: 1.0 for position in range(len(index.docs))
+                    if any(_in_range(value, bounds) for value in index.values(position, field))}
+        if kind == 'exists':
+            return {position: 1.0 for position in range(len(index.docs)) if index.values(position, clause['field'])}
+        raise NotImplementedError(f'query {kind} is not supported by the fake elasticsearch')
+
+    def _match_bool(self, index: FakeIndex, clause: dict) -> Optional[Dict[int, float]]:
+        result: Optional[Dict[int, float]] = None
+        for key in ('must', 'filter'):
+            for sub in _as_list(clause.get(key)):
+                matched = self._match(index, sub)
+                if matched is None:
+                    continue
+                if result is None:
+                    result = matched if key == 'must' else dict.fromkeys(matched, 0.0)
+                else:
+                    result = {position: result[position] + (matched[position] if key == 'must' else 0)
+                              for position in result if position in matched}
+        should = _as_list(clause.get('should'))
+        if should:
+            union: Dict[int, float] = {}
+            for sub in should:
+                for position, score in (self._match(index, sub) or
+                                        dict.fromkeys(range(len(index.docs)), 1.0)).items():
+                    union[position] = union.get(position, 0) + score
+            if result is None:
+                result = union
+            else:
+                # при must/filter should только добавляет релевантности
+                result = {position: score + union.get(position, 0) for position, score in result.items()}
+        for sub in _as_list(clause.get('must_not')):
+            excluded = self._match(index, sub)
+            if result is None:
+                result = dict.fromkeys(range(len(index.docs)), 1.0)
+            if excluded is None:
+                return {}
+            result = {position: score for position, score in result.items() if position not in excluded}
+        return result
+
+    def _match_terms(self, index: FakeIndex, field: str, value: Any, prefix: bool = False) -> Dict[int, float]:
+        if index.is_keyword(field):
+            return {position: 1.0 for position in index.postings(field).get(str(value), [])}
+        scores: Dict[int, float] = {}
+        tokens = _tokens(value)
+        for i, token in enumerate(tokens):
+            if prefix and i == len(tokens) - 1:
+                matched = self._match_prefix(index, field, token)
+            else:
+                matched = dict.fromkeys(index.postings(field).get(token, []), 1.0)
+            for position in matched:
+                scores[position] = scores.get(position, 0) + 1
+        return scores
+
+    def _match_prefix(self, index: FakeIndex, field: str, prefix: str) -> Dict[int, float]:
+        scores = {}
+        for term, positions in index.postings(field).items():
+            if term.lower().startswith(prefix):
+                scores.update(dict.fromkeys(positions, 1.0))
+        return scores
+
+    # сортировка
+
+    def _sorted(self, index: FakeIndex, query: Optional[dict], sort: List[Tuple[str, str]]
+                ) -> Tuple[List[int], List[tuple], Dict[int, float]]:
+        key = (index.name, orjson.dumps(query, option=orjson.OPT_SORT_KEYS), tuple(sort))
+        if key not in self._results:
+            matched = self._match(index, query)
+            if matched is None:
+                matched = dict.fromkeys(range(len(index.docs)), 1.0)
+            sort = sort or [('_score', 'desc')]
+            keys = {position: self._sort_key(index, position, matched[position], sort) for position in matched}
+            positions = sorted(matched, key=lambda position: (keys[position], position))
+            self._results[key] = (positions, [keys[position] for position in positions], matched)
+        return self._results[key]
+
+    @staticmethod
+    def _sort_key(index: FakeIndex, position: int, score: float, sort: List[Tuple[str, str]]) -> tuple:
+        key = []
+        for field, order in sort:
+            values = [score] if field == '_score' else index.values(position, field)
+            value = (min(values) if order == 'asc' else max(values)) if values else None
+            # документы без значения - в конце при любом порядке
+            missing = value is None
+            key.append((missing, value if order == 'asc' or missing else _Desc(value)))
+        return tuple(key)
+
+    @staticmethod
+    def _sort_spec(sort: Any) -> List[Tuple[str, str]]:
+        spec = []
+        if isinstance(sort, str):
+            sort = [dict([item.split(':')]) if ':' in item else item for item in sort.split(',')]
+        for item in _as_list(sort):
+            if isinstance(item, str):
+                spec.append((item, 'desc' if item == '_score' else 'asc'))
+                continue
+            (field, order), = item.items()
+            if isinstance(order, dict):
+                order = order.get('order', 'asc')
+            spec.append((field, order))
+        return spec
+
+    # API клиента
+
+    async def search(self, body: Optional[dict] = None, index: Optional[str] = None,
+                     params: Optional[dict] = None, **kwargs) -> dict:
+        body = dict(body or {})
+        params = dict(params or {}, **kwargs)
+        if index is None and 'pit' in body:
+            index = self._pits[body['pit']['id']]
+        await self._round_trip('search', index)
+        return self._search(self.indices[index], body, params)
+
+    def _search(self, index: FakeIndex, body: dict, params: dict) -> dict:
+        sort = self._sort_spec(body.get('sort', params.get('sort')))
+        positions, keys, scores = self._sorted(index, body.get('query'), sort)
+        if body.get('search_after') is not None:
+            after = self._sort_key_from_values(body['search_after'], sort)
+            start = bisect.bisect_right(keys, after)
+        else:
+            start = int(body.get('from', params.get('from', 0)))
+        size = int(body.get('size', params.get('size', 10)))
+        page = positions[start:start + size]
+
+        source = _source_filter(body, params)
+        hits = []
+        for position in page:
+            doc = index.docs[position]
+            hit = {'_index': index.name, '_id': doc['id'], '_score': scores[position]}
+            if source is not False:
+                hit['_source'] = _project(doc, source)
+            if sort:
+                hit['sort'] = [self._sort_value(index, position, scores[position], field, order)
+                               for field, order in sort]
+            hits.append(hit)
+
+        total = {'value': len(positions), 'relation': 'eq'}
+        track = body.get('track_total_hits', params.get('track_total_hits', 10000))
+        if track is not True and str(track).lower() != 'true':
+            limit = int(track) if str(track).lstrip('-').isdigit() else 0
+            if len(positions) > limit:
+                total = {'value': limit, 'relation': 'gte'}
+        result = {'took': 0, 'timed_out': False, 'hits': {'total': total, 'hits': hits}}
+        if str(track).lower() == 'false':
+            del result['hits']['total']
+        aggs = body.get('aggs') or body.get('aggregations')
+        if aggs:
+            result['aggregations'] = _aggregate(index, [(position, None) for position in positions], aggs)
+        if body.get('suggest'):
+            result['suggest'] = _suggest(index, body['suggest'], source)
+        if 'pit' in body:
+            result['pit_id'] = body['pit']['id']
+        return result
+
+    def _sort_value(self, index: FakeIndex, position: int, score: float, field: str, order: str) -> Any:
+        if field == '_score':
+            return score
+        values = index.values(position, field)
+        if not values:
+            return None
+        return min(values) if order == 'asc' else max(values)
+
+    @staticmethod
+    def _sort_key_from_values(values: List[Any], sort: List[Tuple[str, str]]) -> tuple:
+        key = []
+        for value, (_, order) in zip(values, sort):
+            missing = value is None
+            key.append((missing, value if order == 'asc' or missing else _Desc(value)))
+        return tuple(key)
+
+    async def count(self, body: Optional[dict] = None, index: Optional[str] = None,
+                    params: Optional[dict] = None, **kwargs) -> dict:
+        await self._round_trip('count', index)
+        matched = self._match(self.indices[index], (body or {}).get('query'))
+        return {'count': len(self.indices[index].docs) if matched is None else len(matched)}
+
+    async def mget(self, body: dict, index: Optional[str] = None, params: Optional[dict] = None, **kwargs) -> dict:
+        await self._round_trip('mget', index)
+        params = dict(params or {}, **kwargs)
+        fake_index = self.indices[index]
+        source = _source_filter({}, params)
+        ids = [doc['_id'] for doc in body['docs']] if 'docs' in body else body['ids']
+        docs = []
+        for doc_id in ids:
+            doc_id = str(doc_id)
+            position = fake_index.positions.get(doc_id)
+            if position is None:
+                docs.append({'_index': index, '_id': doc_id, 'found': False})
+                continue
+            doc = {'_index': index, '_id': doc_id, 'found': True}
+            if source is not False:
+                doc['_source'] = _project(fake_index.docs[position], source)
+            docs.append(doc)
+        return {'docs': docs}
+
+    async def msearch(self, body: List[dict], index: Optional[str] = None,
+                      params: Optional[dict] = None, **kwargs) -> dict:
+        await self._round_trip('msearch', index)
+        responses = []
+        for header, search in zip(body[::2], body[1::2]):
+            responses.append(self._search(self.indices[header.get('index', index)], dict(search), {}))
+        return {'took': 0, 'responses': responses}
+
+    async def open_point_in_time(self, index: str, params: Optional[dict] = None, **kwargs) -> dict:
+        await self._round_trip('open_point_in_time', index)
+        pit_id = f'pit-{index}-{len(self._pits)}'
+        self._pits[pit_id] = index
+        return {'id': pit_id}
+
+    async def close_point_in_time(self, body: Optional[dict] = None, params: Optional[dict] = None, **kwargs):
+        await self._round_trip('close_point_in_time', None)
+        self._pits.pop((body or {}).get('id'), None)
+        return {'succeeded': True}
+
+    async def ping(self, **kwargs) -> bool:
+        await self._round_trip('ping', None)
+        return True
+
+    async def info(self, **kwargs) -> dict:
+        await self._round_trip('info', None)
+        return {'version': {'number': '7.10.1'}, 'tagline': 'You Know, for Search'}
+
+    async def close(self):
+        pass
+
+
+def _as_list(value: Any) -> List[Any]:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _in_range(value: Any, bounds: dict) -> bool:
+    checks = {'gt': value.__gt__, 'gte': value.__ge__, 'lt': value.__lt__, 'lte': value.__le__}
+    return all(checks[op](bound) for op, bound in bounds.items() if op in checks)
+
+
+def _source_filter(body: dict, params: dict) -> Any:
+    """
+    False - без _source, None - документ целиком, список - только эти поля.
+    """
+    source = body.get('_source', params.get('_source'))
+    if source is False or str(source).lower() == 'false':
+        return False
+    if isinstance(source, dict):
+        return source.get('includes')
+    if isinstance(source, list):
+        return source
+    includes = params.get('_source_includes')
+    if includes:
+        return includes.split(',') if isinstance(includes, str) else list(includes)
+    return None
+
+
+def _project(doc: dict, fields: Optional[Iterable[str]]) -> dict:
+    if fields is None:
+        return doc
+    result = {}
+    for field in fields:
+        top, _, sub = field.partition('.')
+        if top not in doc:
+            continue
+        if not sub:
+            result[top] = doc[top]
+        elif isinstance(doc[top], list):
+            items = result.setdefault(top, [{} for _ in doc[top]])
+            for item, value in zip(items, doc[top]):
+                item[sub] = value.get(sub)
+        else:
+            result.setdefault(top, {})[sub] = doc[top].get(sub)
+    return result
+
+
+def _aggregate(index: FakeIndex, rows: List[Tuple[int, Any]], aggs: dict) -> dict:
+    """
+    Считает агрегации по найденным документам. rows - пары (позиция документа,
+    путь вложенного контекста или None), чтобы nested/reverse_nested считали
+    количество вложенных объектов и документов так же, как эластик.
+    """
+    result = {}
+    for name, agg in aggs.items():
+        sub_aggs = agg.get('aggs') or agg.get('aggregations')
+        kind = next(key for key in agg if key not in ('aggs', 'aggregations', 'meta'))
+        spec = agg[kind]
+        if kind == 'nested':
+            path = spec['path']
+            nested_rows = [(position, (path, i)) for position, _ in rows
+                           for i in range(len(index.docs[position].get(path) or []))]
+            value = {'doc_count': len(nested_rows)}
+            if sub_aggs:
+                value.update(_aggregate(index, nested_rows, sub_aggs))
+        elif kind == 'reverse_nested':
+            documents = list(dict.fromkeys(position for position, _ in rows))
+            value = {'doc_count': len(documents)}
+            if sub_aggs:
+                value.update(_aggregate(index, [(position, None) for position in documents], sub_aggs))
+        elif kind == 'filter':
+            fake = FakeElasticsearch({index.name: index})
+            matched = fake._match(index, spec)
+            filtered = [row for row in rows if matched is None or row[0] in matched]
+            value = {'doc_count': len(filtered)}
+            if sub_aggs:
+                value.update(_aggregate(index, filtered, sub_aggs))
+        elif kind == 'terms':
+            value = _terms_agg(index, rows, spec, sub_aggs)
+        elif kind == 'histogram':
+            value = _histogram_agg(index, rows, spec, sub_aggs)
+        elif kind in ('min', 'max', 'avg', 'sum', 'value_count', 'cardinality'):
+            values = [field_value for row in rows for field_value in _row_values(index, row, spec['field'])]
+            value = {'value': _metric(kind, values)}
+        elif kind == 'top_hits':
+            size = spec.get('size', 3)
+            documents = list(dict.fromkeys(position for position, _ in rows))[:size]
+            source = _source_filter(spec, {})
+            value = {'hits': {'total': {'value': len(rows), 'relation': 'eq'},
+                              'hits': [{'_id': index.docs[position]['id'],
+                                        '_source': _project(index.docs[position], source or None)}
+                                       for position in documents]}}
+        else:
+            raise NotImplementedError(f'aggregation {kind} is not supported by the fake elasticsearch')
+        result[name] = value
+    return result
+
+
+def _row_values(index: FakeIndex, row: Tuple[int, Any], field: str) -> List[Any]:
+    position, nested = row
+    if nested is not None:
+        path, i = nested
+        if field.startswith(path + '.'):
+            value = index.docs[position][path][i].get(field[len(path) + 1:])
+            return [] if value is None else [value]
+    return index.values(position, field)
+
+
+def _terms_agg(index: FakeIndex, rows, spec: dict, sub_aggs: Optional[dict]) -> dict:
+    buckets: Dict[Any, List[Tuple[int, Any]]] = {}
+    for row in rows:
+        # в nested-контексте строка - один вложенный объект, в обычном - документ
+        for value in set(_row_values(index, row, spec['field'])):
+            buckets.setdefault(value, []).append(row)
+    ordered = sorted(buckets.items(), key=lambda item: (-len(item[1]), str(item[0])))
+    size = spec.get('size', 10)
+    result = {'doc_count_error_upper_bound': 0,
+              'sum_other_doc_count': sum(len(bucket) for _, bucket in ordered[size:]),
+              'buckets': []}
+    for key, bucket_rows in ordered[:size]:
+        bucket = {'key': key, 'doc_count': len(bucket_rows)}
+        if sub_aggs:
+            bucket.update(_aggregate(index, bucket_rows, sub_aggs))
+        result['buckets'].append(bucket)
+    return result
+
+
+def _histogram_agg(index: FakeIndex, rows, spec: dict, sub_aggs: Optional[dict]) -> dict:
+    interval = spec['interval']
+    buckets: Dict[float, List[Tuple[int, Any]]] = {}
+    for row in rows:
+        for value in _row_values(index, row, spec['field']):
+            buckets.setdefault((value // interval) * interval, []).append(row)
+    if not buckets:
+        return {'buckets': []}
+    keys, key = [], min(buckets)
+    while key <= max(buckets):
+        keys.append(key)
+        key = round(key + interval, 10)
+    result = {'buckets': []}
+    for key in keys:
+        bucket_rows = buckets.get(key, [])
+        if len(bucket_rows) < spec.get('min_doc_count', 0):
+            continue
+        bucket = {'key': float(key), 'doc_count': len(bucket_rows)}
+        if sub_aggs:
+            bucket.update(_aggregate(index, bucket_rows, sub_aggs))
+        result['buckets'].append(bucket)
+    return result
+
+
+def _metric(kind: str, values: List[Any]) -> Any:
+    if kind == 'value_count':
+        return len(values)
+    if kind == 'cardinality':
+        return len(set(values))
+    if not values:
+        return None
+    if kind == 'avg':
+        return sum(values) / len(values)
+    return {'min': min, 'max': max, 'sum': sum}[kind](values)
+
+
+def _suggest(index: FakeIndex, suggest: dict, source: Any) -> dict:
+    result = {}
+    for name, spec in suggest.items():
+        if 'completion' not in spec:
+            raise NotImplementedError('only completion suggesters are supported by the fake elasticsearch')
+        completion = spec['completion']
+        prefix = str(spec.get('prefix', spec.get('text', ''))).lower()
+        entries = index.completions(completion['field'])
+        size = completion.get('size', 5)
+        options, seen = [], set()
+        start = bisect.bisect_left(entries, (prefix, -1))
+        for text, position in entries[start:]:
+            if not text.startswith(prefix) or len(options) >= size:
+                break
+            doc = index.docs[position]
+            if completion.get('skip_duplicates') and text in seen:
+                continue
+            seen.add(text)
+            option = {'text': doc[index.source_path(completion['field'])[0]], '_index': index.name,
+                      '_id': doc['id'], '_score': 1.0}
+            if source is not False:
+                option['_source'] = _project(doc, source)
+            options.append(option)
+        result[name] = [{'text': prefix, 'offset': 0, 'length': len(prefix), 'options': options}]
+    return result
@@ -0,0 +1,293 @@
+import asyncio
+import fnmatch
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from cache.redis import ADMIT_SEARCH_KEY_SCRIPT
+from cache.singleflight import RELEASE_LOCK_SCRIPT
+from services.person_films import SET_FILM_PERSONS_SCRIPT
+
+
+def _bytes(value: Any) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode()
+    return str(value).encode()
+
+
+def _key(key: Any) -> str:
+    return key.decode() if isinstance(key, bytes) else str(key)
+
+
+def _decode(value: Any, encoding: Optional[str]) -> Any:
+    if encoding is None or value is None:
+        return value
+    return value.decode(encoding)
+
+
+class _Pool:
+    """
+    Подмена пула соединений aioredis: только счётчики, которые читают метрики.
+    """
+    size = maxsize = minsize = 1
+    freesize = 1
+
+
+class FakePipeline:
+    """
+    Пайплайн поддельного редиса: команды копятся до execute и выполняются
+    за один round-trip, как в aioredis.
+    """
+
+    def __init__(self, redis: 'FakeRedis'):
+        self._redis = redis
+        self._commands: List[Tuple[str, tuple, dict, asyncio.Future]] = []
+
+    def __getattr__(self, name: str):
+        # проверяет, что такая команда есть
+        getattr(self._redis, '_' + name)
+
+        def queue(*args, **kwargs):
+            future = asyncio.get_event_loop().create_future()
+            self._commands.append((name, args, kwargs, future))
+            return future
+        return queue
+
+    async def execute(self) -> List[Any]:
+        await self._redis._round_trip('pipeline')
+        results = []
+        for name, args, kwargs, future in self._commands:
+            result = getattr(self._redis, '_' + name)(*args, **kwargs)
+            future.set_result(result)
+            results.append(result)
+        self._commands = []
+        return results
+
+
+class FakeRedis:
+    """
+    Поддельный клиент aioredis для бенчмарка: данные в памяти процесса,
+    команды, которые использует приложение, с TTL и опциональной
+    задержкой на каждый round-trip (команду или пайплайн целиком).
+    """
+    SET_IF_EXIST = 'SET_IF_EXIST'
+    SET_IF_NOT_EXIST = 'SET_IF_NOT_EXIST'
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self.connection = _Pool()
+        self._data: Dict[str, Any] = {}
+        self._expires: Dict[str, float] = {}
+
+    def flushall(self):
+        self._data.clear()
+        self._expires.clear()
+
+    async def _round_trip(self, command: str):
+        self.calls[command] += 1
+        await asyncio.sleep(self.latency)
+
+    def __getattr__(self, name: str):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        command = getattr(self, '_' + name)
+
+        async def call(*args, **kwargs):
+            await self._round_trip(name)
+            return command(*args, **kwargs)
+        return call
+
+    def pipeline(self) -> FakePipeline:
+        return FakePipeline(self)
+
+    def multi_exec(self) -> FakePipeline:
+        return FakePipeline(self)
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+    # команды: выполняются синхронно, round-trip учитывает вызывающий
+
+    def _alive(self, key: Any) -> Optional[Any]:
+        key = _key(key)
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return self._data.get(key)
+
+    def _get(self, key, encoding=None):
+        return _decode(self._alive(key), encoding)
+
+    def _mget(self, key, *keys, encoding=None):
+        return [_decode(self._alive(item), encoding) for item in (key, ) + keys]
+
+    def _set(self, key, value, *, expire=0, pexpire=0, exist=None):
+        key = _key(key)
+        alive = self._alive(key) is not None
+        if exist == self.SET_IF_NOT_EXIST and alive or exist == self.SET_IF_EXIST and not alive:
+            return None
+        self._data[key] = _bytes(value)
+        self._expires.pop(key, None)
+        if expire or pexpire:
+            self._expires[key] = time.monotonic() + (expire or pexpire / 1000)
+        return True
+
+    def _delete(self, key, *keys):
+        deleted = 0
+        for item in (key, ) + keys:
+            deleted += self._alive(item) is not None
+            self._data.pop(_key(item), None)
+            self._expires.pop(_key(item), None)
+        return deleted
+
+    def _exists(self, key, *keys):
+        return sum(self._alive(item) is not None for item in (key, ) + keys)
+
+    def _expire(self, key, timeout):
+        if self._alive(key) is None:
+            return 0
+        self._expires[_key(key)] = time.monotonic() + timeout
+        return 1
+
+    def _incr(self, key):
+        value = int(self._alive(key) or 0) + 1
+        self._data[_key(key)] = _bytes(value)
+        return value
+
+    def _eval(self, script, keys=(), args=()):
+        # скрипты приложения повторены на питоне
+        if script == RELEASE_LOCK_SCRIPT:
+            if self._alive(keys[0]) == _bytes(args[0]):
+                return self._delete(keys[0])
+            return 0
+        if script == SET_FILM_PERSONS_SCRIPT:
+            return self._set_film_persons(keys, args)
+        if script == ADMIT_SEARCH_KEY_SCRIPT:
+            return self._admit_search_key(keys, args)
+        raise NotImplementedError('script is not supported by the fake redis')
+
+    def _admit_search_key(self, keys, args):
+        cache_key, now, limit, expires_at, expire = args
+        self._zremrangebyscore(keys[0], max=float(now))
+        if self._zscore(keys[0], cache_key) is not None or self._zcard(keys[0]) < int(limit):
+            self._zadd(keys[0], float(expires_at), cache_key)
+            self._expire(keys[0], int(expire))
+            return 1
+        return 0
+
+    def _set_film_persons(self, keys, args):
+        film_id, in_catalogue, person_prefix = (_key(arg) for arg in args[:3])
+        old = set(self._smembers(keys[0], encoding='utf-8'))
+        new = {_key(arg) for arg in args[3:]}
+        changed = []
+        for member in old - new:
+            role, person_id = member.split(':', 1)
+            self._hdel(person_prefix + person_id, f'{role}:{film_id}')
+            changed.append(_bytes(person_id))
+        for member in new - old:
+            role, person_id = member.split(':', 1)
+            self._hset(person_prefix + person_id, f'{role}:{film_id}', '1')
+            changed.append(_bytes(person_id))
+        if changed:
+            self._delete(keys[0])
+            if new:
+                self._sadd(keys[0], *new)
+        if in_catalogue == '1':
+            self._sadd(keys[1], film_id)
+        else:
+            self._srem(keys[1], film_id)
+        return changed
+
+    def _sadd(self, key, member, *members):
+        values = self._data.setdefault(_key(key), set())
+        before = len(values)
+        values.update(_bytes(item) for item in (member, ) + members)
+        return len(values) - before
+
+    def _srem(self, key, member, *members):
+        values = self._alive(key) or set()
+        before = len(values)
+        values.difference_update(_bytes(item) for item in (member, ) + members)
+        return before - len(values)
+
+    def _smembers(self, key, *, encoding=None):
+        return [_decode(item, encoding) for item in self._alive(key) or ()]
+
+    def _scard(self, key):
+        return len(self._alive(key) or ())
+
+    def _hset(self, key, field, value):
+        values = self._data.setdefault(_key(key), {})
+        created = _bytes(field) not in values
+        values[_bytes(field)] = _bytes(value)
+        return int(created)
+
+    def _hdel(self, key, field, *fields):
+        values = self._alive(key) or {}
+        return sum(values.pop(_bytes(item), None) is not None for item in (field, ) + fields)
+
+    def _hgetall(self, key, *, encoding=None):
+        return {_decode(field, encoding): _decode(value, encoding)
+                for field, value in (self._alive(key) or {}).items()}
+
+    def _zincrby(self, key, increment, member):
+        values = self._data.setdefault(_key(key), {})
+        member = _bytes(member)
+        values[member] = values.get(member, 0) + increment
+        return values[member]
+
+    def _zadd(self, key, score, member, *pairs, exist=None):
+        values = self._data.setdefault(_key(key), {})
+        added = 0
+        items = (score, member) + pairs
+        for score, member in zip(items[::2], items[1::2]):
+            added += _bytes(member) not in values
+            values[_bytes(member)] = score
+        return added
+
+    def _zscore(self, key, member):
+        return (self._alive(key) or {}).get(_bytes(member))
+
+    def _zcard(self, key):
+        return len(self._alive(key) or {})
+
+    def _zremrangebyscore(self, key, min=float('-inf'), max=float('inf'), *, exclude=None):
+        values = self._alive(key) or {}
+        removed = [member for member, score in values.items() if min <= score <= max]
+        for member in removed:
+            del values[member]
+        return len(removed)
+
+    def _zrevrange(self, key, start, stop, withscores=False, encoding=None):
+        items = sorted((self._alive(key) or {}).items(), key=lambda item: (-item[1], item[0]))
+        items = items[start:None if stop == -1 else stop + 1]
+        if withscores:
+            return [(_decode(member, encoding), score) for member, score in items]
+        return [_decode(member, encoding) for member, _ in items]
+
+    def _zremrangebyrank(self, key, start, stop):
+        values = self._alive(key) or {}
+        items = sorted(values.items(), key=lambda item: (item[1], item[0]))
+        # отрицательные индексы считаются с конца, как в редисе
+        start = max(start + len(items) if start < 0 else start, 0)
+        stop = min(stop + len(items) if stop < 0 else stop, len(items) - 1)
+        for member, _ in items[start:stop + 1]:
+            del values[member]
+        return max(0, stop - start + 1)
+
+    def _publish(self, channel, message):
+        return 0
+
+    def _ping(self):
+        return b'PONG'
+
+    def _keys(self, pattern, *, encoding=None):
+        return [key if encoding else key.encode() for key in list(self._data)
+                if self._alive(key) is not None and fnmatch.fnmatchcase(key, pattern)]
@@ -0,0 +1,356 @@
+"""
+Прогон бенчмарка: генерирует каталог, поднимает приложение поверх поддельных
+эластика и редиса и гоняет смесь запросов к v1 API дважды - с пустыми
+кешами (cold) и с прогретыми (warm). Для каждого метода печатает
+пропускную способность и p50/p95/p99, результат можно сохранить как базовый
+и сравнивать с ним следующие прогоны.
+
+Пример: python -m bench --films 100000 --requests 20000 --save-baseline bench/baseline.json
+"""
+import argparse
+import asyncio
+import bisect
+import random
+import sys
+import time
+from collections import defaultdict
+from itertools import accumulate
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+import orjson
+
+from bench.catalogue import Catalogue
+from bench.fake_es import FakeElasticsearch, FakeIndex
+from bench.fake_redis import FakeRedis
+from bench.schema import load_mappings
+
+# доля запросов каждого вида в смеси
+MIX = {
+    'film_details': 30,
+    'films': 14,
+    'films_filtered': 6,
+    'film_facets': 4,
+    'film_mget': 4,
+    'film_search': 15,
+    'film_suggest': 8,
+    'person_details': 10,
+    'person_search': 8,
+    'person_suggest': 4,
+    'person_films': 7,
+    'genre_details': 5,
+    'genres': 5,
+}
+SORTS = [None, '-imdb_rating', '+imdb_rating']
+# доля поисковых запросов, которые набираются по буквам (typeahead)
+TYPEAHEAD_SHARE = 0.3
+PAGE_SIZES = [20, 50]
+# сколько id фильмов в одном _mget, как в списке фильмов персоны
+MGET_SIZES = [5, 20]
+
+# вид запроса, путь, query string и JSON-тело (пустое - GET)
+Request = Tuple[str, str, str, bytes]
+
+
+class Zipf:
+    """
+    Выбор элементов по закону Ципфа: первые элементы популярнее,
+    как популярные фильмы и персоны в настоящем трафике.
+    """
+
+    def __init__(self, items: List, rnd: random.Random, exponent: float = 1.0):
+        self.items = items
+        self.rnd = rnd
+        self.weights = list(accumulate(1 / (rank + 1) ** exponent for rank in range(len(items))))
+
+    def __call__(self):
+        position = bisect.bisect(self.weights, self.rnd.random() * self.weights[-1])
+        return self.items[min(position, len(self.items) - 1)]
+
+
+def make_requests(catalogue: Catalogue, count: int, seed: int) -> List[Request]:
+    """
+    Последовательность запросов (вид, путь, query string, тело) с одинаковым
+    seed одна и та же, поэтому прогоны можно сравнивать.
+    """
+    rnd = random.Random(seed)
+    films = Zipf(catalogue.docs['movies'], rnd)
+    persons = Zipf(catalogue.docs['persons'], rnd)
+    genres = Zipf(catalogue.docs['genres'], rnd)
+    words = Zipf(catalogue.words, rnd)
+    pages = Zipf(list(range(1, 11)), rnd, exponent=1.5)
+    kinds = rnd.choices(list(MIX), weights=list(MIX.values()), k=count)
+
+    requests = []
+    for kind in kinds:
+        params = {}
+        body = b''
+        if kind == 'film_details':
+            path = f"/v1/film/{films()['id']}"
+        elif kind == 'films':
+            path = '/v1/film/'
+            params = {'page[number]': pages(), 'page[size]': rnd.choice(PAGE_SIZES)}
+            sort = rnd.choice(SORTS)
+            if sort:
+                params['sort'] = sort
+        elif kind == 'films_filtered':
+            path = '/v1/film/'
+            params = {'page[number]': pages(), 'page[size]': rnd.choice(PAGE_SIZES)}
+            film = films()
+            if rnd.random() < 0.3 and film['genres'] and film['actors']:
+                # фильтры объединяются по И: жанр и актёр одного фильма, чтобы выдача была непустой
+                params['filter[genre]'] = rnd.choice(film['genres'])['id']
+                params['filter[actor]'] = rnd.choice(film['actors'])['id']
+                params['page[number]'] = 1
+            else:
+                params['filter[genre]'] = genres()['id']
+        elif kind == 'film_mget':
+            path = '/v1/film/_mget'
+            body = orjson.dumps({'ids': [films()['id'] for _ in range(rnd.choice(MGET_SIZES))]})
+        elif kind == 'film_facets':
+            path = '/v1/film/facets'
+            if rnd.random() < 0.5:
+                params = {'filter[genre]': genres()['id']}
+        elif kind == 'film_search':
+            path = '/v1/film/search/'
+            if rnd.random() < TYPEAHEAD_SHARE:
+                params = {'query': words()[:rnd.randint(1, 4)]}
+            else:
+                params = {'query': ' '.join(words() for _ in range(rnd.randint(1, 2)))}
+        elif kind == 'film_suggest':
+            path = '/v1/film/suggest'
+            params = {'prefix': films()['title'][:rnd.randint(1, 6)]}
+        elif kind == 'person_details':
+            path = f"/v1/person/{persons()['id']}"
+        elif kind == 'person_suggest':
+            path = '/v1/person/suggest'
+            params = {'prefix': persons()['name'][:rnd.randint(1, 6)]}
+        elif kind == 'person_films':
+            path = f"/v1/person/{persons()['id']}/film"
+        elif kind == 'person_search':
+            path = '/v1/person/search/'
+            query = words()
+            if rnd.random() < TYPEAHEAD_SHARE:
+                query = query[:rnd.randint(1, 4)]
+            params = {'query': query, 'page[size]': rnd.choice(PAGE_SIZES)}
+        elif kind == 'genre_details':
+            path = f"/v1/genre/{genres()['id']}"
+        else:
+            path = '/v1/genre/'
+        requests.append((kind, path, urlencode(params), body))
+    return requests
+
+
+async def _call(app, path: str, query: str, body: bytes = b'') -> int:
+    headers = [(b'host', b'localhost')]
+    if body:
+        headers.append((b'content-type', b'application/json'))
+    scope = {
+        'type': 'http',
+        'http_version': '1.1',
+        'method': 'POST' if body else 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'root_path': '',
+        'query_string': query.encode(),
+        'headers': headers,
+        'client': None,
+        'server': None,
+    }
+    status = None
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await app(scope, receive, send)
+    return status
+
+
+async def drive(app, requests: List[Request], concurrency: int) -> Tuple[Dict[str, List[float]], Dict[str, int], float]:
+    """
+    Выполняет запросы concurrency параллельными клиентами.
+    Возвращает время ответов по методам, количество ошибок по методам
+    и общее время прогона.
+    """
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    queue = iter(requests)
+
+    async def client():
+        for kind, path, query, body in queue:
+            started = time.perf_counter()
+            try:
+                status = await _call(app, path, query, body)
+            except Exception:
+                status = 500
+            latencies[kind].append(time.perf_counter() - started)
+            # 404 - нормальный ответ для пустой страницы или поиска
+            if status >= 500:
+                errors[kind] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+
+def percentile(values: List[float], percent: float) -> float:
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1, int(round(percent / 100 * len(values) + 0.5)) - 1))]
+
+
+def summarize(latencies: Dict[str, List[float]], errors: Dict[str, int], elapsed: float) -> Dict[str, dict]:
+    summary = {}
+    everything = [value for values in latencies.values() for value in values]
+    for kind, values in sorted(latencies.items()) + [('total', everything)]:
+        summary[kind] = {
+            'requests': len(values),
+            'rps': len(values) / elapsed,
+            'p50_ms': percentile(values, 50) * 1000,
+            'p95_ms': percentile(values, 95) * 1000,
+            'p99_ms': percentile(values, 99) * 1000,
+            'errors': sum(errors.values()) if kind == 'total' else errors.get(kind, 0),
+        }
+    return summary
+
+
+def reset_caches(redis: FakeRedis):
+    """
+    Сбрасывает все кеши приложения: редис, L1 в памяти процесса
+    и статистику выбора стратегии выборки из эластика.
+    """
+    from cache import memory
+    from services import fetch
+
+    redis.flushall()
+    for cache in memory._memory_caches.values():
+        cache.clear()
+    fetch._planners.clear()
+
+
+def print_report(name: str, run: dict, baseline: Optional[dict] = None):
+    print(f"\n{name}: {run['elapsed']:.2f}s, es calls {run['es_calls']}, redis calls {run['redis_calls']}")
+    header = f"{'endpoint':<16}{'requests':>9}{'rps':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}"
+    print(header + ('   p95 vs baseline' if baseline else ''))
+    for kind, stats in run['endpoints'].items():
+        line = (f"{kind:<16}{stats['requests']:>9}{stats['rps']:>10.1f}{stats['p50_ms']:>9.2f}"
+                f"{stats['p95_ms']:>9.2f}{stats['p99_ms']:>9.2f}{stats['errors']:>8}")
+        base = (baseline or {}).get('endpoints', {}).get(kind)
+        if base and base['p95_ms']:
+            line += f"   {(stats['p95_ms'] / base['p95_ms'] - 1) * 100:+.1f}%"
+        print(line)
+
+
+def regressions(result: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    Методы, у которых p95 вырос больше чем на tolerance относительно базового прогона.
+    """
+    found = []
+    for name, run in result['runs'].items():
+        for kind, stats in run['endpoints'].items():
+            base = baseline['runs'].get(name, {}).get('endpoints', {}).get(kind)
+            if base and stats['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+                found.append(f"{name}/{kind}: p95 {base['p95_ms']:.2f}ms -> {stats['p95_ms']:.2f}ms")
+    return found
+
+
+async def bench(args: argparse.Namespace) -> dict:
+    import main
+    from core import config, metrics
+    from db import elastic, redis
+    from services import prefix_index
+    from services.person_films import get_person_films_index
+
+    started = time.perf_counter()
+    mappings = load_mappings()
+    catalogue = Catalogue(mappings, films=args.films, persons=args.persons, genres=args.genres, seed=args.seed)
+    fake_es = FakeElasticsearch({index: FakeIndex(index, docs, mappings[index])
+                                 for index, docs in catalogue.docs.items()},
+                                latency=args.es_latency_ms / 1000)
+    fake_redis = FakeRedis(latency=args.redis_latency_ms / 1000)
+    # то же, что делает startup приложения, без фоновых задач и прогрева;
+    # индексы в памяти и в редисе строятся в prepare
+    redis.redis, elastic.es = fake_redis, fake_es
+    if config.METRICS_ENABLED:
+        redis.redis = metrics.InstrumentedRedis(redis.redis)
+        elastic.es = metrics.InstrumentedElasticsearch(elastic.es)
+    requests = make_requests(catalogue, args.requests, args.seed)
+    print(f'catalogue: {args.films} films, {args.persons} persons, {args.genres} genres, '
+          f'{len(requests)} requests, generated in {time.perf_counter() - started:.1f}s')
+
+    async def prepare():
+        reset_caches(fake_redis)
+        if config.PERSON_FILMS_INDEX_ENABLED:
+            await get_person_films_index(redis.redis).rebuild(elastic.es)
+        if config.SEARCH_PREFIX_INDEX_ENABLED:
+            for name in prefix_index.INDEXES:
+                await prefix_index.get_prefix_index(name).refresh(elastic.es)
+
+    # холостой прогон строит индексы поддельного эластика и запоминает
+    # его ответы, чтобы в замеры попадала только работа приложения
+    await prepare()
+    await drive(main.app, requests, args.concurrency)
+
+    result = {'params': {key: value for key, value in vars(args).items()
+                         if key not in ('save_baseline', 'compare', 'tolerance')},
+              'runs': {}}
+    await prepare()
+    for name in ('cold', 'warm'):
+        fake_es.calls.clear()
+        fake_redis.calls.clear()
+        latencies, errors, elapsed = await drive(main.app, requests, args.concurrency)
+        result['runs'][name] = {
+            'elapsed': elapsed,
+            'es_calls': sum(fake_es.calls.values()),
+            'redis_calls': sum(fake_redis.calls.values()),
+            'endpoints': summarize(latencies, errors, elapsed),
+        }
+    return result
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='python -m bench', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--films', type=int, default=10000)
+    parser.add_argument('--persons', type=int, default=None, help='по умолчанию - films / 2')
+    parser.add_argument('--genres', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--requests', type=int, default=5000, help='запросов в каждом прогоне')
+    parser.add_argument('--concurrency', type=int, default=32, help='параллельных клиентов')
+    parser.add_argument('--es-latency-ms', type=float, default=2.0, help='задержка каждого запроса в эластик')
+    parser.add_argument('--redis-latency-ms', type=float, default=0.2, help='задержка каждого round-trip в редис')
+    parser.add_argument('--save-baseline', type=Path, help='сохранить результат в json как базовый')
+    parser.add_argument('--compare', type=Path, help='сравнить с сохранённым базовым результатом')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='допустимый рост p95 относительно базового, доля (по умолчанию 0.1)')
+    args = parser.parse_args(argv)
+    if args.persons is None:
+        args.persons = max(1, args.films // 2)
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    result = asyncio.run(bench(args))
+    baseline = orjson.loads(args.compare.read_bytes()) if args.compare else None
+    for name, run in result['runs'].items():
+        print_report(name, run, baseline['runs'].get(name) if baseline else None)
+    if args.save_baseline:
+        args.save_baseline.write_bytes(orjson.dumps(result, option=orjson.OPT_INDENT_2))
+        print(f'\nbaseline saved to {args.save_baseline}')
+    if baseline:
+        found = regressions(result, baseline, args.tolerance)
+        if found:
+            print('\nregressions:\n  ' + '\n  '.join(found))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,24 @@
+import re
+from pathlib import Path
+from typing import Dict
+
+import orjson
+
+from bench import ROOT_DIR
+
+SCHEMAS_SCRIPT = ROOT_DIR / 'docker' / 'es' / 'create_es_schemas.sh'
+
+# curl -XPUT http://host:9200/<индекс> ... -d'<json>'
+_CREATE_INDEX = re.compile(r"curl\s+-XPUT\s+\S+/(?P<index>\w+)\s.*?-d\s*'(?P<body>.*?)'", re.S)
+
+
+def load_mappings(path: Path = SCHEMAS_SCRIPT) -> Dict[str, dict]:
+    """
+    Возвращает маппинги индексов (index -> mappings.properties) из скрипта
+    создания схем, чтобы бенчмарк работал с теми же полями, что и эластик.
+    """
+    mappings = {}
+    for match in _CREATE_INDEX.finditer(path.read_text()):
+        body = orjson.loads(match['body'])
+        mappings[match['index']] = body['mappings']['properties']
+    return mappings
@@ -0,0 +1,94 @@
+"""
+Стоимость разбора и сериализации моделей в пересчёте на один объект
+для страницы из 1000 фильмов: с валидацией pydantic и через models.fast.
+
+Запуск: python -m bench.serialization [--page-size 1000] [--repeat 20]
+"""
+import argparse
+import time
+from typing import Callable, List
+
+import orjson
+
+from bench.catalogue import Catalogue
+from bench.schema import load_mappings
+from api.v1.models import FilmShort as ApiFilmShort, PaginatedFilmShortList
+from models.fast import construct, dumps
+from models.film import Film, FilmShort
+
+
+def _best(fn: Callable[[], object], repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def _validated_page(films: List[FilmShort]) -> bytes:
+    page = PaginatedFilmShortList(
+        page_number=1,
+        count=len(films),
+        total_pages=1,
+        result=[ApiFilmShort(id=film.id, title=film.title, imdb_rating=film.imdb_rating) for film in films],
+    )
+    return orjson.dumps(page.dict())
+
+
+def _fast_page(films: List[FilmShort]) -> bytes:
+    page = PaginatedFilmShortList.construct(
+        page_number=1,
+        count=len(films),
+        total_pages=1,
+        next_cursor=None,
+        result=[ApiFilmShort.construct(id=film.id, title=film.title, imdb_rating=film.imdb_rating)
+                for film in films],
+    )
+    return dumps(page)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m bench.serialization', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    size = args.page_size
+    catalogue = Catalogue(load_mappings(), films=size, persons=max(1, size // 2), genres=30)
+    docs = catalogue.docs['movies']
+    films = [Film(**doc) for doc in docs]
+    shorts = [FilmShort(**doc) for doc in docs]
+    cached_films = [film.json() for film in films]
+    cached_shorts = [film.json() for film in shorts]
+
+    cases = [
+        ('film: es -> model', lambda: [Film(**doc) for doc in docs],
+         lambda: [construct(Film, doc) for doc in docs]),
+        ('film: cache -> model', lambda: [Film.parse_raw(data) for data in cached_films],
+         lambda: [construct(Film, orjson.loads(data)) for data in cached_films]),
+        ('film: model -> cache', lambda: [film.json() for film in films],
+         lambda: [dumps(film) for film in films]),
+        ('short: cache -> model', lambda: [FilmShort.parse_raw(data) for data in cached_shorts],
+         lambda: [construct(FilmShort, orjson.loads(data)) for data in cached_shorts]),
+        ('short: model -> page json', lambda: _validated_page(shorts), lambda: _fast_page(shorts)),
+    ]
+    assert orjson.loads(_validated_page(shorts)) == orjson.loads(_fast_page(shorts))
+
+    print(f'{size} items per page, best of {args.repeat}, microseconds per item')
+    print(f"{'step':<28}{'pydantic':>10}{'fast':>10}{'speedup':>10}")
+    total_slow = total_fast = 0.0
+    for name, slow, fast in cases:
+        slow_us = _best(slow, args.repeat) / size * 1e6
+        fast_us = _best(fast, args.repeat) / size * 1e6
+        if name.startswith('short'):
+            total_slow += slow_us
+            total_fast += fast_us
+        print(f'{name:<28}{slow_us:>10.2f}{fast_us:>10.2f}{slow_us / fast_us:>9.1f}x')
+    # страница списка фильмов из кеша: разбор кратких форм и сборка ответа
+    print(f"{'short list page total':<28}{total_slow:>10.2f}{total_fast:>10.2f}{total_slow / total_fast:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
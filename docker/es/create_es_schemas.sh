@@ -57,6 +57,10 @@ curl -XPUT http://127.0.0.1:9200/movies -H 'Content-Type: application/json' -d'
         "fields": {
           "raw": { 
             "type":  "keyword"
+          },
+          "suggest": {
+            "type": "completion",
+            "analyzer": "simple"
           }
         }
       },
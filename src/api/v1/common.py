@@ -1,17 +1,50 @@
-from typing import Optional
+from typing import Any, AsyncIterator, Iterable, List, Optional, Tuple
+from uuid import UUID
 
+import orjson
 from fastapi import Query
 
+from services.cursor import MAX_RESULT_WINDOW
+
 DEFAULT_PAGE_SIZE = 1000
+# страницы запрашиваются с одним лишним документом, и вместе с ним
+# размер не должен выходить за index.max_result_window
+MAX_PAGE_SIZE = MAX_RESULT_WINDOW - 1
 
 
 async def pagination(pagesize: Optional[int] = Query(DEFAULT_PAGE_SIZE,
                                                      alias='page[size]',
-                                                     title='Количество объектов на одной странице'),
+                                                     title='Количество объектов на одной странице',
+                                                     ge=1,
+                                                     le=MAX_PAGE_SIZE),
                      pagenumber: Optional[int] = Query(1,
                                                        alias='page[number]',
-                                                       title='Номер страницы')):
+                                                       title='Номер страницы'),
+                     cursor: Optional[str] = Query(None,
+                                                   alias='page[cursor]',
+                                                   title='Курсор страницы',
+                                                   description='Значение next_cursor предыдущей страницы. '
+                                                               'Если передан, page[number] не учитывается')):
     """
     Добавляет пагинацию в метод API.
     """
-    return {'pagesize': pagesize, 'pagenumber': pagenumber}
+    return {'pagesize': pagesize, 'pagenumber': pagenumber, 'cursor': cursor}
+
+
+async def ndjson_lines(batches: AsyncIterator[List[dict]]) -> AsyncIterator[bytes]:
+    """
+    Превращает пачки документов в NDJSON: по одному JSON-объекту на строку,
+    одна пачка - один кусок ответа.
+    """
+    async for docs in batches:
+        yield b''.join(orjson.dumps(doc) + b'\n' for doc in docs)
+
+
+def in_request_order(ids: List[UUID], objects: Iterable[Any]) -> Tuple[List[Optional[Any]], List[UUID]]:
+    """
+    Раскладывает найденные объекты в порядке запрошенных id (id могут повторяться),
+    на месте ненайденных - None. Вторым значением возвращает ненайденные id.
+    """
+    found = {obj.id: obj for obj in objects if obj}
+    missing = [obj_id for obj_id in dict.fromkeys(ids) if obj_id not in found]
+    return [found.get(obj_id) for obj_id in ids], missing
@@ -1,79 +1,178 @@
+import asyncio
 from uuid import UUID
 from typing import List, Optional
 
 from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from fastapi import status
+from fastapi.responses import StreamingResponse
 
 from services.film import FilmService, get_film_service, SortBy, FilterBy
+from services.genre import GenreService, get_genre_service
+from services.person import PersonService, get_person_service
+from services.cursor import InvalidCursor
 from api.v1.models import FilmShort, Film, PaginatedFilmShortList, FilmShortList, Genre, Actor, Writer, Director
+from api.v1.models import FilmFacets, GenreFacet, PersonFacet, RatingFacet, FilmMget, IdList
 from cache.redis import cache_response
-from api.v1.common import pagination
+from core import config
+from api.v1.common import pagination, ndjson_lines, in_request_order
 
 router = APIRouter()
 
 
+def _film_response(film) -> Film:
+    """
+    Ответ API по фильму из сервиса.
+    """
+    return Film.construct(id=film.id,
+                          title=film.title,
+                          description=film.description,
+                          imdb_rating=film.imdb_rating,
+                          genres=[Genre.construct(id=genre.id, name=genre.name) for genre in film.genres],
+                          actors=[Actor.construct(id=actor.id, name=actor.name) for actor in film.actors],
+                          writers=[Writer.construct(id=writer.id, name=writer.name) for writer in film.writers],
+                          directors=[Director.construct(id=director.id, name=director.name)
+                                     for director in film.directors],
+                          )
+
+
+@router.get('/export', response_class=StreamingResponse)
+async def films_export(after: Optional[UUID] = Query(None,
+                                                     description='id последнего полученного объекта, '
+                                                                 'выгрузка продолжится со следующего'),
+                       film_service: FilmService = Depends(get_film_service)) -> StreamingResponse:
+    """
+    Потоковая выгрузка всего каталога в формате NDJSON, отсортированного по id.
+    """
+    return StreamingResponse(ndjson_lines(film_service.export(after)), media_type='application/x-ndjson')
+
+
+@router.get('/suggest', response_model=FilmShortList)
+@cache_response(ttl=config.RESPONSE_CACHE_TTL, query_args=['prefix', 'size'], search_args=['prefix'])
+async def film_suggest(prefix: str = Query(..., min_length=1, description='Начало названия фильма'),
+                       size: int = Query(config.SUGGEST_SIZE, ge=1, le=config.SUGGEST_MAX_SIZE),
+                       film_service: FilmService = Depends(get_film_service)) -> List[FilmShort]:
+    """
+    Автодополнение названий фильмов по началу названия.
+    """
+    films = await film_service.suggest(prefix, size)
+    if not films:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail='films not found')
+
+    return FilmShortList.construct(
+        __root__=[
+            FilmShort.construct(id=film.id,
+                                title=film.title,
+                                imdb_rating=film.imdb_rating) for film in films]
+    )
+
+
+@router.post('/_mget', response_model=FilmMget)
+async def films_mget(body: IdList, film_service: FilmService = Depends(get_film_service)) -> FilmMget:
+    """
+    Фильмы по списку id одним запросом: из кеша пачкой, недостающие - одним mget в эластик.
+    Ненайденные id не приводят к ошибке, а перечисляются в missing.
+    """
+    films, missing = in_request_order(body.ids, await film_service.get_by_ids(body.ids))
+    return FilmMget.construct(result=[_film_response(film) if film else None for film in films],
+                              missing=missing)
+
+
+@router.get('/facets', response_model=FilmFacets)
+@cache_response(ttl=config.RESPONSE_CACHE_TTL)
+async def film_facets(request: Request,
+                      film_service: FilmService = Depends(get_film_service),
+                      genre_service: GenreService = Depends(get_genre_service),
+                      person_service: PersonService = Depends(get_person_service)) -> FilmFacets:
+    """
+    Количество фильмов по жанрам, интервалам рейтинга, актёрам и режиссёрам
+    среди фильмов, подходящих под фильтры filter[...].
+    """
+    filters = FilterBy.from_query_params(request.query_params)
+    facets = await film_service.facets(filters)
+    # имена жанров и персон берутся из кеша объектов
+    genres, persons = await asyncio.gather(
+        genre_service.get_by_ids(list(facets.genres)),
+        person_service.get_by_ids(list(dict.fromkeys([*facets.actors, *facets.directors]))),
+    )
+    genres = {genre.id: genre for genre in genres if genre}
+    persons = {person.id: person for person in persons if person}
+    interval = config.FACETS_RATING_INTERVAL
+
+    return FilmFacets.construct(
+        total=facets.total,
+        genres=[GenreFacet.construct(id=genre_id, name=genres[genre_id].name, count=count)
+                for genre_id, count in facets.genres.items() if genre_id in genres],
+        imdb_rating=[RatingFacet.construct(from_rating=rating, to_rating=rating + interval, count=count)
+                     for rating, count in facets.imdb_rating.items()],
+        actors=[PersonFacet.construct(id=person_id, name=persons[person_id].name, count=count)
+                for person_id, count in facets.actors.items() if person_id in persons],
+        directors=[PersonFacet.construct(id=person_id, name=persons[person_id].name, count=count)
+                   for person_id, count in facets.directors.items() if person_id in persons],
+    )
+
+
 @router.get('/{film_id}', response_model=Film)
-@cache_response(ttl=60 * 5, query_args=['film_id'])
+@cache_response(ttl=config.RESPONSE_CACHE_TTL, query_args=['film_id'])
 async def film_details(film_id: UUID, film_service: FilmService = Depends(get_film_service)) -> Film:
     film = await film_service.get_by_id(film_id)
     if not film:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail='film not found')
-    return Film(id=film.id,
-                title=film.title,
-                description=film.description,
-                imdb_rating=film.imdb_rating,
-                genres=[Genre(**genre.dict()) for genre in film.genres],
-                actors=[Actor(**actor.dict()) for actor in film.actors],
-                writers=[Writer(**writer.dict()) for writer in film.writers],
-                directors=[Director(**director.dict()) for director in film.directors],
-                )
+    return _film_response(film)
 
 
 @router.get('/', response_model=PaginatedFilmShortList)
-@cache_response(ttl=60 * 5, query_args=['sort'])
+@cache_response(ttl=config.RESPONSE_CACHE_TTL, query_args=['sort'])
 async def films(request: Request,
                 film_service: FilmService = Depends(get_film_service),
                 sort: Optional[str] = Query(
                     None, description='Сортировка по аттрибуту фильма', regex='^[-+].+$'),
                 pagination: dict = Depends(pagination)) -> List[FilmShort]:
     sort_by = SortBy.from_query(sort)
-    filter_by = FilterBy.from_query_params(request.query_params)
+    filters = FilterBy.from_query_params(request.query_params)
     page_number = pagination['pagenumber']
     page_size = pagination['pagesize']
 
-    films_total, films = await film_service.list(page_number, page_size, sort_by, filter_by)
+    try:
+        films_total, films, next_cursor = await film_service.list(page_number, page_size, sort_by, filters,
+                                                                  cursor=pagination['cursor'], short=True)
+    except InvalidCursor:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail='invalid page cursor')
     if not films:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail='films not found')
 
-    response = PaginatedFilmShortList(
+    response = PaginatedFilmShortList.construct(
         page_number=page_number,
         count=len(films),
-        total_pages=(films_total // page_size) + 1,
+        total_pages=(films_total.value // page_size) + 1,
+        total_pages_at_least=films_total.at_least,
+        next_cursor=next_cursor,
         result=[
-            FilmShort(id=film.id,
-                      title=film.title,
-                      imdb_rating=film.imdb_rating) for film in films],
+            FilmShort.construct(id=film.id,
+                                title=film.title,
+                                imdb_rating=film.imdb_rating) for film in films],
     )
     return response
 
 
 @router.get('/search/', response_model=FilmShortList)
-@cache_response(ttl=60 * 5, query_args=['query'])
+@cache_response(ttl=config.RESPONSE_CACHE_TTL, query_args=['query'], search_args=['query'])
 async def film_search(request: Request,
                       query: str,
                       film_service: FilmService = Depends(get_film_service)) -> List[FilmShort]:
 
-    films = await film_service.search(query)
+    films = await film_service.search(query, short=True)
     if not films:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail='films not found')
 
-    response = FilmShortList(
+    response = FilmShortList.construct(
         __root__=[
-            FilmShort(id=film.id,
-                      title=film.title,
-                      imdb_rating=film.imdb_rating) for film in films]
+            FilmShort.construct(id=film.id,
+                                title=film.title,
+                                imdb_rating=film.imdb_rating) for film in films]
     )
     return response
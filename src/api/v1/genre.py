@@ -1,48 +1,81 @@
 from uuid import UUID
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from fastapi import status
+from fastapi.responses import StreamingResponse
 
 from services.genre import GenreService, get_genre_service
-from api.v1.models import Genre, PaginatedGenreList
-from api.v1.common import pagination
+from services.cursor import InvalidCursor
+from api.v1.models import Genre, PaginatedGenreList, GenreMget, IdList
+from api.v1.common import pagination, ndjson_lines, in_request_order
 from cache.redis import cache_response
+from core import config
 
 router = APIRouter()
 
 
+@router.get('/export', response_class=StreamingResponse)
+async def genres_export(after: Optional[UUID] = Query(None,
+                                                      description='id последнего полученного объекта, '
+                                                                  'выгрузка продолжится со следующего'),
+                        genre_service: GenreService = Depends(get_genre_service)) -> StreamingResponse:
+    """
+    Потоковая выгрузка всего каталога в формате NDJSON, отсортированного по id.
+    """
+    return StreamingResponse(ndjson_lines(genre_service.export(after)), media_type='application/x-ndjson')
+
+
+@router.post('/_mget', response_model=GenreMget)
+async def genres_mget(body: IdList, genre_service: GenreService = Depends(get_genre_service)) -> GenreMget:
+    """
+    Жанры по списку id одним запросом: из кеша пачкой, недостающие - одним mget в эластик.
+    Ненайденные id не приводят к ошибке, а перечисляются в missing.
+    """
+    genres, missing = in_request_order(body.ids, await genre_service.get_by_ids(body.ids))
+    return GenreMget.construct(result=[Genre.construct(id=genre.id, name=genre.name) if genre else None
+                                       for genre in genres],
+                               missing=missing)
+
+
 @router.get('/{genre_id}', response_model=Genre)
-@cache_response(ttl=60 * 5, query_args=['genre_id'])
+@cache_response(ttl=config.RESPONSE_CACHE_TTL, query_args=['genre_id'])
 async def film_details(genre_id: UUID, genre_service: GenreService = Depends(get_genre_service)) -> Genre:
     genre = await genre_service.get_by_id(genre_id)
     if not genre:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail='genre not found')
-    return Genre(id=genre.id,
-                 name=genre.name
-                 )
+    return Genre.construct(id=genre.id,
+                           name=genre.name
+                           )
 
 
 @router.get('/', response_model=PaginatedGenreList)
-@cache_response(ttl=60 * 5, query_args=['sort'])
+@cache_response(ttl=config.RESPONSE_CACHE_TTL, query_args=['sort'])
 async def films(request: Request,
                 genre_service: GenreService = Depends(get_genre_service),
                 pagination: dict = Depends(pagination)) -> List[Genre]:
     page_number = pagination['pagenumber']
     page_size = pagination['pagesize']
 
-    genres_total, genres = await genre_service.list(page_number, page_size)
+    try:
+        genres_total, genres, next_cursor = await genre_service.list(page_number, page_size,
+                                                                     cursor=pagination['cursor'])
+    except InvalidCursor:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail='invalid page cursor')
     if not genres:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail='genres not found')
 
-    response = PaginatedGenreList(
+    response = PaginatedGenreList.construct(
         page_number=page_number,
         count=len(genres),
-        total_pages=(genres_total // page_size) + 1,
+        total_pages=(genres_total.value // page_size) + 1,
+        total_pages_at_least=genres_total.at_least,
+        next_cursor=next_cursor,
         result=[
-            Genre(id=genre.id,
-                  name=genre.name) for genre in genres],
+            Genre.construct(id=genre.id,
+                            name=genre.name) for genre in genres],
     )
     return response
@@ -3,6 +3,8 @@ from uuid import UUID
 
 from pydantic import BaseModel, Field
 
+from core import config
+
 """
 Здесь находятся модели, которые сериализются в ответ API
 """
@@ -15,6 +17,10 @@ class PaginatedList(BaseModel):
         ..., description="Количество объектов на текущей странице")
     total_pages: int = Field(
         ..., description="Количество страниц в выдаче")
+    total_pages_at_least: bool = Field(
+        False, description="Страниц может быть больше total_pages: количество посчитано не до конца")
+    next_cursor: Optional[str] = Field(
+        None, description="Курсор следующей страницы для параметра page[cursor]")
 
 
 class Genre(BaseModel):
@@ -62,6 +68,10 @@ class PersonList(BaseModel):
     __root__: List[Person]
 
 
+class PersonShortList(BaseModel):
+    __root__: List[PersonShort]
+
+
 class FilmShort(BaseModel):
     id: UUID
     title: str = Field(
@@ -89,3 +99,58 @@ class FilmShortList(BaseModel):
 
 class PaginatedFilmShortList(PaginatedList):
     result: List[FilmShort]
+
+
+class GenreFacet(Genre):
+    count: int = Field(
+        ..., description="Количество фильмов с жанром")
+
+
+class PersonFacet(PersonShort):
+    count: int = Field(
+        ..., description="Количество фильмов с персоной")
+
+
+class RatingFacet(BaseModel):
+    from_rating: float = Field(
+        ..., description="Нижняя граница интервала рейтинга, включительно")
+    to_rating: float = Field(
+        ..., description="Верхняя граница интервала рейтинга, не включительно")
+    count: int = Field(
+        ..., description="Количество фильмов с рейтингом в интервале")
+
+
+class FilmFacets(BaseModel):
+    total: int = Field(
+        ..., description="Количество фильмов, подходящих под фильтры")
+    genres: List[GenreFacet]
+    imdb_rating: List[RatingFacet]
+    actors: List[PersonFacet] = Field(
+        ..., description="Актёры с наибольшим количеством фильмов")
+    directors: List[PersonFacet] = Field(
+        ..., description="Режиссёры с наибольшим количеством фильмов")
+
+
+class IdList(BaseModel):
+    ids: List[UUID] = Field(
+        ..., min_items=1, max_items=config.MGET_MAX_IDS, description="Список id объектов")
+
+
+class MgetResult(BaseModel):
+    missing: List[UUID] = Field(
+        ..., description="Id, для которых объекты не найдены")
+
+
+class FilmMget(MgetResult):
+    result: List[Optional[Film]] = Field(
+        ..., description="Фильмы в порядке запрошенных id, null - фильм не найден")
+
+
+class PersonMget(MgetResult):
+    result: List[Optional[Person]] = Field(
+        ..., description="Персоны в порядке запрошенных id, null - персона не найдена")
+
+
+class GenreMget(MgetResult):
+    result: List[Optional[Genre]] = Field(
+        ..., description="Жанры в порядке запрошенных id, null - жанр не найден")
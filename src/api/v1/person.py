@@ -1,21 +1,83 @@
 from uuid import UUID
-from typing import List
+from typing import Dict, List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from fastapi import status
+from fastapi.responses import StreamingResponse
 
 from services.person import PersonService, get_person_service
 from services.film import FilmService, Roles, get_film_service
-from api.v1.common import pagination
+from services.cursor import InvalidCursor
+from api.v1.common import pagination, ndjson_lines, in_request_order
 from api.v1.models import PersonList, Person, PaginatedPersonShortList, PersonShort, FilmShortList, FilmShort
+from api.v1.models import IdList, PersonMget, PersonShortList
 from cache.redis import cache_response
+from core import config
 
 
 router = APIRouter()
 
 
+def _person_response(person, film_ids: Dict[str, List[UUID]]) -> Person:
+    """
+    Ответ API по персоне из сервиса и id её фильмов в разрезе по ролям.
+    """
+    return Person.construct(id=person.id,
+                            name=person.name,
+                            actor=film_ids[Roles.ACTOR.value],
+                            writer=film_ids[Roles.WRITER.value],
+                            director=film_ids[Roles.DIRECTOR.value],
+                            )
+
+
+@router.get('/export', response_class=StreamingResponse)
+async def persons_export(after: Optional[UUID] = Query(None,
+                                                       description='id последнего полученного объекта, '
+                                                                   'выгрузка продолжится со следующего'),
+                         person_service: PersonService = Depends(get_person_service)) -> StreamingResponse:
+    """
+    Потоковая выгрузка всего каталога в формате NDJSON, отсортированного по id.
+    """
+    return StreamingResponse(ndjson_lines(person_service.export(after)), media_type='application/x-ndjson')
+
+
+@router.post('/_mget', response_model=PersonMget)
+async def persons_mget(body: IdList,
+                       person_service: PersonService = Depends(get_person_service),
+                       film_service: FilmService = Depends(get_film_service)) -> PersonMget:
+    """
+    Персоны по списку id одним запросом: из кеша пачкой, недостающие - одним mget в эластик,
+    id фильмов всех персон - тоже одной пачкой.
+    Ненайденные id не приводят к ошибке, а перечисляются в missing.
+    """
+    persons, missing = in_request_order(body.ids, await person_service.get_by_ids(body.ids))
+    person_ids = list(dict.fromkeys(person.id for person in persons if person))
+    film_ids_by_person = await film_service.get_ids_by_person_ids(person_ids)
+    return PersonMget.construct(result=[_person_response(person, film_ids_by_person[person.id]) if person else None
+                                        for person in persons],
+                                missing=missing)
+
+
+@router.get('/suggest', response_model=PersonShortList)
+@cache_response(ttl=config.RESPONSE_CACHE_TTL, query_args=['prefix', 'size'], search_args=['prefix'])
+async def person_suggest(prefix: str = Query(..., min_length=1, description='Начало имени персоны'),
+                         size: int = Query(config.SUGGEST_SIZE, ge=1, le=config.SUGGEST_MAX_SIZE),
+                         person_service: PersonService = Depends(get_person_service)) -> PersonShortList:
+    """
+    Автодополнение имён персон по началу любого слова имени.
+    """
+    persons = await person_service.suggest(prefix, size)
+    if not persons:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail='persons not found')
+
+    return PersonShortList.construct(
+        __root__=[PersonShort.construct(id=person.id, name=person.name) for person in persons]
+    )
+
+
 @router.get('/{person_id}', response_model=Person)
-@cache_response(ttl=60 * 5, query_args=['person_id'])
+@cache_response(ttl=config.RESPONSE_CACHE_TTL, query_args=['person_id'])
 async def person_details(person_id: UUID,
                          person_service: PersonService = Depends(
                              get_person_service),
@@ -24,20 +86,13 @@ async def person_details(person_id: UUID,
     if not person:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail='person not found')
-    person_films = await film_service.get_by_person_id(person.id)
-    return Person(id=person.id,
-                  name=person.name,
-                  actor=[
-                      film.id for film in person_films[Roles.ACTOR.value]],
-                  writer=[
-                      film.id for film in person_films[Roles.WRITER.value]],
-                  director=[
-                      film.id for film in person_films[Roles.DIRECTOR.value]],
-                  )
+    # для ответа нужны только id фильмов, сами фильмы не загружаются
+    film_ids_by_person = await film_service.get_ids_by_person_ids([person.id])
+    return _person_response(person, film_ids_by_person[person.id])
 
 
 @router.get('/{person_id}/film', response_model=FilmShortList)
-@cache_response(ttl=60 * 5, query_args=['person_id'])
+@cache_response(ttl=config.RESPONSE_CACHE_TTL, query_args=['person_id'])
 async def person_films(person_id: UUID,
                        person_service: PersonService = Depends(
                            get_person_service),
@@ -51,16 +106,16 @@ async def person_films(person_id: UUID,
     for films in person_films_by_role.values():
         person_films.extend(films)
 
-    response = FilmShortList(
-        result=[
-            FilmShort(id=film.id,
-                      title=film.title,
-                      imdb_rating=film.imdb_rating) for film in person_films])
+    response = FilmShortList.construct(
+        __root__=[
+            FilmShort.construct(id=film.id,
+                                title=film.title,
+                                imdb_rating=film.imdb_rating) for film in person_films])
     return response
 
 
 @router.get('/search/', response_model=PersonList)
-@cache_response(ttl=60 * 5, query_args=['query'])
+@cache_response(ttl=config.RESPONSE_CACHE_TTL, query_args=['query'], search_args=['query'])
 async def persons_search(request: Request,
                          query: str,
                          person_service: PersonService = Depends(
@@ -72,42 +127,40 @@ async def persons_search(request: Request,
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail='persons not found')
 
+    # id фильмов всех найденных персон - одним запросом, без загрузки самих фильмов
+    film_ids_by_person = await film_service.get_ids_by_person_ids([person.id for person in persons])
     for person in persons:
-
-        person_films = await film_service.get_by_person_id(person.id)
-        response_person_models.append(
-            Person(id=person.id,
-                   name=person.name,
-                   actor=[
-                       film.id for film in person_films[Roles.ACTOR.value]],
-                   writer=[
-                       film.id for film in person_films[Roles.WRITER.value]],
-                   director=[
-                       film.id for film in person_films[Roles.DIRECTOR.value]],
-                   ))
-    response = PersonList(__root__=response_person_models)
+        response_person_models.append(_person_response(person, film_ids_by_person[person.id]))
+    response = PersonList.construct(__root__=response_person_models)
     return response
 
 
 @router.get('/', response_model=PaginatedPersonShortList)
-@cache_response(ttl=60 * 5, query_args=['sort'])
+@cache_response(ttl=config.RESPONSE_CACHE_TTL, query_args=['sort'])
 async def persons(request: Request,
                   person_service: PersonService = Depends(get_person_service),
                   pagination: dict = Depends(pagination)) -> List[Person]:
     page_number = pagination['pagenumber']
     page_size = pagination['pagesize']
 
-    persons_total, persons = await person_service.list(page_number, page_size)
+    try:
+        persons_total, persons, next_cursor = await person_service.list(page_number, page_size,
+                                                                        cursor=pagination['cursor'])
+    except InvalidCursor:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail='invalid page cursor')
     if not persons:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail='persons not found')
 
-    response = PaginatedPersonShortList(
+    response = PaginatedPersonShortList.construct(
         page_number=page_number,
         count=len(persons),
-        total_pages=(persons_total // page_size) + 1,
+        total_pages=(persons_total.value // page_size) + 1,
+        total_pages_at_least=persons_total.at_least,
+        next_cursor=next_cursor,
         result=[
-            PersonShort(id=person.id,
-                        name=person.name) for person in persons]
+            PersonShort.construct(id=person.id,
+                                  name=person.name) for person in persons]
     )
     return response
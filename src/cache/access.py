@@ -0,0 +1,56 @@
+import asyncio
+import logging
+import random
+from typing import List
+
+from aioredis import Redis
+from fastapi import Request
+
+from core import config
+
+logger = logging.getLogger(__name__)
+
+# ZSET: путь запроса с query-строкой -> сколько раз его запрашивали (с учётом выборки)
+ACCESS_KEY = 'access:paths'
+# заголовок запросов прогрева кеша, такие запросы не учитываются
+WARMUP_HEADER = 'x-cache-warmup'
+
+# ссылки на фоновые записи, чтобы задачи не собрал сборщик мусора
+_pending = set()
+
+
+def record_access(redis: Redis, request: Request):
+    """
+    Учитывает запрос к кешируемому методу API в счётчиках обращений,
+    по которым прогрев кеша выбирает самые популярные запросы.
+    Учитывается только доля запросов WARMUP_ACCESS_SAMPLE_RATE, запись
+    идёт в фоне и не задерживает ответ.
+    """
+    if random.random() >= config.WARMUP_ACCESS_SAMPLE_RATE or WARMUP_HEADER in request.headers:
+        return
+    path = request.url.path
+    if request.url.query:
+        path = f'{path}?{request.url.query}'
+    task = asyncio.ensure_future(_increment(redis, path))
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
+
+
+async def _increment(redis: Redis, path: str):
+    try:
+        pipe = redis.pipeline()
+        pipe.zincrby(ACCESS_KEY, 1, path)
+        # храним только самые популярные пути, чтобы множество не росло бесконечно
+        pipe.zremrangebyrank(ACCESS_KEY, 0, -config.WARMUP_ACCESS_MAX_PATHS - 1)
+        await pipe.execute()
+    except Exception:
+        logger.debug('failed to record access to %s', path, exc_info=True)
+
+
+async def top_paths(redis: Redis, limit: int) -> List[str]:
+    """
+    Возвращает самые часто запрашиваемые пути, начиная с самого популярного.
+    """
+    if limit <= 0:
+        return []
+    return await redis.zrevrange(ACCESS_KEY, 0, limit - 1, encoding='utf-8')
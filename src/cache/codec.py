@@ -0,0 +1,167 @@
+"""
+Формат значений в редисе.
+
+Каждое значение начинается с байта формата: старший бит отличает его
+от записей, сохранённых до появления кодеков (JSON объектов и записи
+кеша ответов начинаются с байта меньше 0x80), биты 4-6 - сжатие,
+младшие четыре бита - сериализация. Поэтому значения разных форматов
+можно читать одновременно, пока после смены настроек кеш обновляется.
+"""
+import logging
+import zlib
+from functools import lru_cache
+from typing import Any, Callable, Dict, Optional, Tuple
+from uuid import UUID
+
+import orjson
+
+from core import config
+from models.fast import dumps, model_data
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+logger = logging.getLogger(__name__)
+
+FORMAT_FLAG = 0x80
+
+RAW = 0
+ORJSON = 1
+MSGPACK = 2
+SERIALIZERS = {'orjson': ORJSON, 'msgpack': MSGPACK}
+
+NONE = 0
+ZLIB = 1
+ZSTD = 2
+LZ4 = 3
+COMPRESSIONS = {'none': NONE, 'zlib': ZLIB, 'zstd': ZSTD, 'lz4': LZ4}
+PACKAGES = {'msgpack': 'msgpack', 'zstd': 'zstandard', 'lz4': 'lz4'}
+
+
+class CodecError(ValueError):
+    pass
+
+
+def _msgpack_default(obj: Any) -> Any:
+    if isinstance(obj, UUID):
+        return str(obj)
+    return model_data(obj)
+
+
+def _compressors(level: int) -> Dict[int, Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]]:
+    """
+    Функции сжатия и распаковки для доступных библиотек.
+    """
+    compressors = {ZLIB: (lambda data: zlib.compress(data, level), zlib.decompress)}
+    if zstandard is not None:
+        compressor, decompressor = zstandard.ZstdCompressor(level=level), zstandard.ZstdDecompressor()
+        compressors[ZSTD] = (compressor.compress, decompressor.decompress)
+    if lz4_frame is not None:
+        compressors[LZ4] = (lambda data: lz4_frame.compress(data, compression_level=level), lz4_frame.decompress)
+    return compressors
+
+
+class Codec:
+    """
+    Кодирует значения для редиса: сериализует объекты (dumps/loads)
+    или оборачивает готовые байты (pack/unpack), сжимая всё,
+    что не меньше threshold байт. Читает значения любого формата,
+    для которого установлены библиотеки.
+    """
+
+    def __init__(self,
+                 serializer: str = 'orjson',
+                 compression: str = 'none',
+                 threshold: int = 1024,
+                 level: int = 3):
+        if serializer not in SERIALIZERS:
+            raise CodecError(f'unknown cache serializer {serializer!r}')
+        if compression not in COMPRESSIONS:
+            raise CodecError(f'unknown cache compression {compression!r}')
+        if serializer == 'msgpack' and msgpack is None:
+            raise CodecError(f'msgpack serializer requires the {PACKAGES[serializer]} package')
+        self.compressors = _compressors(level)
+        self.serializer = SERIALIZERS[serializer]
+        self.compression = COMPRESSIONS[compression]
+        if self.compression != NONE and self.compression not in self.compressors:
+            raise CodecError(f'{compression} compression requires the {PACKAGES[compression]} package')
+        self.threshold = threshold
+
+    def dumps(self, obj: Any) -> bytes:
+        return self.dumps_sized(obj)[0]
+
+    def dumps_sized(self, obj: Any) -> Tuple[bytes, int]:
+        """
+        Возвращает значение для редиса и размер сериализованного объекта до сжатия.
+        """
+        if self.serializer == MSGPACK:
+            data = msgpack.packb(obj, default=_msgpack_default, use_bin_type=True)
+        else:
+            data = dumps(obj)
+        return (self._encode(self.serializer, data), len(data))
+
+    def loads(self, data: bytes) -> Any:
+        """
+        Возвращает объект или None, если значение не удалось прочитать.
+        """
+        return self.loads_sized(data)[0]
+
+    def loads_sized(self, data: bytes) -> Tuple[Any, int]:
+        """
+        То же, что loads, вместе с размером сериализованного объекта до сжатия.
+        """
+        serializer, payload = self._decode(data)
+        if payload is None:
+            return (None, 0)
+        if serializer == MSGPACK:
+            if msgpack is None:
+                logger.warning('cache value is encoded with msgpack, but msgpack is not installed')
+                return (None, 0)
+            return (msgpack.unpackb(payload, raw=False), len(payload))
+        return (orjson.loads(payload), len(payload))
+
+    def pack(self, payload: bytes) -> bytes:
+        """
+        Оборачивает уже сериализованные байты (например, готовый ответ API).
+        """
+        return self._encode(RAW, payload)
+
+    def unpack(self, data: bytes) -> Optional[bytes]:
+        return self._decode(data)[1]
+
+    def _encode(self, serializer: int, data: bytes) -> bytes:
+        compression = self.compression if len(data) >= self.threshold else NONE
+        if compression != NONE:
+            data = self.compressors[compression][0](data)
+        return bytes((FORMAT_FLAG | compression << 4 | serializer, )) + data
+
+    def _decode(self, data: bytes) -> Tuple[int, Optional[bytes]]:
+        if not data[0] & FORMAT_FLAG:
+            # значение в формате до кодеков: JSON объекта или запись кеша ответов
+            return ORJSON, data
+        compression, serializer = (data[0] >> 4) & 0x7, data[0] & 0xF
+        payload = data[1:]
+        if compression != NONE:
+            if compression not in self.compressors:
+                logger.warning('cache value is compressed with an unavailable codec %d', compression)
+                return serializer, None
+            payload = self.compressors[compression][1](payload)
+        return serializer, payload
+
+
+@lru_cache()
+def get_codec() -> Codec:
+    return Codec(serializer=config.CACHE_SERIALIZER,
+                 compression=config.CACHE_COMPRESSION,
+                 threshold=config.CACHE_COMPRESSION_THRESHOLD,
+                 level=config.CACHE_COMPRESSION_LEVEL)
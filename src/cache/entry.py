@@ -0,0 +1,49 @@
+import hashlib
+import struct
+from typing import NamedTuple, Optional
+
+# заголовок записи: версия формата, момент мягкого истечения (unix time),
+# время, за которое значение было вычислено (в секундах), и хеш содержимого
+ENTRY_VERSION = 2
+DIGEST_SIZE = 16
+HEADER = struct.Struct(f'!Bdd{DIGEST_SIZE}s')
+
+
+class CacheEntry(NamedTuple):
+    payload: bytes
+    soft_expires_at: float
+    delta: float
+    digest: bytes
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.digest.hex()}"'
+
+
+def content_digest(payload: bytes) -> bytes:
+    return hashlib.blake2b(payload, digest_size=DIGEST_SIZE).digest()
+
+
+def make_entry(payload: bytes, soft_expires_at: float, delta: float) -> CacheEntry:
+    return CacheEntry(payload=payload,
+                      soft_expires_at=soft_expires_at,
+                      delta=delta,
+                      digest=content_digest(payload))
+
+
+def pack_entry(entry: CacheEntry) -> bytes:
+    return HEADER.pack(ENTRY_VERSION, entry.soft_expires_at, entry.delta, entry.digest) + entry.payload
+
+
+def unpack_entry(data: bytes) -> Optional[CacheEntry]:
+    """
+    Разбирает запись кеша ответов. Записи неизвестного формата
+    (например, оставшиеся от предыдущей версии) считаются промахом.
+    """
+    if len(data) < HEADER.size or data[0] != ENTRY_VERSION:
+        return None
+    _, soft_expires_at, delta, digest = HEADER.unpack_from(data)
+    return CacheEntry(payload=data[HEADER.size:],
+                      soft_expires_at=soft_expires_at,
+                      delta=delta,
+                      digest=digest)
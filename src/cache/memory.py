@@ -0,0 +1,131 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Tuple
+
+from core import config
+
+
+class MemoryCache:
+    """
+    In-process LRU-кеш уже распарсенных объектов (L1).
+    Живёт в памяти воркера, ограничен количеством записей и суммарным
+    размером в байтах, у каждой записи есть своё время жизни.
+    Размер записи задаёт вызывающий код (обычно это длина JSON объекта).
+    """
+
+    def __init__(self,
+                 name: str,
+                 max_entries: int,
+                 max_bytes: int,
+                 ttl: float,
+                 enabled: bool = True):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = enabled
+        # ключ -> (объект, размер, момент истечения)
+        self._data: 'OrderedDict[Hashable, Tuple[Any, int, float]]' = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, _, expires_at = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def get_many(self, keys: Iterable[Hashable]) -> Dict[Hashable, Any]:
+        """
+        Возвращает словарь только с найденными в кеше объектами.
+        """
+        found = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                found[key] = value
+        return found
+
+    def put(self, key: Hashable, value: Any, size: int):
+        if not self.enabled:
+            return
+        if size > self.max_bytes:
+            # объект не поместится в кеш целиком, не вытесняем ради него остальные
+            return
+        if key in self._data:
+            self._remove(key)
+        self._data[key] = (value, size, time.monotonic() + self.ttl)
+        self._bytes += size
+        while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def delete(self, key: Hashable):
+        if key in self._data:
+            self._remove(key)
+
+    def clear(self):
+        self._data.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Счётчики кеша, по которым можно подобрать его размер.
+        """
+        return {
+            'enabled': self.enabled,
+            'entries': len(self._data),
+            'bytes': self._bytes,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+    def _remove(self, key: Hashable):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+
+# кеши создаются по одному на тип объектов и живут всё время работы воркера
+_memory_caches: Dict[str, MemoryCache] = {}
+
+
+def get_memory_cache(name: str) -> MemoryCache:
+    """
+    Возвращает L1-кеш для указанного типа объектов (film, person, genre),
+    при первом обращении создаёт его по настройкам из конфига.
+    """
+    if name not in _memory_caches:
+        _memory_caches[name] = MemoryCache(
+            name=name,
+            max_entries=config.MEMORY_CACHE_MAX_ENTRIES,
+            max_bytes=config.MEMORY_CACHE_MAX_BYTES,
+            ttl=config.MEMORY_CACHE_TTL,
+            enabled=name in config.MEMORY_CACHE_ENTITIES,
+        )
+    return _memory_caches[name]
+
+
+def memory_cache_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: cache.stats() for name, cache in _memory_caches.items()}
@@ -1,55 +1,317 @@
-import json
+import asyncio
+import hashlib
+import inspect
+import logging
+import math
+import random
+import time
 from uuid import UUID
 from functools import wraps
-from typing import Optional, List, Callable
+from typing import Optional, List, Dict, Callable, Tuple
+from urllib.parse import urlencode
 
-from fastapi import Request
+from fastapi import Request, Response, status
 from aioredis import Redis
+from pydantic import BaseModel
 
+from cache.access import record_access
+from cache.codec import Codec, get_codec
+from cache.entry import CacheEntry, make_entry, pack_entry, unpack_entry
+from cache.singleflight import get_single_flight
+from cache.tags import start_collecting, tag_keys
+from core import config
+from core.metrics import HANDLER_SECONDS, RESPONSE_CACHE_LOOKUPS, SERIALIZE_SECONDS, timer
 from db.redis import get_redis
+from models.fast import dumps
+
+logger = logging.getLogger(__name__)
 
 DEFAULT_TTL = 60
 
+# имя параметра, через который декоратор получает запрос,
+# если сам метод API его не объявляет
+CACHE_REQUEST_ARG = '_cache_request'
+
+# параметры запроса длиннее этого заменяются в ключе кеша хешем
+MAX_KEY_PARAMS_LENGTH = 128
+
+# параметры query-строки, от которых зависит ответ: пагинация, сортировка,
+# фильтры фильмов (services.film.FilterByAttr) и текст поиска. Остальные в ключ
+# не попадают, иначе ?x=1, ?x=2, ... создавали бы неограниченно много ключей
+RESPONSE_KEY_PARAMS = frozenset([
+    'page[size]', 'page[number]', 'page[cursor]', 'sort', 'query',
+    'filter[genre]', 'filter[actor]', 'filter[director]', 'filter[writer]',
+])
+
+# Допускает ключ в множество закешированных ответов на тексты поиска:
+# удаляет истёкшие ключи и добавляет новый, пока их меньше лимита.
+# Проверка и запись идут одним скриптом, чтобы одновременные запросы
+# не превысили лимит. KEYS[1] - множество ключей, ARGV[1] - ключ ответа,
+# ARGV[2] - текущее время, ARGV[3] - лимит, ARGV[4] - момент истечения ключа,
+# ARGV[5] - TTL множества. Возвращает 1, если ключ допущен
+ADMIT_SEARCH_KEY_SCRIPT = """
+redis.call('zremrangebyscore', KEYS[1], '-inf', ARGV[2])
+if redis.call('zscore', KEYS[1], ARGV[1]) or redis.call('zcard', KEYS[1]) < tonumber(ARGV[3]) then
+    redis.call('zadd', KEYS[1], ARGV[4], ARGV[1])
+    redis.call('expire', KEYS[1], ARGV[5])
+    return 1
+end
+return 0
+"""
+
+# ссылки на фоновые обновления, чтобы задачи не собрал сборщик мусора
+_background_refreshes = set()
+
+
+def normalize_search_text(text: str) -> str:
+    """
+    Текст поиска без различий, которые не меняют результат:
+    регистр и лишние пробелы (эластик всё равно разбивает текст на слова в нижнем регистре).
+    """
+    return ' '.join(text.lower().split())
+
+
+def _canonical_params(query_args: List[str], search_args: List[str], kwargs: dict) -> List[Tuple[str, str]]:
+    """
+    Параметры запроса, от которых зависит ответ, в одном порядке:
+    query-строка (если метод получает Request) и аргументы query_args.
+    Отсутствующие (None) параметры не учитываются.
+    """
+    params = {}
+    for value in kwargs.values():
+        if isinstance(value, Request):
+            for name, item in value.query_params.multi_items():
+                if name in RESPONSE_KEY_PARAMS:
+                    params.setdefault(name, []).append(item)
+    for name in query_args:
+        if kwargs.get(name) is not None:
+            params[name] = [kwargs[name]]
+    canonical = []
+    for name, values in params.items():
+        for value in values:
+            value = str(value)
+            if name in search_args:
+                value = normalize_search_text(value)
+            canonical.append((name, value))
+    return sorted(canonical)
+
+
+def response_key_prefix(func) -> str:
+    return f'response:v{config.RESPONSE_CACHE_KEY_VERSION}:{func.__module__}.{func.__name__}'
+
+
+def default_response_keybuilder(func, query_args, search_args, *args, **kwargs) -> str:
+    """
+    Формирует ключ для хранения ответа на запрос в кеше:
+    response:v<версия>:<метод API>:<параметры>.
+    Параметры сортируются, текст поиска нормализуется, поэтому одинаковые
+    по смыслу запросы попадают в один ключ. Длинные параметры заменяются
+    хешем, чтобы размер ключа был ограничен.
+    Сменой RESPONSE_CACHE_KEY_VERSION можно разом перестать читать старые ответы.
+    """
+    params = urlencode(_canonical_params(query_args, search_args, kwargs), safe='[]')
+    if args:
+        params = f'{args}:{params}'
+    if len(params) > MAX_KEY_PARAMS_LENGTH:
+        params = 'h:' + hashlib.blake2b(params.encode(), digest_size=16).hexdigest()
+    return f'{response_key_prefix(func)}:{params}'
+
+
+async def _admit_search_key(redis: Redis, keys_set: str, cache_key: str, limit: int, expire: int) -> bool:
+    """
+    Проверяет, можно ли закешировать ответ ещё на один текст поиска, и сразу
+    занимает для него место: в keys_set хранятся закешированные ключи
+    с моментом их истечения, истёкшие удаляются, новый ключ допускается,
+    пока их меньше limit.
+    """
+    now = time.time()
+    admitted = await redis.eval(ADMIT_SEARCH_KEY_SCRIPT, keys=[keys_set],
+                                args=[cache_key, now, limit, now + expire, expire])
+    return bool(admitted)
+
+
+def render_response(ret: BaseModel) -> bytes:
+    """
+    Сериализует модель ответа API в JSON через orjson, без промежуточного .dict().
+    """
+    return dumps(ret)
+
 
-def default_response_keybuilder(func, query_args, *args, **kwargs) -> str:
+def entry_response(entry: CacheEntry, max_age: int) -> Response:
     """
-    Формирует ключ для хранения ответа на запрос в кеше.
-    Если среди параметров функции есть объект Response, использует
-    query_args для формирования ключа (для функций, которые используют
-    Response для получения параметров запроса)
+    Отдаёт закешированный ответ как есть, без разбора JSON и повторной сериализации.
     """
-    kwargs_key = {k: v for k, v in kwargs.items() if k in query_args}
-    for k, v in kwargs.items():
-        if isinstance(v, Request):
-            kwargs_key['query_params'] = v.query_params
-    return f'response:{func.__module__}.{func.__name__}:{args}:{kwargs_key}'
+    return Response(content=entry.payload,
+                    media_type='application/json',
+                    headers=_validator_headers(entry, max_age))
+
+
+def not_modified_response(entry: CacheEntry, max_age: int) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED,
+                    headers=_validator_headers(entry, max_age))
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Проверяет заголовок If-None-Match: список ETag через запятую,
+    слабые валидаторы (W/) сравниваются так же, как сильные.
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*':
+            return True
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def _validator_headers(entry: CacheEntry, max_age: int) -> Dict[str, str]:
+    return {
+        'ETag': entry.etag,
+        'Cache-Control': f'public, max-age={max_age}',
+    }
+
+
+def _should_refresh_early(entry: CacheEntry, now: float, beta: float) -> bool:
+    """
+    Вероятностное досрочное обновление (XFetch): чем ближе мягкое истечение
+    и чем дольше вычисляется значение, тем выше шанс обновить его заранее.
+    """
+    if beta <= 0 or entry.delta <= 0:
+        return False
+    return now - entry.delta * beta * math.log(1.0 - random.random()) >= entry.soft_expires_at
+
+
+def _read_entry(codec: Codec, data: Optional[bytes]) -> Optional[CacheEntry]:
+    if not data:
+        return None
+    data = codec.unpack(data)
+    return unpack_entry(data) if data else None
+
+
+def _refresh_done(task: asyncio.Task):
+    _background_refreshes.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning('background refresh of cached response failed: %r', task.exception())
 
 
 def cache_response(
     ttl: Optional[int] = DEFAULT_TTL,
     query_args: List[str] = [],
     key_builder: Callable = default_response_keybuilder,
+    stale_ttl: Optional[int] = None,
+    beta: Optional[float] = None,
+    max_age: Optional[int] = None,
+    search_args: List[str] = [],
+    max_search_keys: Optional[int] = None,
 ):
     """
     Декоратор для кеширования ответа метода API
 
-    ttl: время жизни записи в кеш
+    ttl: время, в течение которого ответ считается свежим
     query_args: аргументы метода API, которые меняют его поведение
+    stale_ttl: сколько ещё после ttl можно отдавать устаревший ответ,
+        обновляя его в фоне (stale-while-revalidate)
+    beta: коэффициент вероятностного досрочного обновления (XFetch),
+        0 - отключить досрочное обновление
+    max_age: значение max-age в заголовке Cache-Control
+    search_args: параметры с текстом поиска, он нормализуется в ключе кеша
+    max_search_keys: сколько ответов на разные тексты поиска может быть
+        в кеше одновременно, ответы сверх этого не кешируются
+
+    Ответ отдаётся с ETag по хешу содержимого. Если ETag клиента
+    (If-None-Match) совпадает с закешированным, возвращается 304 без тела.
+    Ответ привязывается к тегам объектов, которые он использовал,
+    и удаляется из кеша при их изменении (см. services.invalidation).
     """
+    if stale_ttl is None:
+        stale_ttl = config.RESPONSE_CACHE_STALE_TTL
+    if beta is None:
+        beta = config.RESPONSE_CACHE_XFETCH_BETA
+    if max_age is None:
+        max_age = config.RESPONSE_CACHE_MAX_AGE
+    if max_search_keys is None:
+        max_search_keys = config.RESPONSE_CACHE_MAX_SEARCH_KEYS
+
     def wrapper(func):
+        signature = inspect.signature(func)
+        endpoint = func.__name__
+        search_keys = f'{response_key_prefix(func)}:search-keys'
+        request_arg = next((name for name, param in signature.parameters.items()
+                            if param.annotation is Request), None)
+
         @wraps(func)
         async def inner(*args, **kwargs):
             nonlocal ttl
             nonlocal query_args
 
+            if request_arg is None:
+                request = kwargs.pop(CACHE_REQUEST_ARG)
+            else:
+                request = kwargs[request_arg]
+            if_none_match = request.headers.get('if-none-match')
+
             redis = await get_redis()
-            cache_key = key_builder(func, query_args, *args, **kwargs)
-            resp = await redis.get(cache_key)
-            if resp:
-                return json.loads(resp)
-            ret = await func(*args, **kwargs)
-            await redis.set(cache_key, ret.json(), expire=ttl)
-            return ret
+            codec = get_codec()
+            record_access(redis, request)
+            flight = get_single_flight(redis)
+            cache_key = key_builder(func, query_args, search_args, *args, **kwargs)
+            searched = any(kwargs.get(name) for name in search_args)
+
+            async def compute() -> CacheEntry:
+                # сервисы отмечают, от каких объектов и коллекций зависит ответ,
+                # по этим тегам ответ удаляется при их изменении
+                tags = start_collecting()
+                started = time.monotonic()
+                ret = await func(*args, **kwargs)
+                delta = time.monotonic() - started
+                HANDLER_SECONDS.labels(endpoint).observe(delta)
+                with timer(SERIALIZE_SECONDS, endpoint):
+                    payload = render_response(ret)
+                entry = make_entry(payload, time.time() + ttl, delta)
+                # разных текстов поиска неограниченно много, кешируются не больше max_search_keys
+                if searched and not await _admit_search_key(redis, search_keys, cache_key, max_search_keys,
+                                                            ttl + stale_ttl):
+                    return entry
+                pipe = redis.pipeline()
+                pipe.set(cache_key, codec.pack(pack_entry(entry)), expire=ttl + stale_ttl)
+                tag_keys(pipe, cache_key, tags, ttl + stale_ttl)
+                await pipe.execute()
+                return entry
+
+            async def lookup() -> Optional[CacheEntry]:
+                return _read_entry(codec, await redis.get(cache_key))
+
+            entry = _read_entry(codec, await redis.get(cache_key))
+            if entry:
+                now = time.time()
+                if now >= entry.soft_expires_at or _should_refresh_early(entry, now, beta):
+                    RESPONSE_CACHE_LOOKUPS.labels(endpoint, 'stale').inc()
+                    # отдаём то, что есть, а свежий ответ считаем в фоне
+                    task = asyncio.ensure_future(flight.do(cache_key, compute, lookup))
+                    _background_refreshes.add(task)
+                    task.add_done_callback(_refresh_done)
+                else:
+                    RESPONSE_CACHE_LOOKUPS.labels(endpoint, 'hit').inc()
+            else:
+                RESPONSE_CACHE_LOOKUPS.labels(endpoint, 'miss').inc()
+                # одновременные промахи по одному ключу ждут один вызов метода API
+                entry = await flight.do(cache_key, compute, lookup)
+
+            if etag_matches(if_none_match, entry.etag):
+                return not_modified_response(entry, max_age)
+            return entry_response(entry, max_age)
+
+        if request_arg is None:
+            # FastAPI передаст запрос в этот параметр, для ETag нужны заголовки запроса
+            inner.__signature__ = signature.replace(parameters=[
+                *signature.parameters.values(),
+                inspect.Parameter(CACHE_REQUEST_ARG, inspect.Parameter.KEYWORD_ONLY, annotation=Request),
+            ])
         return inner
     return wrapper
 
@@ -57,20 +319,54 @@ def cache_response(
 class RedisCache:
     """
     Redis-кеш для объектов. Ничего не знает об их структуре,
-    просто сохраняет и возвращает стороки из редиса.
+    просто сохраняет и возвращает байты из редиса.
+    codec - формат, в котором значения кодирует и читает тот, кто пользуется кешем.
     """
 
-    def __init__(self, redis: Redis, keybuilder: Callable[[UUID], str], ttl: int = DEFAULT_TTL):
+    def __init__(self,
+                 redis: Redis,
+                 keybuilder: Callable[[UUID], str],
+                 ttl: int = DEFAULT_TTL,
+                 codec: Optional[Codec] = None):
         self.redis = redis
         self.keybuilder = keybuilder
         self.ttl = ttl
+        self.codec = codec or get_codec()
 
-    async def get(self, obj_id: UUID) -> Optional[str]:
+    async def get(self, obj_id: UUID) -> Optional[bytes]:
         resp = await self.redis.get(self.keybuilder(obj_id))
         if not resp:
             return None
 
         return resp
 
-    async def put(self, obj_id: UUID, data: str):
+    async def put(self, obj_id: UUID, data: bytes):
         await self.redis.set(self.keybuilder(obj_id), data, expire=self.ttl)
+
+    async def get_many(self, obj_ids: List[UUID]) -> List[Optional[bytes]]:
+        """
+        Возвращает значения для списка id одним запросом MGET.
+        Порядок результата совпадает с порядком obj_ids,
+        для отсутствующих в кеше объектов возвращается None.
+        """
+        if not obj_ids:
+            return []
+        keys = [self.keybuilder(obj_id) for obj_id in obj_ids]
+        return await self.redis.mget(*keys)
+
+    async def put_many(self, items: Dict[UUID, bytes]):
+        """
+        Сохраняет несколько объектов за один round-trip:
+        команды SET с expire отправляются в редис пайплайном.
+        """
+        if not items:
+            return
+        pipe = self.redis.pipeline()
+        for obj_id, data in items.items():
+            pipe.set(self.keybuilder(obj_id), data, expire=self.ttl)
+        await pipe.execute()
+
+    async def delete_many(self, obj_ids: List[UUID]):
+        if not obj_ids:
+            return
+        await self.redis.delete(*(self.keybuilder(obj_id) for obj_id in obj_ids))
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import time
+import uuid
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aioredis import Redis
+
+from core import config
+
+logger = logging.getLogger(__name__)
+
+# снимает блокировку, только если она всё ещё принадлежит нам
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+else
+    return 0
+end
+"""
+
+
+def _forget(calls: Dict[str, asyncio.Future], key: str, fut: asyncio.Future):
+    if calls.get(key) is fut:
+        del calls[key]
+    # ошибку уже получили все ожидающие, помечаем её обработанной
+    if not fut.cancelled():
+        fut.exception()
+
+
+class SingleFlight:
+    """
+    Схлопывает одновременные вычисления с одинаковым ключом в пределах воркера:
+    первый запрос запускает вычисление, остальные ждут его результат.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+
+    async def do(self,
+                 key: str,
+                 fn: Callable[[], Awaitable[Any]],
+                 lookup: Optional[Callable[[], Awaitable[Any]]] = None) -> Any:
+        """
+        Выполняет fn один раз на все одновременные вызовы с ключом key.
+        lookup - проверка кеша, нужна только для координации между воркерами.
+        """
+        fut = self._calls.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(self._run(key, fn, lookup))
+            self._calls[key] = fut
+            fut.add_done_callback(lambda f: _forget(self._calls, key, f))
+        # отмена одного из ожидающих не должна отменять общее вычисление
+        return await asyncio.shield(fut)
+
+    async def _run(self,
+                   key: str,
+                   fn: Callable[[], Awaitable[Any]],
+                   lookup: Optional[Callable[[], Awaitable[Any]]]) -> Any:
+        return await fn()
+
+
+class RedisSingleFlight(SingleFlight):
+    """
+    Single-flight между воркерами: вычисление выполняет тот, кто взял
+    блокировку lock:<key> в Redis. Остальные опрашивают кеш через lookup,
+    пока не появится значение или не пропадёт блокировка.
+    """
+
+    def __init__(self, redis: Redis, lock_timeout: float, poll_interval: float):
+        super().__init__()
+        self.redis = redis
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+
+    async def _run(self,
+                   key: str,
+                   fn: Callable[[], Awaitable[Any]],
+                   lookup: Optional[Callable[[], Awaitable[Any]]]) -> Any:
+        lock_key = f'lock:{key}'
+        token = uuid.uuid4().hex
+        acquired = await self.redis.set(lock_key, token,
+                                        pexpire=int(self.lock_timeout * 1000),
+                                        exist=Redis.SET_IF_NOT_EXIST)
+        if acquired:
+            try:
+                return await fn()
+            finally:
+                await self.redis.eval(RELEASE_LOCK_SCRIPT, keys=[lock_key], args=[token])
+
+        if lookup is not None:
+            deadline = time.monotonic() + self.lock_timeout
+            while time.monotonic() < deadline:
+                await asyncio.sleep(self.poll_interval)
+                value = await lookup()
+                if value is not None:
+                    return value
+                if not await self.redis.exists(lock_key):
+                    break
+            logger.debug('single-flight lock %s was not released in time', lock_key)
+        # владелец блокировки упал или не успел - считаем сами
+        return await fn()
+
+
+_local_flight = SingleFlight()
+
+
+@lru_cache()
+def get_single_flight(redis: Redis) -> SingleFlight:
+    """
+    Возвращает single-flight в режиме из настроек SINGLE_FLIGHT_MODE:
+    local - только внутри воркера, redis - ещё и между воркерами.
+    """
+    if config.SINGLE_FLIGHT_MODE == 'redis':
+        return RedisSingleFlight(redis,
+                                 lock_timeout=config.SINGLE_FLIGHT_LOCK_TIMEOUT,
+                                 poll_interval=config.SINGLE_FLIGHT_POLL_INTERVAL)
+    return _local_flight
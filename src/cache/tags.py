@@ -0,0 +1,94 @@
+import time
+from contextvars import ContextVar
+from typing import Iterable, List, Optional, Set
+
+from aioredis import Redis
+
+# tags:<тег> - сортированное множество ключей ответов API, которые зависят от тега,
+# с моментом истечения ключа. Раньше теги были обычными множествами tag:<тег>,
+# новое имя не пересекается с ними, пока они не истекут
+TAG_PREFIX = 'tags:'
+
+# теги ответа API, который сейчас вычисляется, None - вне cache_response
+_response_tags: ContextVar[Optional[Set[str]]] = ContextVar('response_tags', default=None)
+
+
+def object_tag(entity: str, obj_id) -> str:
+    """
+    Тег объекта: ответ зависит от конкретного фильма, персоны или жанра.
+    """
+    return f'{entity}:{obj_id}'
+
+
+def collection_tag(entity: str) -> str:
+    """
+    Тег коллекции: ответ (список, поиск) может измениться при изменении
+    любого объекта этого типа, в том числе при добавлении нового.
+    """
+    return entity
+
+
+def add_response_tags(tags: Iterable[str]):
+    """
+    Отмечает, что вычисляемый ответ API зависит от тегов.
+    Вне cache_response ничего не делает.
+    """
+    current = _response_tags.get()
+    if current is not None:
+        current.update(tags)
+
+
+def start_collecting() -> Set[str]:
+    """
+    Начинает сбор тегов для ответа в текущем контексте и возвращает
+    множество, в которое они будут собраны.
+    """
+    tags = set()
+    _response_tags.set(tags)
+    return tags
+
+
+def stored_tags(tags: Iterable[str]) -> List[str]:
+    """
+    Теги, которые стоит записывать: если ответ зависит от всей коллекции,
+    он и так удаляется при изменении любого её объекта, и теги отдельных
+    объектов этой коллекции (например, всех фильмов страницы списка) не нужны.
+    """
+    tags = set(tags)
+    collections = {tag for tag in tags if ':' not in tag}
+    return [tag for tag in tags if ':' not in tag or tag.split(':', 1)[0] not in collections]
+
+
+def tag_keys(pipe, key: str, tags: Iterable[str], expire: int):
+    """
+    Добавляет в пайплайн привязку ключа к тегам. Ключ хранится в теге
+    с моментом своего истечения, истёкшие ключи убираются при каждой записи,
+    поэтому тег не растёт при постоянном трафике. Тег живёт не меньше,
+    чем привязанные к нему ключи.
+    """
+    now = time.time()
+    for tag in stored_tags(tags):
+        tag_key = f'{TAG_PREFIX}{tag}'
+        pipe.zadd(tag_key, now + expire, key)
+        pipe.zremrangebyscore(tag_key, max=now)
+        pipe.expire(tag_key, expire)
+
+
+async def evict_tags(redis: Redis, tags: List[str]) -> int:
+    """
+    Удаляет все ключи, привязанные к тегам, вместе с самими тегами.
+    Возвращает количество удалённых ключей.
+    """
+    if not tags:
+        return 0
+    tag_sets = [f'{TAG_PREFIX}{tag}' for tag in tags]
+    pipe = redis.pipeline()
+    members = [pipe.zrevrange(tag_set, 0, -1) for tag_set in tag_sets]
+    await pipe.execute()
+    keys = set()
+    for tag_members in members:
+        keys.update(await tag_members)
+    if not keys:
+        return 0
+    await redis.delete(*keys, *tag_sets)
+    return len(keys)
@@ -0,0 +1,150 @@
+import hashlib
+from typing import Awaitable, Callable, Dict, Generic, List, Optional, Tuple, Type, TypeVar
+from uuid import UUID
+
+from pydantic import BaseModel
+
+from cache.memory import MemoryCache
+from cache.redis import RedisCache
+from cache.singleflight import SingleFlight
+from cache.tags import add_response_tags, object_tag
+from core.metrics import CACHE_LOOKUPS, MODEL_PARSE_SECONDS, timer
+from models.fast import construct
+
+Model = TypeVar('Model', bound=BaseModel)
+
+
+def _count_lookups(entity: str, tier: str, hits: int, misses: int):
+    if hits:
+        CACHE_LOOKUPS.labels(entity, tier, 'hit').inc(hits)
+    if misses:
+        CACHE_LOOKUPS.labels(entity, tier, 'miss').inc(misses)
+
+
+class TieredCache(Generic[Model]):
+    """
+    Двухуровневый кеш объектов: in-process LRU распарсенных моделей (L1)
+    перед Redis (L2). Промахи L1, найденные в Redis, поднимаются в L1.
+    Загрузка не найденных в кеше объектов идёт через single-flight,
+    чтобы одновременные промахи по одним и тем же id не дублировали запросы в эластик.
+    """
+
+    def __init__(self,
+                 memory: MemoryCache,
+                 redis_cache: RedisCache,
+                 model: Type[Model],
+                 flight: SingleFlight,
+                 entity: Optional[str] = None):
+        self.memory = memory
+        self.redis_cache = redis_cache
+        self.model = model
+        self.flight = flight
+        # тип объектов для тегов ответов API, по умолчанию - имя L1 кеша
+        self.entity = entity or memory.name
+
+    async def get(self, obj_id: UUID) -> Optional[Model]:
+        obj = self.memory.get(obj_id)
+        if obj is not None:
+            CACHE_LOOKUPS.labels(self.entity, 'memory', 'hit').inc()
+            return obj
+        CACHE_LOOKUPS.labels(self.entity, 'memory', 'miss').inc()
+
+        data = await self.redis_cache.get(obj_id)
+        if not data:
+            CACHE_LOOKUPS.labels(self.entity, 'redis', 'miss').inc()
+            return None
+        with timer(MODEL_PARSE_SECONDS, self.entity):
+            obj, size = self._parse(data)
+        if obj is None:
+            CACHE_LOOKUPS.labels(self.entity, 'redis', 'miss').inc()
+            return None
+        CACHE_LOOKUPS.labels(self.entity, 'redis', 'hit').inc()
+        self.memory.put(obj_id, obj, size)
+        return obj
+
+    async def get_many(self, obj_ids: List[UUID]) -> Dict[UUID, Model]:
+        """
+        Возвращает словарь только с найденными в кеше объектами.
+        В Redis за недостающими объектами ходим одним MGET.
+        """
+        found = self.memory.get_many(obj_ids)
+        missed = [obj_id for obj_id in obj_ids if obj_id not in found]
+        _count_lookups(self.entity, 'memory', len(found), len(missed))
+        if not missed:
+            return found
+
+        cached = await self.redis_cache.get_many(missed)
+        with timer(MODEL_PARSE_SECONDS, self.entity):
+            for obj_id, data in zip(missed, cached):
+                obj, size = self._parse(data) if data else (None, 0)
+                if obj is not None:
+                    self.memory.put(obj_id, obj, size)
+                    found[obj_id] = obj
+        hits = len(found) - (len(obj_ids) - len(missed))
+        _count_lookups(self.entity, 'redis', hits, len(missed) - hits)
+        return found
+
+    async def get_or_load(self,
+                          obj_ids: List[UUID],
+                          loader: Callable[[List[UUID]], Awaitable[List[Model]]],
+                          on_lookup: Optional[Callable[[int, int], None]] = None) -> Dict[UUID, Model]:
+        """
+        Возвращает словарь найденных объектов. Отсутствующие в кеше объекты
+        загружаются через loader и сохраняются в кеш.
+        on_lookup вызывается с количеством найденных в кеше и запрошенных объектов.
+        """
+        # ответ зависит от запрошенных объектов, даже если их пока нет
+        add_response_tags(object_tag(self.entity, obj_id) for obj_id in obj_ids)
+        found = await self.get_many(obj_ids)
+        if on_lookup is not None:
+            on_lookup(len(found), len(obj_ids))
+        missed = [obj_id for obj_id in obj_ids if obj_id not in found]
+        if not missed:
+            return found
+
+        async def load() -> Dict[UUID, Model]:
+            objs = await loader(missed)
+            await self.put_many(objs)
+            return {obj.id: obj for obj in objs}
+
+        async def lookup() -> Optional[Dict[UUID, Model]]:
+            # другой воркер уже положил объекты в кеш
+            objs = await self.get_many(missed)
+            return objs if len(objs) == len(missed) else None
+
+        found.update(await self.flight.do(self._flight_key(missed), load, lookup))
+        return found
+
+    async def put(self, obj: Model):
+        await self.put_many([obj, ])
+
+    async def delete_many(self, obj_ids: List[UUID]):
+        """
+        Удаляет объекты из памяти воркера и из Redis.
+        """
+        for obj_id in obj_ids:
+            self.memory.delete(obj_id)
+        await self.redis_cache.delete_many(obj_ids)
+
+    async def put_many(self, objs: List[Model]):
+        items = {}
+        for obj in objs:
+            data, size = self.redis_cache.codec.dumps_sized(obj)
+            items[obj.id] = data
+            self.memory.put(obj.id, obj, size)
+        await self.redis_cache.put_many(items)
+
+    def _parse(self, data: bytes) -> Tuple[Optional[Model], int]:
+        """
+        Возвращает объект и его размер для L1: длину сериализованного объекта
+        до сжатия, как при записи в put_many, независимо от формата значения в редисе.
+        """
+        # в кеше только то, что приложение положило само, валидация не нужна
+        value, size = self.redis_cache.codec.loads_sized(data)
+        return (None if value is None else construct(self.model, value), size)
+
+    def _flight_key(self, obj_ids: List[UUID]) -> str:
+        if len(obj_ids) == 1:
+            return self.redis_cache.keybuilder(obj_ids[0])
+        digest = hashlib.sha1(','.join(sorted(str(obj_id) for obj_id in obj_ids)).encode()).hexdigest()
+        return f'{self.memory.name}:batch:{digest}'
@@ -12,10 +12,179 @@ PROJECT_NAME = os.getenv('PROJECT_NAME', 'movies-api')
 # Настройки Redis
 REDIS_HOST = os.getenv('REDIS_HOST', '127.0.0.1')
 REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
+# Пул соединений воркера: сколько соединений открывается сразу и сколько
+# максимум, таймаут открытия соединения (в секундах)
+REDIS_POOL_MINSIZE = int(os.getenv('REDIS_POOL_MINSIZE', 10))
+REDIS_POOL_MAXSIZE = int(os.getenv('REDIS_POOL_MAXSIZE', 20))
+REDIS_CONNECT_TIMEOUT = float(os.getenv('REDIS_CONNECT_TIMEOUT', 5))
 
 # Настройки Elasticsearch
 ELASTIC_HOST = os.getenv('ELASTIC_HOST', '127.0.0.1')
 ELASTIC_PORT = int(os.getenv('ELASTIC_PORT', 9200))
+# Сколько keep-alive соединений воркер держит к каждому узлу, таймаут
+# запроса (в секундах), сколько раз повторять запрос при ошибке соединения
+# и при таймауте ли тоже
+ES_POOL_MAXSIZE = int(os.getenv('ES_POOL_MAXSIZE', 25))
+ES_TIMEOUT = float(os.getenv('ES_TIMEOUT', 10))
+ES_MAX_RETRIES = int(os.getenv('ES_MAX_RETRIES', 3))
+ES_RETRY_ON_TIMEOUT = os.getenv('ES_RETRY_ON_TIMEOUT', 'true').lower() == 'true'
+# Поиск узлов кластера (sniffing): при старте, после ошибки соединения
+# и раз в ES_SNIFFER_TIMEOUT секунд (пусто - не искать периодически)
+ES_SNIFF_ON_START = os.getenv('ES_SNIFF_ON_START', 'false').lower() == 'true'
+ES_SNIFF_ON_CONNECTION_FAIL = os.getenv('ES_SNIFF_ON_CONNECTION_FAIL', 'false').lower() == 'true'
+ES_SNIFFER_TIMEOUT = float(os.getenv('ES_SNIFFER_TIMEOUT')) if os.getenv('ES_SNIFFER_TIMEOUT') else None
+# Сжимать тела запросов в эластик gzip
+ES_HTTP_COMPRESS = os.getenv('ES_HTTP_COMPRESS', 'false').lower() == 'true'
+
+# Ожидание эластика и редиса при старте воркера: сколько секунд ждать
+# всего и как часто проверять
+READINESS_TIMEOUT = float(os.getenv('READINESS_TIMEOUT', 60))
+READINESS_INTERVAL = float(os.getenv('READINESS_INTERVAL', 1))
 
 # Корень проекта
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Настройки in-process кеша объектов (L1), который стоит перед Redis.
+# Кеш создаётся в каждом воркере отдельно для фильмов, персон и жанров.
+MEMORY_CACHE_TTL = int(os.getenv('MEMORY_CACHE_TTL', 30))
+MEMORY_CACHE_MAX_ENTRIES = int(os.getenv('MEMORY_CACHE_MAX_ENTRIES', 5000))
+MEMORY_CACHE_MAX_BYTES = int(os.getenv('MEMORY_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+# Типы объектов, для которых L1-кеш включён
+MEMORY_CACHE_ENTITIES = set(
+    filter(None, os.getenv('MEMORY_CACHE_ENTITIES', 'film,film_short,person,genre').split(',')))
+
+# Схлопывание одновременных промахов кеша (single-flight):
+# local - запросы ждут одно вычисление в пределах воркера,
+# redis - вычисление дополнительно координируется между воркерами блокировкой в Redis
+SINGLE_FLIGHT_MODE = os.getenv('SINGLE_FLIGHT_MODE', 'local')
+SINGLE_FLIGHT_LOCK_TIMEOUT = float(os.getenv('SINGLE_FLIGHT_LOCK_TIMEOUT', 5))
+SINGLE_FLIGHT_POLL_INTERVAL = float(os.getenv('SINGLE_FLIGHT_POLL_INTERVAL', 0.05))
+
+# Кеш ответов API: сколько секунд после истечения свежести можно отдавать
+# устаревший ответ, пока он обновляется в фоне, и коэффициент вероятностного
+# досрочного обновления (XFetch, 0 - отключить)
+RESPONSE_CACHE_STALE_TTL = int(os.getenv('RESPONSE_CACHE_STALE_TTL', 60 * 5))
+RESPONSE_CACHE_XFETCH_BETA = float(os.getenv('RESPONSE_CACHE_XFETCH_BETA', 1.0))
+
+# max-age в заголовке Cache-Control закешированных ответов API
+RESPONSE_CACHE_MAX_AGE = int(os.getenv('RESPONSE_CACHE_MAX_AGE', 60))
+
+# Пагинация по курсору (search_after): читать страницы по курсору из
+# point-in-time контекста эластика и сколько держать этот контекст открытым
+# между страницами. На последней странице контекст закрывается сразу,
+# брошенные клиентом контексты живут ES_POINT_IN_TIME_KEEP_ALIVE, поэтому он короткий
+ES_CURSOR_POINT_IN_TIME = os.getenv('ES_CURSOR_POINT_IN_TIME', 'false').lower() == 'true'
+ES_POINT_IN_TIME_KEEP_ALIVE = os.getenv('ES_POINT_IN_TIME_KEEP_ALIVE', '1m')
+
+# Кеш запросов шардов эластика (request_cache) для страниц списков и подсчётов:
+# ответы на одинаковые запросы хранятся в шарде до следующего обновления индекса
+ES_REQUEST_CACHE = os.getenv('ES_REQUEST_CACHE', 'true').lower() == 'true'
+
+# Размер пачки, которой выгрузка каталога (/export) читает документы из эластика
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+
+# Как списки и поиск получают документы из эластика:
+# ids - поиск возвращает только id, документы берутся из кеша и через mget,
+# source - документы приходят сразу в ответе поиска (один запрос в эластик),
+# auto - выбирается по измеренной доле попаданий в кеш.
+# Для отдельного метода можно задать FETCH_STRATEGY_<МЕТОД>, например FETCH_STRATEGY_FILM_LIST
+FETCH_STRATEGY_DEFAULT = os.getenv('FETCH_STRATEGY', 'auto')
+FETCH_STRATEGIES = {
+    name: os.getenv(f'FETCH_STRATEGY_{name.upper()}', FETCH_STRATEGY_DEFAULT)
+    for name in ('film_list', 'film_search', 'person_list', 'person_search', 'genre_list')
+}
+# В режиме auto: порог доли попаданий в кеш, начиная с которого выгоднее ids,
+# и как часто перепроверять долю попаданий, когда выбран source
+FETCH_AUTO_HIT_RATIO = float(os.getenv('FETCH_AUTO_HIT_RATIO', 0.8))
+FETCH_AUTO_PROBE_EVERY = int(os.getenv('FETCH_AUTO_PROBE_EVERY', 20))
+
+# Как списки считают общее количество документов для total_pages:
+# exact - точно в каждом запросе, capped - до COUNT_TRACK_LIMIT, дальше
+# total_pages_at_least в ответе, cached - отдельным запросом, результат
+# хранится в редисе COUNT_CACHE_TTL секунд для каждого фильтра.
+# Для отдельного списка можно задать COUNT_STRATEGY_<СПИСОК>, например COUNT_STRATEGY_FILM_LIST
+COUNT_STRATEGY_DEFAULT = os.getenv('COUNT_STRATEGY', 'capped')
+COUNT_STRATEGIES = {
+    name: os.getenv(f'COUNT_STRATEGY_{name.upper()}', COUNT_STRATEGY_DEFAULT)
+    for name in ('film_list', 'person_list', 'genre_list')
+}
+COUNT_TRACK_LIMIT = int(os.getenv('COUNT_TRACK_LIMIT', 10000))
+COUNT_CACHE_TTL = int(os.getenv('COUNT_CACHE_TTL', 60 * 5))
+
+# Сколько запросов в эластик сервис может отправить одновременно в рамках одного запроса к API
+ES_MAX_CONCURRENT_REQUESTS = int(os.getenv('ES_MAX_CONCURRENT_REQUESTS', 4))
+# Сколько персон запрашивать в одном msearch при поиске фильмов персон
+PERSON_FILMS_MSEARCH_CHUNK = int(os.getenv('PERSON_FILMS_MSEARCH_CHUNK', 10))
+# Сколько фильмов одной роли персоны запрашивать в msearch, пока не построен индекс
+# персона -> фильмы (индекс отдаёт все фильмы). Не больше index.max_result_window
+PERSON_FILMS_MSEARCH_SIZE = int(os.getenv('PERSON_FILMS_MSEARCH_SIZE', 1000))
+
+# Индекс персона -> фильмы в редисе: включён ли, как часто перестраивается (в секундах)
+# и сколько фильмов читается из эластика за раз при перестроении
+PERSON_FILMS_INDEX_ENABLED = os.getenv('PERSON_FILMS_INDEX_ENABLED', 'true').lower() == 'true'
+PERSON_FILMS_INDEX_REFRESH = int(os.getenv('PERSON_FILMS_INDEX_REFRESH', 60 * 10))
+PERSON_FILMS_INDEX_BATCH_SIZE = int(os.getenv('PERSON_FILMS_INDEX_BATCH_SIZE', 1000))
+
+# Префиксный индекс названий фильмов и имён персон в памяти воркера для автодополнения
+# /v1/film/suggest и /v1/person/suggest: включён ли, как часто перестраивается (в секундах)
+# и сколько документов читается из эластика за раз. Если индекс выключен, ещё не построен
+# или ничего не нашёл, автодополнение идёт в эластик
+SEARCH_PREFIX_INDEX_ENABLED = os.getenv('SEARCH_PREFIX_INDEX_ENABLED', 'true').lower() == 'true'
+SEARCH_PREFIX_INDEX_REFRESH = int(os.getenv('SEARCH_PREFIX_INDEX_REFRESH', 60 * 10))
+SEARCH_PREFIX_INDEX_BATCH_SIZE = int(os.getenv('SEARCH_PREFIX_INDEX_BATCH_SIZE', 5000))
+
+# Сколько вариантов по умолчанию и максимум возвращает автодополнение
+SUGGEST_SIZE = int(os.getenv('SUGGEST_SIZE', 10))
+SUGGEST_MAX_SIZE = int(os.getenv('SUGGEST_MAX_SIZE', 50))
+
+# Фасеты /v1/film/facets: сколько жанров и сколько актёров и режиссёров
+# возвращать, шаг интервалов рейтинга
+FACETS_GENRES_SIZE = int(os.getenv('FACETS_GENRES_SIZE', 100))
+FACETS_PERSONS_SIZE = int(os.getenv('FACETS_PERSONS_SIZE', 10))
+FACETS_RATING_INTERVAL = float(os.getenv('FACETS_RATING_INTERVAL', 1))
+
+# Сколько id можно запросить за раз в POST /v1/{film,person,genre}/_mget
+MGET_MAX_IDS = int(os.getenv('MGET_MAX_IDS', 100))
+
+# Время жизни в редисе ответов API и объектов (в секундах). Изменённые объекты
+# удаляются из кеша по событиям из канала INVALIDATION_CHANNEL, поэтому TTL
+# ограничивает только устаревание при пропущенных событиях и может быть длинным
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 60 * 5))
+OBJECT_CACHE_TTL = int(os.getenv('OBJECT_CACHE_TTL', 60))
+INVALIDATION_ENABLED = os.getenv('INVALIDATION_ENABLED', 'true').lower() == 'true'
+INVALIDATION_CHANNEL = os.getenv('INVALIDATION_CHANNEL', 'cache:invalidate')
+
+# Прогрев кеша при старте: бюджет времени (в секундах), сколько задач выполнять
+# одновременно, сколько жанров, фильмов из топа по рейтингу, страниц каждого
+# списка и самых популярных запросов прогревать
+WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', 'true').lower() == 'true'
+WARMUP_BUDGET = float(os.getenv('WARMUP_BUDGET', 10))
+WARMUP_CONCURRENCY = int(os.getenv('WARMUP_CONCURRENCY', 4))
+WARMUP_GENRES_LIMIT = int(os.getenv('WARMUP_GENRES_LIMIT', 1000))
+WARMUP_TOP_FILMS = int(os.getenv('WARMUP_TOP_FILMS', 100))
+WARMUP_LIST_PAGES = int(os.getenv('WARMUP_LIST_PAGES', 3))
+WARMUP_TOP_PATHS = int(os.getenv('WARMUP_TOP_PATHS', 50))
+# Доля запросов, которые учитываются в счётчиках обращений, и сколько
+# самых популярных путей в них хранить
+WARMUP_ACCESS_SAMPLE_RATE = float(os.getenv('WARMUP_ACCESS_SAMPLE_RATE', 0.1))
+WARMUP_ACCESS_MAX_PATHS = int(os.getenv('WARMUP_ACCESS_MAX_PATHS', 10000))
+
+# Замеры времени запросов в эластик и редис для /metrics
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+# Каталог метрик воркеров для /metrics при нескольких воркерах. prometheus-client 0.9
+# читает только имя переменной в нижнем регистре, PROMETHEUS_MULTIPROC_DIR он не видит
+PROMETHEUS_MULTIPROC_DIR = os.getenv('prometheus_multiproc_dir')
+
+# Формат значений в редисе: сериализация объектов (orjson или msgpack) и сжатие
+# (none, zlib, zstd или lz4) значений и ответов API не меньше CACHE_COMPRESSION_THRESHOLD
+# байт. msgpack, zstd и lz4 требуют пакетов msgpack, zstandard и lz4.
+# Записи в старом формате читаются, поэтому формат можно менять без сброса кеша
+CACHE_SERIALIZER = os.getenv('CACHE_SERIALIZER', 'orjson')
+CACHE_COMPRESSION = os.getenv('CACHE_COMPRESSION', 'none')
+CACHE_COMPRESSION_THRESHOLD = int(os.getenv('CACHE_COMPRESSION_THRESHOLD', 1024))
+CACHE_COMPRESSION_LEVEL = int(os.getenv('CACHE_COMPRESSION_LEVEL', 3))
+
+# Версия ключей кеша ответов API: при смене старые ответы перестают читаться.
+# Сколько ответов на разные тексты поиска каждый метод API может держать в кеше
+RESPONSE_CACHE_KEY_VERSION = int(os.getenv('RESPONSE_CACHE_KEY_VERSION', 1))
+RESPONSE_CACHE_MAX_SEARCH_KEYS = int(os.getenv('RESPONSE_CACHE_MAX_SEARCH_KEYS', 10000))
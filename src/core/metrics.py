@@ -0,0 +1,171 @@
+import inspect
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Iterator
+
+from aioredis import Redis
+from elasticsearch import AsyncElasticsearch
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest,
+                               multiprocess)
+
+from cache.memory import memory_cache_stats
+from core import config
+
+# границы корзин гистограмм: от сотен микросекунд (L1, разбор моделей)
+# до секунд (медленные запросы в эластик)
+BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5)
+
+ES_REQUEST_SECONDS = Histogram('es_request_seconds', 'Время запроса в Elasticsearch',
+                               ['operation', 'index'], buckets=BUCKETS)
+REDIS_COMMAND_SECONDS = Histogram('redis_command_seconds', 'Время команды Redis (pipeline - весь пайплайн)',
+                                  ['command'], buckets=BUCKETS)
+MODEL_PARSE_SECONDS = Histogram('model_parse_seconds', 'Время разбора пачки моделей из кеша',
+                                ['entity'], buckets=BUCKETS)
+HANDLER_SECONDS = Histogram('api_handler_seconds', 'Время вычисления ответа метода API при промахе кеша',
+                            ['endpoint'], buckets=BUCKETS)
+SERIALIZE_SECONDS = Histogram('response_serialize_seconds', 'Время сериализации ответа API',
+                              ['endpoint'], buckets=BUCKETS)
+CACHE_LOOKUPS = Counter('cache_lookups_total', 'Обращения к кешу объектов по уровням',
+                        ['entity', 'tier', 'result'])
+RESPONSE_CACHE_LOOKUPS = Counter('response_cache_lookups_total', 'Обращения к кешу ответов API',
+                                 ['endpoint', 'result'])
+
+# заполненность пулов соединений: занятые соединения, максимум и запросы,
+# которые ждут свободного соединения. Обновляется при чтении /metrics,
+# чтобы не добавлять работы каждому запросу в эластик и редис
+REDIS_POOL_CONNECTIONS = Gauge('redis_pool_connections', 'Соединения пула Redis',
+                               ['state'], multiprocess_mode='livesum')
+ES_POOL_CONNECTIONS = Gauge('es_pool_connections', 'Соединения HTTP-клиента Elasticsearch по узлам',
+                            ['node', 'state'], multiprocess_mode='livesum')
+# счётчики L1-кешей воркера (записи, байты, попадания, промахи, вытеснения, истечения)
+# по типам объектов. Обновляется при чтении /metrics
+MEMORY_CACHE = Gauge('memory_cache', 'Состояние и счётчики in-process кеша объектов (L1)',
+                     ['entity', 'stat'], multiprocess_mode='livesum')
+
+# операции эластика, которые замеряются, остальные методы клиента вызываются как есть
+ES_OPERATIONS = {'search', 'msearch', 'mget', 'get', 'count', 'open_point_in_time', 'close_point_in_time'}
+
+
+@contextmanager
+def timer(histogram: Histogram, *labels: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(*labels).observe(time.perf_counter() - started)
+
+
+async def _observe(aw: Awaitable[Any], histogram: Histogram, *labels: str) -> Any:
+    with timer(histogram, *labels):
+        return await aw
+
+
+def observe_redis_pool(redis: Redis):
+    pool = getattr(redis, 'connection', None)
+    if not hasattr(pool, 'freesize'):
+        # одиночное соединение, а не пул
+        return
+    # запросы, ждущие соединения, стоят в очереди условия пула
+    waiters = getattr(getattr(pool, '_cond', None), '_waiters', None) or ()
+    REDIS_POOL_CONNECTIONS.labels('in_use').set(pool.size - pool.freesize)
+    REDIS_POOL_CONNECTIONS.labels('max').set(pool.maxsize)
+    REDIS_POOL_CONNECTIONS.labels('waiting').set(len(waiters))
+
+
+def observe_es_pool(elastic: AsyncElasticsearch):
+    transport = getattr(elastic, 'transport', None)
+    if transport is None:
+        return
+    for connection in transport.connection_pool.connections:
+        session = getattr(connection, 'session', None)
+        if session is None:
+            # сессия aiohttp создаётся при первом запросе к узлу
+            continue
+        connector = session.connector
+        node = str(connection.host)
+        ES_POOL_CONNECTIONS.labels(node, 'in_use').set(len(connector._acquired))
+        ES_POOL_CONNECTIONS.labels(node, 'max').set(connector.limit)
+        ES_POOL_CONNECTIONS.labels(node, 'waiting').set(sum(len(waiters) for waiters in connector._waiters.values()))
+
+
+def observe_memory_caches():
+    for name, stats in memory_cache_stats().items():
+        for stat, value in stats.items():
+            if stat != 'enabled':
+                MEMORY_CACHE.labels(name, stat).set(value)
+
+
+class InstrumentedElasticsearch:
+    """
+    Обёртка клиента эластика, которая замеряет время запросов
+    по операции и индексу. Остальное поведение клиента не меняется.
+    """
+
+    def __init__(self, elastic: AsyncElasticsearch):
+        self._elastic = elastic
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._elastic, name)
+        if name not in ES_OPERATIONS:
+            return attr
+
+        def call(*args, **kwargs):
+            # запрос в point-in-time контекст идёт без индекса
+            index = kwargs.get('index') or 'pit'
+            return _observe(attr(*args, **kwargs), ES_REQUEST_SECONDS, name, str(index))
+        return call
+
+
+class _InstrumentedPipeline:
+    def __init__(self, pipe):
+        self._pipe = pipe
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._pipe, name)
+
+    async def execute(self, *args, **kwargs):
+        return await _observe(self._pipe.execute(*args, **kwargs), REDIS_COMMAND_SECONDS, 'pipeline')
+
+
+class InstrumentedRedis:
+    """
+    Обёртка клиента редиса, которая замеряет время команд.
+    Пайплайн замеряется целиком, при execute.
+    """
+
+    def __init__(self, redis: Redis):
+        self._redis = redis
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._redis, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            if not inspect.isawaitable(result):
+                return result
+            return _observe(result, REDIS_COMMAND_SECONDS, name)
+        return call
+
+    def pipeline(self):
+        return _InstrumentedPipeline(self._redis.pipeline())
+
+    def multi_exec(self):
+        return _InstrumentedPipeline(self._redis.multi_exec())
+
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+
+def render_metrics() -> bytes:
+    """
+    Текущие значения метрик в текстовом формате Prometheus.
+    Если воркеров несколько (задан prometheus_multiproc_dir), метрики
+    собираются со всех воркеров.
+    """
+    if config.PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path=config.PROMETHEUS_MULTIPROC_DIR)
+        return generate_latest(registry)
+    return generate_latest()
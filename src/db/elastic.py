@@ -1,7 +1,28 @@
 from elasticsearch import AsyncElasticsearch
 
+from core import config
+
 es: AsyncElasticsearch = None
 
+
+def create_elastic() -> AsyncElasticsearch:
+    """
+    Клиент эластика с настройками пула и запросов из config: maxsize -
+    сколько keep-alive соединений держать к каждому узлу, запросы дольше
+    ES_TIMEOUT секунд прерываются и повторяются на другом соединении.
+    """
+    return AsyncElasticsearch(
+        hosts=[f'{config.ELASTIC_HOST}:{config.ELASTIC_PORT}'],
+        maxsize=config.ES_POOL_MAXSIZE,
+        timeout=config.ES_TIMEOUT,
+        max_retries=config.ES_MAX_RETRIES,
+        retry_on_timeout=config.ES_RETRY_ON_TIMEOUT,
+        sniff_on_start=config.ES_SNIFF_ON_START,
+        sniff_on_connection_fail=config.ES_SNIFF_ON_CONNECTION_FAIL,
+        sniffer_timeout=config.ES_SNIFFER_TIMEOUT,
+        http_compress=config.ES_HTTP_COMPRESS,
+    )
+
 # Функция понадобится при внедрении зависимостей
 
 
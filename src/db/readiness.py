@@ -0,0 +1,41 @@
+"""
+Ожидание готовности эластика и редиса при старте воркера: пока они
+недоступны, воркер не принимает запросы, а не отвечает на них ошибками.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable
+
+from core import config
+
+logger = logging.getLogger(__name__)
+
+
+class NotReady(RuntimeError):
+    pass
+
+
+async def wait_ready(name: str, check: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Повторяет check каждые READINESS_INTERVAL секунд, пока он не вернёт
+    истинное значение без исключения, и возвращает это значение.
+    Если за READINESS_TIMEOUT секунд этого не случилось - NotReady.
+    """
+    deadline = time.monotonic() + config.READINESS_TIMEOUT
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            result = await check()
+            if result:
+                if attempt > 1:
+                    logger.info('%s is ready after %d attempts', name, attempt)
+                return result
+            error = 'check returned %r' % (result, )
+        except Exception as exc:
+            error = repr(exc)
+        if time.monotonic() >= deadline:
+            raise NotReady(f'{name} is not ready after {config.READINESS_TIMEOUT}s: {error}')
+        logger.warning('%s is not ready yet (%s), retrying', name, error)
+        await asyncio.sleep(config.READINESS_INTERVAL)
@@ -1,7 +1,21 @@
+import aioredis
 from aioredis import Redis
 
+from core import config
+
 redis: Redis = None
 
 
+async def create_redis() -> Redis:
+    """
+    Пул соединений редиса с размерами из config. Соединения minsize
+    открываются сразу, поэтому без доступного редиса вызов падает.
+    """
+    return await aioredis.create_redis_pool((config.REDIS_HOST, config.REDIS_PORT),
+                                            minsize=config.REDIS_POOL_MINSIZE,
+                                            maxsize=config.REDIS_POOL_MAXSIZE,
+                                            timeout=config.REDIS_CONNECT_TIMEOUT)
+
+
 async def get_redis() -> Redis:
     return redis
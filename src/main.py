@@ -1,15 +1,16 @@
+import asyncio
 import logging
 
-import aioredis
 import uvicorn as uvicorn
-from elasticsearch import AsyncElasticsearch
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.responses import ORJSONResponse
 
 from api.v1 import film, genre, person
-from core import config
+from core import config, metrics
 from core.logger import LOGGING
-from db import elastic, redis
+from db import elastic, readiness, redis
+from services import invalidation, person_films, prefix_index
+import warmup
 
 app = FastAPI(
     title=config.PROJECT_NAME,
@@ -21,17 +22,46 @@ app = FastAPI(
 
 @app.on_event('startup')
 async def startup():
-    redis.redis = await aioredis.create_redis_pool((config.REDIS_HOST, config.REDIS_PORT), minsize=10, maxsize=20)
-    elastic.es = AsyncElasticsearch(
-        hosts=[f'{config.ELASTIC_HOST}:{config.ELASTIC_PORT}'])
+    # пока эластик и редис недоступны, воркер не начинает принимать запросы
+    redis.redis = await readiness.wait_ready('redis', redis.create_redis)
+    elastic.es = elastic.create_elastic()
+    await readiness.wait_ready('elasticsearch', elastic.es.ping)
+    if config.METRICS_ENABLED:
+        redis.redis = metrics.InstrumentedRedis(redis.redis)
+        elastic.es = metrics.InstrumentedElasticsearch(elastic.es)
+    if config.PERSON_FILMS_INDEX_ENABLED:
+        app.state.person_films_refresh = asyncio.ensure_future(
+            person_films.refresh_periodically(redis.redis, elastic.es))
+    if config.SEARCH_PREFIX_INDEX_ENABLED:
+        app.state.prefix_index_refresh = asyncio.ensure_future(prefix_index.refresh_periodically(elastic.es))
+    if config.INVALIDATION_ENABLED:
+        app.state.invalidation_listener = asyncio.ensure_future(invalidation.listen())
+    if config.WARMUP_ENABLED:
+        # ограничен WARMUP_BUDGET, поэтому надолго готовность воркера не задерживает
+        await warmup.warm_up_once(app, redis.redis, elastic.es)
 
 
 @app.on_event('shutdown')
 async def shutdown():
+    if config.PERSON_FILMS_INDEX_ENABLED:
+        app.state.person_films_refresh.cancel()
+    if config.SEARCH_PREFIX_INDEX_ENABLED:
+        app.state.prefix_index_refresh.cancel()
+    if config.INVALIDATION_ENABLED:
+        app.state.invalidation_listener.cancel()
     await redis.redis.close()
     await elastic.es.close()
 
 
+@app.get('/metrics', include_in_schema=False)
+async def prometheus_metrics() -> Response:
+    metrics.observe_redis_pool(redis.redis)
+    metrics.observe_es_pool(elastic.es)
+    metrics.observe_memory_caches()
+    # тип передаётся заголовком: к media_type starlette добавил бы второй charset
+    return Response(metrics.render_metrics(), headers={'Content-Type': metrics.METRICS_CONTENT_TYPE})
+
+
 app.include_router(film.router, prefix='/v1/film', tags=['film'])
 app.include_router(genre.router, prefix='/v1/genre', tags=['genre'])
 app.include_router(person.router, prefix='/v1/person', tags=['person'])
@@ -0,0 +1,89 @@
+"""
+Быстрое создание и сериализация моделей без валидации pydantic.
+
+Используется для данных, которым можно доверять: документов из эластика
+и объектов, которые приложение само положило в кеш. Для страницы
+из тысячи фильмов валидация каждого объекта на каждом шаге
+(из кеша в модель сервиса, в модель ответа, в JSON) стоит дороже
+всего остального запроса, см. python -m bench.serialization.
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type, TypeVar
+from uuid import UUID
+
+import orjson
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_LIST, ModelField
+from pydantic.utils import lenient_issubclass
+
+Model = TypeVar('Model', bound=BaseModel)
+
+# имя поля, ключ в данных, значение по умолчанию, приведение типа
+_Field = Tuple[str, str, Any, Optional[Callable[[Any], Any]]]
+_fields: Dict[Type[BaseModel], List[_Field]] = {}
+
+
+def _uuid(value: Any) -> UUID:
+    return value if isinstance(value, UUID) else UUID(value)
+
+
+def _converter(field: ModelField) -> Optional[Callable[[Any], Any]]:
+    """
+    Приведение значения поля к типу модели. Нужно только там, где тип
+    в JSON теряется: UUID, float, который пришёл целым, и вложенные модели.
+    """
+    if field.type_ is UUID:
+        convert = _uuid
+    elif field.type_ is float:
+        convert = float
+    elif lenient_issubclass(field.type_, BaseModel):
+        nested = field.type_
+
+        def convert(data):
+            return construct(nested, data)
+    else:
+        return None
+    if field.shape == SHAPE_LIST:
+        return lambda values: [convert(value) for value in values]
+    return convert
+
+
+def _model_fields(model: Type[BaseModel]) -> List[_Field]:
+    if model not in _fields:
+        _fields[model] = [(name, field.alias, field.default, _converter(field))
+                          for name, field in model.__fields__.items()]
+    return _fields[model]
+
+
+def construct(model: Type[Model], data: Dict[str, Any]) -> Model:
+    """
+    Создаёт модель из словаря без валидации. Вложенные модели тоже создаются,
+    UUID и float приводятся к своим типам, лишние ключи игнорируются.
+    """
+    values = {}
+    for name, alias, default, convert in _model_fields(model):
+        value = data.get(alias, default)
+        if value is not None and convert is not None:
+            value = convert(value)
+        values[name] = value
+    # то же, что BaseModel.construct, но без копирования значений по умолчанию
+    obj = model.__new__(model)
+    object.__setattr__(obj, '__dict__', values)
+    object.__setattr__(obj, '__fields_set__', set(values))
+    return obj
+
+
+def model_data(obj: Any) -> Any:
+    """
+    default для сериализаторов: поля модели без промежуточного .dict().
+    """
+    if isinstance(obj, BaseModel):
+        return obj.__dict__['__root__'] if obj.__custom_root_type__ else obj.__dict__
+    raise TypeError(f'Type is not JSON serializable: {type(obj).__name__}')
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Сериализует модель (и вложенные модели) в JSON сразу через orjson,
+    без промежуточного .dict(). Результат такой же, как у orjson.dumps(obj.dict()).
+    """
+    return orjson.dumps(obj, default=model_data)
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 from uuid import UUID
 
 import orjson
@@ -31,3 +31,31 @@ class Film(BaseModel):
         # Заменяем стандартную работу с json на более быструю
         json_loads = orjson.loads
         json_dumps = orjson_dumps
+
+
+class FilmShort(BaseModel):
+    """
+    Краткая форма фильма для списков и поиска: только поля,
+    которые попадают в ответ API, без описания и участников.
+    """
+    id: UUID
+    title: str
+    imdb_rating: float
+
+    class Config:
+        # Заменяем стандартную работу с json на более быструю
+        json_loads = orjson.loads
+        json_dumps = orjson_dumps
+
+
+class FilmFacets(BaseModel):
+    """
+    Фасеты выборки фильмов: сколько фильмов найдено всего, у скольких
+    из них каждый жанр, актёр и режиссёр (id -> количество, по убыванию)
+    и сколько фильмов в каждом интервале рейтинга (нижняя граница -> количество).
+    """
+    total: int
+    genres: Dict[UUID, int]
+    imdb_rating: Dict[float, int]
+    actors: Dict[UUID, int]
+    directors: Dict[UUID, int]
@@ -0,0 +1,16 @@
+import asyncio
+from typing import Any, Awaitable, List
+
+
+async def gather_bounded(limit: int, *aws: Awaitable[Any]) -> List[Any]:
+    """
+    Как asyncio.gather, но одновременно выполняется не больше limit корутин.
+    Результаты возвращаются в порядке aws.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(aw: Awaitable[Any]) -> Any:
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*(run(aw) for aw in aws))
@@ -0,0 +1,99 @@
+"""
+Общее количество документов для постраничных списков.
+
+Точный hits.total заставляет эластик досчитывать все совпадения, даже если
+нужна одна первая страница. Поэтому для каждого списка можно выбрать:
+exact - считать точно в каждом запросе страницы,
+capped - считать до COUNT_TRACK_LIMIT, дальше количество отдаётся как "не меньше",
+cached - страница запрашивается без подсчёта, количество считается отдельным
+запросом с size=0 и хранится в редисе COUNT_CACHE_TTL секунд для каждого фильтра.
+"""
+import asyncio
+import hashlib
+from enum import Enum
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+import orjson
+from aioredis import Redis
+from elasticsearch import AsyncElasticsearch
+
+from core import config
+from services.cursor import search_page
+from services.fetch import request_cache_params
+
+
+class CountStrategy(Enum):
+    EXACT = 'exact'
+    CAPPED = 'capped'
+    CACHED = 'cached'
+
+
+class Total(NamedTuple):
+    value: int
+    # настоящее количество может быть больше value
+    at_least: bool = False
+
+
+def count_strategy(name: str) -> CountStrategy:
+    return CountStrategy(config.COUNT_STRATEGIES.get(name, config.COUNT_STRATEGY_DEFAULT))
+
+
+def track_total_hits(strategy: CountStrategy) -> Union[bool, int]:
+    if strategy is CountStrategy.EXACT:
+        return True
+    if strategy is CountStrategy.CAPPED:
+        return config.COUNT_TRACK_LIMIT
+    return False
+
+
+def count_keybuilder(index: str, query: Optional[Dict]) -> str:
+    digest = hashlib.blake2b(orjson.dumps(query, option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest()
+    return f'count:{index}:{digest}'
+
+
+async def cached_count(redis: Redis, elastic: AsyncElasticsearch, index: str, query: Optional[Dict]) -> int:
+    """
+    Количество документов, подходящих под query: из редиса, а при промахе -
+    запросом без документов, который эластик может взять из кеша запросов шардов.
+    """
+    key = count_keybuilder(index, query)
+    data = await redis.get(key)
+    if data is not None:
+        return int(data)
+    body = {'size': 0, 'track_total_hits': True}
+    if query is not None:
+        body['query'] = query
+    resp = await elastic.search(index=index, body=body, params=request_cache_params(None))
+    total = resp['hits']['total']['value']
+    await redis.set(key, total, expire=config.COUNT_CACHE_TTL)
+    return total
+
+
+async def search_page_with_total(name: str,
+                                 redis: Redis,
+                                 elastic: AsyncElasticsearch,
+                                 index: str,
+                                 body: Optional[Dict],
+                                 params: Optional[Dict],
+                                 sort: List[Dict],
+                                 sort_key: str,
+                                 offset: int,
+                                 limit: int,
+                                 cursor: Optional[str] = None) -> Tuple[Total, Dict, Optional[str]]:
+    """
+    То же, что search_page, но дополнительно возвращает общее количество
+    документов, посчитанное по стратегии COUNT_STRATEGY списка name.
+    """
+    strategy = count_strategy(name)
+    body = dict(body or {}, track_total_hits=track_total_hits(strategy))
+    if strategy is CountStrategy.CACHED:
+        # страница и количество запрашиваются одновременно
+        (resp, next_cursor), total = await asyncio.gather(
+            search_page(elastic, index, body, params, sort, sort_key, offset, limit, cursor),
+            cached_count(redis, elastic, index, body.get('query')),
+        )
+        return (Total(total), resp, next_cursor)
+
+    resp, next_cursor = await search_page(elastic, index, body, params, sort, sort_key, offset, limit, cursor)
+    hits_total = resp['hits']['total']
+    return (Total(hits_total['value'], hits_total['relation'] == 'gte'), resp, next_cursor)
@@ -0,0 +1,194 @@
+import base64
+import binascii
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import orjson
+from elasticsearch import AsyncElasticsearch, NotFoundError
+from pydantic import BaseModel
+
+from core import config
+from services.fetch import request_cache_params
+
+# index.max_result_window эластика по умолчанию: from + size не может быть больше
+MAX_RESULT_WINDOW = 10000
+
+# числовые поля сортировки, значения остальных полей в курсоре - строки
+NUMERIC_SORT_FIELDS = {'imdb_rating'}
+# так эластик отдаёт значение сортировки числового поля, если у документа его нет
+MISSING_NUMERIC_VALUES = {'Infinity', '-Infinity'}
+
+
+class InvalidCursor(ValueError):
+    """
+    Курсор не удалось разобрать или он выдан для другой сортировки.
+    """
+
+
+class Cursor(BaseModel):
+    """
+    Позиция в выдаче для пагинации через search_after.
+
+    search_after: значения полей сортировки последнего документа страницы
+    sort: сортировка, для которой выдан курсор
+    pit_id: id point-in-time контекста эластика, если он используется
+    """
+    search_after: List[Any]
+    sort: str
+    pit_id: Optional[str] = None
+
+    def encode(self) -> str:
+        data = {'a': self.search_after, 's': self.sort}
+        if self.pit_id:
+            data['p'] = self.pit_id
+        return base64.urlsafe_b64encode(orjson.dumps(data)).decode().rstrip('=')
+
+    @classmethod
+    def decode(cls, value: str) -> 'Cursor':
+        try:
+            padded = value + '=' * (-len(value) % 4)
+            data = orjson.loads(base64.urlsafe_b64decode(padded.encode()))
+            pit_id = data.get('p')
+            if pit_id is not None and not isinstance(pit_id, str):
+                raise InvalidCursor(value)
+            return cls.construct(search_after=list(data['a']),
+                                 sort=str(data['s']),
+                                 pit_id=pit_id)
+        except (binascii.Error, orjson.JSONDecodeError, KeyError, TypeError, ValueError):
+            raise InvalidCursor(value)
+
+    def check_sort(self, sort: str):
+        """
+        Проверяет, что курсор выдан для этой сортировки и в search_after
+        по одному значению подходящего типа на каждое поле сортировки,
+        чтобы подделанный курсор не дошёл до эластика.
+        """
+        if self.sort != sort:
+            raise InvalidCursor(f'cursor was issued for sort {self.sort!r}, not {sort!r}')
+        fields = [item.split(':', 1)[0] for item in sort.split(',')]
+        if len(self.search_after) != len(fields):
+            raise InvalidCursor(f'cursor has {len(self.search_after)} sort values, expected {len(fields)}')
+        for field, value in zip(fields, self.search_after):
+            if not _valid_sort_value(field, value):
+                raise InvalidCursor(f'bad cursor value {value!r} for {field}')
+
+
+def _valid_sort_value(field: str, value: Any) -> bool:
+    if field in NUMERIC_SORT_FIELDS:
+        if isinstance(value, str):
+            return value in MISSING_NUMERIC_VALUES
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return isinstance(value, str)
+
+
+async def search_page(elastic: AsyncElasticsearch,
+                      index: str,
+                      body: Optional[Dict],
+                      params: Optional[Dict],
+                      sort: List[Dict],
+                      sort_key: str,
+                      offset: int,
+                      limit: int,
+                      cursor: Optional[str] = None) -> Tuple[Dict, Optional[str]]:
+    """
+    Запрашивает страницу выдачи из эластика и возвращает ответ эластика
+    и курсор следующей страницы.
+
+    Без курсора страница выбирается через from/size, с курсором - через
+    search_after, тогда глубина страницы не влияет на стоимость запроса.
+    sort должен заканчиваться уникальным полем (id), чтобы курсор однозначно
+    задавал позицию. Если включён ES_CURSOR_POINT_IN_TIME, страницы по курсору
+    читаются из point-in-time контекста и не съезжают при изменении индекса,
+    остальные страницы могут отдаваться из кеша запросов шардов.
+
+    Запрашивается на один документ больше limit: курсор выдаётся, только если
+    следующая страница не пустая. На последней странице point-in-time контекст
+    закрывается, брошенные на середине контексты истекают через
+    ES_POINT_IN_TIME_KEEP_ALIVE.
+    """
+    body = dict(body or {})
+    body['sort'] = sort
+    # за пределами max_result_window лишний документ не запросить,
+    # тогда курсор выдаётся на любую полную страницу
+    lookahead = cursor is not None or offset + limit < MAX_RESULT_WINDOW
+    body['size'] = limit + 1 if lookahead else limit
+    pit_id = None
+    if cursor is None:
+        body['from'] = offset
+        resp = await elastic.search(index=index, body=body, params=request_cache_params(params))
+    else:
+        position = Cursor.decode(cursor)
+        position.check_sort(sort_key)
+        body['search_after'] = position.search_after
+        if config.ES_CURSOR_POINT_IN_TIME:
+            pit_id = position.pit_id or await _open_point_in_time(elastic, index)
+            try:
+                resp = await _search_point_in_time(elastic, body, params, pit_id)
+            except NotFoundError:
+                # контекст истёк - продолжаем с той же позиции в новом
+                pit_id = await _open_point_in_time(elastic, index)
+                resp = await _search_point_in_time(elastic, body, params, pit_id)
+            pit_id = resp.get('pit_id', pit_id)
+        else:
+            resp = await elastic.search(index=index, body=body, params=request_cache_params(params))
+
+    hits = resp['hits']['hits']
+    next_cursor = None
+    if len(hits) > limit or (not lookahead and len(hits) == limit):
+        hits = hits[:limit]
+        # ответ эластика не меняем на месте, клиент может держать его у себя
+        resp = dict(resp, hits=dict(resp['hits'], hits=hits))
+        next_cursor = Cursor.construct(search_after=hits[-1]['sort'],
+                                       sort=sort_key,
+                                       pit_id=pit_id).encode()
+    elif pit_id is not None:
+        await _close_point_in_time(elastic, pit_id)
+    return (resp, next_cursor)
+
+
+async def _open_point_in_time(elastic: AsyncElasticsearch, index: str) -> str:
+    resp = await elastic.open_point_in_time(index=index,
+                                            params={'keep_alive': config.ES_POINT_IN_TIME_KEEP_ALIVE})
+    return resp['id']
+
+
+async def _close_point_in_time(elastic: AsyncElasticsearch, pit_id: str):
+    try:
+        await elastic.close_point_in_time(body={'id': pit_id})
+    except NotFoundError:
+        # контекст уже истёк
+        pass
+
+
+async def _search_point_in_time(elastic: AsyncElasticsearch,
+                                body: Dict,
+                                params: Optional[Dict],
+                                pit_id: str) -> Dict:
+    # запрос в point-in-time контекст идёт без указания индекса
+    body = dict(body, pit={'id': pit_id, 'keep_alive': config.ES_POINT_IN_TIME_KEEP_ALIVE})
+    return await elastic.search(body=body, params=params)
+
+
+async def scan_by_id(elastic: AsyncElasticsearch,
+                     index: str,
+                     batch_size: int,
+                     after: Optional[str] = None,
+                     body: Optional[Dict] = None,
+                     params: Optional[Dict] = None) -> AsyncIterator[List[Dict]]:
+    """
+    Обходит весь индекс в порядке id пачками по batch_size документов
+    через search_after. В памяти держится только текущая пачка.
+    after - id, после которого начинать обход (для продолжения прерванного обхода).
+    """
+    body = dict(body or {})
+    body['sort'] = [{'id': 'asc'}]
+    body['size'] = batch_size
+    if after is not None:
+        body['search_after'] = [after]
+    while True:
+        resp = await elastic.search(index=index, body=body, params=params)
+        hits = resp['hits']['hits']
+        if hits:
+            yield hits
+        if len(hits) < batch_size:
+            return
+        body['search_after'] = hits[-1]['sort']
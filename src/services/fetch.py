@@ -0,0 +1,102 @@
+from enum import Enum
+from typing import Any, Dict, List, Optional, Union
+
+from core import config
+
+
+class FetchStrategy(Enum):
+    # поиск возвращает только id, документы берутся из кеша, промахи - через mget
+    IDS = 'ids'
+    # документы приходят сразу в ответе поиска, кеш по id заполняется из них
+    SOURCE = 'source'
+    # стратегия выбирается по измеренной доле попаданий в кеш
+    AUTO = 'auto'
+
+
+class FetchPlanner:
+    """
+    Выбирает, как метод сервиса получает документы из эластика.
+
+    В режиме AUTO по запросам через кеш считается скользящее среднее доли
+    попаданий. Пока она не ниже порога, выгоднее IDS: большая часть документов
+    берётся из кеша. Если ниже - SOURCE: один запрос в эластик вместо двух.
+    Раз в probe_every запросов AUTO всё равно идёт через кеш, чтобы заметить,
+    что доля попаданий выросла.
+    """
+
+    def __init__(self,
+                 name: str,
+                 strategy: FetchStrategy,
+                 threshold: float,
+                 probe_every: int,
+                 alpha: float = 0.2):
+        self.name = name
+        self.strategy = strategy
+        self.threshold = threshold
+        self.probe_every = probe_every
+        self.alpha = alpha
+        self.hit_ratio: Optional[float] = None
+        self._requests = 0
+
+    def choose(self) -> FetchStrategy:
+        if self.strategy is not FetchStrategy.AUTO:
+            return self.strategy
+        self._requests += 1
+        if self.hit_ratio is None or self.hit_ratio >= self.threshold:
+            return FetchStrategy.IDS
+        if self._requests % self.probe_every == 0:
+            return FetchStrategy.IDS
+        return FetchStrategy.SOURCE
+
+    def record(self, hits: int, total: int):
+        """
+        Учитывает результат обращения к кешу: сколько из total объектов нашлось.
+        """
+        if total == 0:
+            return
+        ratio = hits / total
+        if self.hit_ratio is None:
+            self.hit_ratio = ratio
+        else:
+            self.hit_ratio = self.alpha * ratio + (1 - self.alpha) * self.hit_ratio
+
+
+def source_params(source: Union[bool, List[str]]) -> Dict[str, Any]:
+    """
+    Параметры запроса поиска в эластик для получения документов в ответе:
+    False - только id, True - документ целиком, список - только эти поля.
+    """
+    if source is True:
+        return {}
+    if not source:
+        return {'_source': False}
+    return {'_source_includes': ','.join(source)}
+
+
+def request_cache_params(params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Добавляет к параметрам поиска request_cache. Только для детерминированных
+    запросов: подсчётов (size=0) и страниц с однозначной сортировкой -
+    эластик кеширует ответ целиком, а страницы без этого флага не кеширует.
+    """
+    params = dict(params or {})
+    if config.ES_REQUEST_CACHE:
+        params['request_cache'] = 'true'
+    return params
+
+
+_planners: Dict[str, FetchPlanner] = {}
+
+
+def get_fetch_planner(name: str) -> FetchPlanner:
+    """
+    Возвращает планировщик для метода сервиса (film_list, film_search, ...),
+    при первом обращении создаёт его по настройкам FETCH_STRATEGY*.
+    """
+    if name not in _planners:
+        strategy = config.FETCH_STRATEGIES.get(name, config.FETCH_STRATEGY_DEFAULT)
+        _planners[name] = FetchPlanner(name=name,
+                                       strategy=FetchStrategy(strategy),
+                                       threshold=config.FETCH_AUTO_HIT_RATIO,
+                                       probe_every=config.FETCH_AUTO_PROBE_EVERY)
+    return _planners[name]
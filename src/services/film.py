@@ -1,6 +1,6 @@
 import re
 from functools import lru_cache
-from typing import Optional, List, Dict, Tuple
+from typing import Optional, List, Dict, Tuple, AsyncIterator, Union, Callable
 from uuid import UUID
 from enum import Enum
 from collections import OrderedDict
@@ -12,13 +12,29 @@ from starlette.datastructures import QueryParams
 from fastapi import Depends
 
 
+from core import config
 from db.elastic import get_elastic
 from db.redis import get_redis
+from cache.memory import get_memory_cache
 from cache.redis import RedisCache
-from models.film import Film
+from cache.singleflight import get_single_flight
+from cache.tags import add_response_tags, collection_tag
+from cache.tiered import TieredCache
+from models.film import Film, FilmFacets, FilmShort
+from models.fast import construct
+from services.count import Total, search_page_with_total
+from services.cursor import MAX_RESULT_WINDOW, scan_by_id
+from services.concurrency import gather_bounded
+from services.fetch import FetchStrategy, get_fetch_planner, request_cache_params, source_params
+from services.person_films import PersonFilmsIndex, get_person_films_index
+from services.prefix_index import get_prefix_index
 
 DEFAULT_LIST_SIZE = 1000
 FILMS_INDEX = 'movies'
+# поля, которые попадают в выгрузку каталога
+EXPORT_FIELDS = ['id', 'title', 'imdb_rating', 'description', 'genres', 'actors', 'writers', 'directors']
+# поля краткой формы фильма, только их запрашиваем из эластика для списков и поиска
+SHORT_FIELDS = list(FilmShort.__fields__.keys())
 
 
 class Roles(Enum):
@@ -79,45 +95,90 @@ class FilterBy(BaseModel):
     value: str
 
     @classmethod
-    def from_query_params(cls, query: QueryParams):
+    def from_query_params(cls, query: QueryParams) -> List['FilterBy']:
         """
-        Парсит набор query параметров и возвращает FilterBy либо None.
+        Парсит набор query параметров и возвращает все фильтры из них,
+        фильм должен подходить под каждый.
         """
-        for k, v in query.items():
+        filters = []
+        for k, v in query.multi_items():
             if k.startswith('filter'):
                 match = re.match('filter\[(.+)\]', k)  # noqa: W605
-                if match:
-                    return cls.construct(attr=match[1], value=v)
-        return None
+                # неизвестные фильтры не учитываются, как и в ключе кеша ответов
+                if match and match[1] in FILTERBY_PATHS:
+                    filters.append(cls.construct(attr=match[1], value=v))
+        return filters
 
 
 def films_keybuilder(film_id: UUID) -> str:
     return f'film:{str(film_id)}'
 
 
-def _build_filter_query(filter_by: FilterBy) -> Dict:
+def films_short_keybuilder(film_id: UUID) -> str:
+    return f'film_short:{str(film_id)}'
+
+
+def _build_filter_query(filters: List[FilterBy]) -> Dict:
     """
-    Формирует поисковый запрос для фильтрации по аттрибутам фильма
+    Формирует поисковый запрос для фильтрации по аттрибутам фильма.
+    Условия стоят в контексте фильтра: эластик не считает по ним релевантность
+    и кеширует их результаты, а фильм должен подходить под все условия.
     """
-    path = FILTERBY_PATHS.get(filter_by.attr, 'actors')
-    return {
-        'query': {
+    conditions = []
+    for filter_by in filters:
+        path = FILTERBY_PATHS.get(filter_by.attr, 'actors')
+        conditions.append({
             'nested': {
                 'path': path,
                 'query': {
-                    'match': {f'{path}.id': filter_by.value}
+                    'term': {f'{path}.id': filter_by.value}
                 }
             }
+        })
+    return {
+        'query': {
+            'bool': {
+                'filter': conditions
+            }
         }
     }
 
 
+def _build_facets_query(filters: List[FilterBy]) -> Dict:
+    """
+    Формирует запрос фасетов: только агрегации, без документов.
+    """
+    body = _build_filter_query(filters) if filters else {}
+    body['size'] = 0
+    body['track_total_hits'] = True
+    body['aggs'] = {
+        'imdb_rating': {
+            'histogram': {'field': 'imdb_rating', 'interval': config.FACETS_RATING_INTERVAL}
+        }
+    }
+    for name, size in (('genres', config.FACETS_GENRES_SIZE),
+                       ('actors', config.FACETS_PERSONS_SIZE),
+                       ('directors', config.FACETS_PERSONS_SIZE)):
+        body['aggs'][name] = {
+            'nested': {'path': name},
+            'aggs': {
+                'ids': {'terms': {'field': f'{name}.id', 'size': size}}
+            }
+        }
+    return body
+
+
 def _build_person_role_query(person_id: UUID) -> List:
     result = []
     for role in Roles:
         result.append({})
         result.append(
             {
+                '_source': False,
+                # фильмы персоны в порядке id, как их отдаёт индекс персона -> фильмы,
+                # а не первые 10 по умолчанию
+                'size': min(config.PERSON_FILMS_MSEARCH_SIZE, MAX_RESULT_WINDOW),
+                'sort': [{'id': 'asc'}],
                 'query': {
                     'nested': {
                         'path': role.value,
@@ -147,181 +208,294 @@ def _build_film_serch_query(query: str) -> List:
 
 class FilmService:
 
-    def __init__(self, cache: RedisCache, elastic: AsyncElasticsearch):
+    def __init__(self,
+                 cache: TieredCache,
+                 elastic: AsyncElasticsearch,
+                 short_cache: TieredCache,
+                 person_films: Optional[PersonFilmsIndex] = None):
         self.cache = cache
         self.elastic = elastic
+        # краткие формы фильмов кешируются отдельно от полных
+        self.short_cache = short_cache
+        # индекс персона -> фильмы, если выключен - фильмы персон ищутся в эластике
+        self.person_films = person_films
 
     async def get_by_id(self, film_id: UUID) -> Optional[Film]:
         """
         Возвращает объект фильма. Он опционален, так как
         фильм может отсутствовать в базе
         """
-        data = await self.cache.get(film_id)
-        if data:
-            return Film.parse_raw(data)
-
-        docs = await self._es_get_by_ids([film_id, ])
-        if not docs:
-            return None
-        film = Film(**docs[0])
-        await self.cache.put(film.id, film.json())
-
-        return film
+        films = await self.cache.get_or_load([film_id, ], self._load_from_elastic)
+        return films.get(film_id)
 
     async def list(self,
                    page_number: int,
                    page_size: int,
                    sort_by: Optional[SortBy] = None,
-                   filter_by: Optional[FilterBy] = None,) -> Tuple[int, List[Film]]:
+                   filters: Optional[List[FilterBy]] = None,
+                   cursor: Optional[str] = None,
+                   short: bool = False) -> Tuple[Total, List[Union[Film, FilmShort]], Optional[str]]:
         """
-        Возвращает общее количество фильмов и список фильмов с учётом сортировки и фильтрации.
+        Возвращает общее количество фильмов, список фильмов с учётом сортировки
+        и фильтрации и курсор следующей страницы.
+        Если передан курсор, страница выбирается по нему, а не по номеру.
+        short - вернуть краткие формы фильмов (FilmShort).
         """
-        # получаем только ID фильмов
         limit = page_size
         offset = page_size * (page_number - 1)
-        films_total, film_ids = await self._es_get_all(offset, limit, sort_by, filter_by)
-        # OrderedDict позволяет сохранить исходный порядок сортировки
-        films = OrderedDict.fromkeys(film_ids, None)
-
-        # проверяем есть ли полученные фильмы в кеше по их ID
-        for film_id in films.keys():
-            data = await self.cache.get(film_id)
-            if data:
-                films[film_id] = Film.parse_raw(data)
-
-        # не найденные в кеше фильмы запрашиваем в эластике и кладём в кеш
-        not_found = [film_id for film_id in films.keys()
-                     if films[film_id] is None]
-        if not_found:
-            docs = await self._es_get_by_ids(not_found)
-            for doc in docs:
-                film = Film(**doc)
-                await self.cache.put(film.id, film.json())
-                films[film.id] = film
-        return (films_total, list(films.values()))
-
-    async def get_by_person_id(self, person_id: UUID) -> Dict[Roles, List[Film]]:
-        """
-        Возвращает фильмы в которых участвовала персона
+        add_response_tags([collection_tag('film')])
+        planner = get_fetch_planner('film_list')
+        if planner.choose() is FetchStrategy.SOURCE:
+            # фильмы приходят сразу в ответе поиска
+            films_total, hits, next_cursor = await self._es_get_all(offset, limit, sort_by, filters, cursor,
+                                                                    source=SHORT_FIELDS if short else True)
+            films = await self._cache_hits(hits, short)
+            return (films_total, films, next_cursor)
+
+        # получаем только ID фильмов, сами фильмы - из кеша
+        films_total, hits, next_cursor = await self._es_get_all(offset, limit, sort_by, filters, cursor)
+        film_ids = [UUID(hit['_id']) for hit in hits]
+        films = await self.get_by_ids(film_ids, short=short, on_lookup=planner.record)
+        return (films_total, films, next_cursor)
+
+    async def get_by_person_id(self, person_id: UUID) -> Dict[str, List[FilmShort]]:
+        """
+        Возвращает краткие формы фильмов, в которых участвовала персона,
         в разрезе по ролям
         """
-        film_ids_by_role = await self._es_get_by_person(person_id)
-        films_by_role = {}
-        for role, film_ids in film_ids_by_role.items():
-            role_film_ids = OrderedDict.fromkeys(film_ids, None)
-            # ищем есть ли фильмы в кеше
-            for film_id in role_film_ids.keys():
-                data = await self.cache.get(film_id)
-                if data:
-                    role_film_ids[film_id] = Film.parse_raw(data)
-
-            not_found = [film_id for film_id in role_film_ids.keys()
-                         if role_film_ids[film_id] is None]
-
-            # если нет, запрашиваем их в эластике
-            if not_found:
-                docs = await self._es_get_by_ids(not_found)
-                for doc in docs:
-                    film = Film(**doc)
-                    await self.cache.put(film.id, film.json())
-                    role_film_ids[film.id] = film
+        films_by_person = await self.get_by_person_ids([person_id, ])
+        return films_by_person[person_id]
 
-            # кладем список фильмов в результирующую структуру
-            films_by_role[role] = list(role_film_ids.values())
-
-        return films_by_role
+    async def get_ids_by_person_ids(self, person_ids: List[UUID]) -> Dict[UUID, Dict[str, List[UUID]]]:
+        """
+        Возвращает id фильмов для каждой из персон в разрезе по ролям, без самих фильмов.
+        Id берутся из индекса персона -> фильмы, пока он не построен - через msearch.
+        """
+        film_ids_by_person = None
+        if self.person_films is not None:
+            film_ids_by_person = await self.person_films.get_many(person_ids)
+        if film_ids_by_person is None:
+            # большие пачки персон делим на несколько msearch, которые идут параллельно
+            chunk_size = config.PERSON_FILMS_MSEARCH_CHUNK
+            chunks = [person_ids[i:i + chunk_size] for i in range(0, len(person_ids), chunk_size)]
+            film_ids_by_person = {}
+            for chunk_result in await gather_bounded(config.ES_MAX_CONCURRENT_REQUESTS,
+                                                     *(self._es_get_by_persons(chunk) for chunk in chunks)):
+                film_ids_by_person.update(chunk_result)
+        return film_ids_by_person
+
+    async def get_by_person_ids(self, person_ids: List[UUID]) -> Dict[UUID, Dict[str, List[FilmShort]]]:
+        """
+        Возвращает краткие формы фильмов для каждой из персон в разрезе по ролям.
+        Id фильмов всех персон и ролей - из get_ids_by_person_ids,
+        сами фильмы - одной пачкой из кеша и эластика.
+        """
+        film_ids_by_person = await self.get_ids_by_person_ids(person_ids)
+
+        all_film_ids = []
+        for film_ids_by_role in film_ids_by_person.values():
+            for film_ids in film_ids_by_role.values():
+                all_film_ids.extend(film_ids)
+        films = {film.id: film for film in await self.get_by_ids(all_film_ids, short=True) if film}
+
+        films_by_person = {}
+        for person_id, film_ids_by_role in film_ids_by_person.items():
+            films_by_person[person_id] = {
+                role: [films[film_id] for film_id in film_ids if film_id in films]
+                for role, film_ids in film_ids_by_role.items()
+            }
+        return films_by_person
 
-    async def get_by_ids(self, film_ids: List[UUID]) -> Optional[List[Film]]:
+    async def get_by_ids(self,
+                         film_ids: List[UUID],
+                         short: bool = False,
+                         on_lookup: Optional[Callable[[int, int], None]] = None
+                         ) -> Optional[List[Union[Film, FilmShort]]]:
         """
         Возвращает фильмы по списку id.
+        short - вернуть краткие формы фильмов: из эластика запрашиваются
+        только их поля, в кеше они лежат под отдельными ключами.
+        on_lookup - получает количество найденных в кеше и запрошенных фильмов.
         """
+        # OrderedDict позволяет сохранить исходный порядок сортировки
         films = OrderedDict.fromkeys(film_ids, None)
 
-        # проверяем есть ли полученные жанры в кеше по их ID
-        for film_id in films.keys():
-            data = await self.cache.get(film_id)
-            if data:
-                films[film_id] = Film.parse_raw(data)
-
-        # не найденные в кеше персоны запрашиваем в эластике и кладём в кеш
-        not_found = [film_id for film_id in films.keys()
-                     if films[film_id] is None]
-        if not_found:
-            docs = await self._es_get_by_ids(not_found)
-            for doc in docs:
-                film = Film(**doc)
-                await self.cache.put(film.id, film.json())
-                films[film.id] = film
+        if short:
+            cache, loader = self.short_cache, self._load_short_from_elastic
+        else:
+            cache, loader = self.cache, self._load_from_elastic
+        # ищем фильмы сначала в памяти воркера, недостающие - одним MGET в редисе,
+        # не найденные в кеше запрашиваем в эластике и кладём в кеш пачкой
+        films.update(await cache.get_or_load(list(films.keys()), loader, on_lookup))
         return list(films.values())
 
-    async def search(self, query: str) -> Optional[List[Film]]:
+    async def _cache_hits(self, hits: List[dict], short: bool) -> List[Union[Film, FilmShort]]:
+        """
+        Разбирает фильмы из ответа поиска и кладёт их в кеш по id,
+        чтобы следующие запросы по этим фильмам не ходили в эластик.
+        """
+        if short:
+            cache, model = self.short_cache, FilmShort
+        else:
+            cache, model = self.cache, Film
+        films = [construct(model, hit['_source']) for hit in hits]
+        await cache.put_many(films)
+        return films
+
+    async def search(self, query: str, short: bool = False) -> Optional[List[Union[Film, FilmShort]]]:
         """
         Поиск по фильмам.
         """
-        person_ids = await self._es_search_by_query(query)
-        if not person_ids:
+        add_response_tags([collection_tag('film')])
+        planner = get_fetch_planner('film_search')
+        if planner.choose() is FetchStrategy.SOURCE:
+            hits = await self._es_search_by_query(query, source=SHORT_FIELDS if short else True)
+            if not hits:
+                return None
+            return await self._cache_hits(hits, short)
+
+        hits = await self._es_search_by_query(query)
+        if not hits:
             return None
 
-        return await self.get_by_ids(person_ids)
+        film_ids = [UUID(hit['_id']) for hit in hits]
+        return await self.get_by_ids(film_ids, short=short, on_lookup=planner.record)
 
-    async def _es_search_by_query(self, query: str) -> List[dict]:
+    async def facets(self, filters: Optional[List[FilterBy]] = None) -> FilmFacets:
+        """
+        Возвращает фасеты фильмов, подходящих под фильтры, одним запросом
+        агрегаций в эластик, без получения самих фильмов.
         """
-        Отправляет поисковый запрос в эластик и возвращает полученные фильмы
+        add_response_tags([collection_tag('film')])
+        resp = await self.elastic.search(index=FILMS_INDEX, body=_build_facets_query(filters or []),
+                                         params=request_cache_params(None))
+        aggs = resp['aggregations']
+        return FilmFacets.construct(
+            total=resp['hits']['total']['value'],
+            genres={UUID(bucket['key']): bucket['doc_count'] for bucket in aggs['genres']['ids']['buckets']},
+            imdb_rating={bucket['key']: bucket['doc_count'] for bucket in aggs['imdb_rating']['buckets']},
+            actors={UUID(bucket['key']): bucket['doc_count'] for bucket in aggs['actors']['ids']['buckets']},
+            directors={UUID(bucket['key']): bucket['doc_count'] for bucket in aggs['directors']['ids']['buckets']},
+        )
+
+    async def suggest(self, prefix: str, size: int) -> List[FilmShort]:
         """
-        params = {"_source": False}
+        Автодополнение названий фильмов. Если включён префиксный индекс в памяти
+        воркера, отвечает он (совпадение с началом любого слова названия), иначе
+        или когда индекс ничего не нашёл - completion suggester эластика:
+        поиск идёт по префиксному автомату, без полнотекстового подсчёта релевантности.
+        """
+        add_response_tags([collection_tag('film')])
+        if config.SEARCH_PREFIX_INDEX_ENABLED:
+            film_ids = get_prefix_index('film').search(prefix, size)
+            if film_ids:
+                films = await self.get_by_ids(film_ids, short=True)
+                films = [film for film in films if film]
+                if films:
+                    return films
+
+        body = {
+            'suggest': {
+                'title': {
+                    'prefix': prefix,
+                    'completion': {'field': 'title.suggest', 'size': size, 'skip_duplicates': True},
+                }
+            }
+        }
+        resp = await self.elastic.search(index=FILMS_INDEX, body=body, params=source_params(SHORT_FIELDS))
+        options = resp['suggest']['title'][0]['options']
+        return await self._cache_hits(options, short=True)
+
+    async def _es_search_by_query(self, query: str, source: Union[bool, List[str]] = False) -> List[dict]:
+        """
+        Отправляет поисковый запрос в эластик и возвращает найденные документы.
+        source - False (только id), True (документ целиком) или список полей документа.
+        """
+        params = source_params(source)
         body = _build_film_serch_query(query)
         docs = await self.elastic.search(index=FILMS_INDEX, body=body, params=params)
-        ids = [UUID(doc['_id']) for doc in docs['hits']['hits']]
-        return ids
+        return docs['hits']['hits']
 
-    async def _es_get_by_ids(self, film_ids: List[UUID]) -> List[dict]:
+    async def export(self, after: Optional[UUID] = None) -> AsyncIterator[List[dict]]:
         """
-        Получает фильмы из elasticsearch по списку id
+        Выгружает все фильмы пачками в порядке id, начиная после after.
+        Документы отдаются как есть из эластика, только с полями EXPORT_FIELDS,
+        без разбора в модели и без кеша.
+        """
+        params = {'_source_includes': ','.join(EXPORT_FIELDS)}
+        after_id = str(after) if after else None
+        async for hits in scan_by_id(self.elastic, FILMS_INDEX, config.EXPORT_BATCH_SIZE, after_id, params=params):
+            yield [hit['_source'] for hit in hits]
+
+    async def _load_from_elastic(self, film_ids: List[UUID]) -> List[Film]:
+        """
+        Загружает фильмы из elasticsearch по списку id, для кеша.
+        """
+        docs = await self._es_get_by_ids(film_ids)
+        return [construct(Film, doc) for doc in docs]
+
+    async def _load_short_from_elastic(self, film_ids: List[UUID]) -> List[FilmShort]:
+        """
+        Загружает краткие формы фильмов из elasticsearch по списку id, для кеша.
+        """
+        docs = await self._es_get_by_ids(film_ids, fields=SHORT_FIELDS)
+        return [construct(FilmShort, doc) for doc in docs]
+
+    async def _es_get_by_ids(self, film_ids: List[UUID], fields: Optional[List[str]] = None) -> List[dict]:
+        """
+        Получает фильмы из elasticsearch по списку id.
+        fields - получить из _source только эти поля.
         """
         doc_ids = [{'_id': film_id} for film_id in film_ids]
-        resp = await self.elastic.mget(index=FILMS_INDEX, body={'docs': doc_ids})
-        docs = [doc['_source'] for doc in resp['docs']]
+        params = None
+        if fields:
+            params = {'_source_includes': ','.join(fields)}
+        resp = await self.elastic.mget(index=FILMS_INDEX, body={'docs': doc_ids}, params=params)
+        docs = [doc['_source'] for doc in resp['docs'] if doc.get('found')]
         return docs
 
     async def _es_get_all(self,
                           offset: int,
                           limit: int,
                           sort_by: Optional[SortBy] = None,
-                          filter_by: Optional[FilterBy] = None) -> Tuple[int, List[UUID]]:
+                          filters: Optional[List[FilterBy]] = None,
+                          cursor: Optional[str] = None,
+                          source: Union[bool, List[str]] = False) -> Tuple[Total, List[dict], Optional[str]]:
         """
-        Возвращает общее кол-во фильмов и список id фильмов из elasticsearch
-        с учётом сортировки и фильтрации.
+        Возвращает общее кол-во фильмов, найденные документы из elasticsearch
+        с учётом сортировки и фильтрации и курсор следующей страницы.
+        source - False (только id), True (документ целиком) или список полей документа.
         """
-        params = {
-            '_source': False,
-            'size': limit,
-            'from': offset
-        }
+        params = source_params(source)
+        # id в конце сортировки делает порядок однозначным для search_after
+        sort = [{'id': 'asc'}]
+        sort_key = 'id:asc'
         if sort_by:
-            params.update({'sort': f'{sort_by.attr}:{sort_by.order.value}'})
+            sort.insert(0, {sort_by.attr: sort_by.order.value})
+            sort_key = f'{sort_by.attr}:{sort_by.order.value},{sort_key}'
         body = None
-        if filter_by:
-            body = _build_filter_query(filter_by)
-        docs = await self.elastic.search(index=FILMS_INDEX, params=params, body=body)
-        ids = [UUID(doc['_id']) for doc in docs['hits']['hits']]
-        total = docs['hits']['total']['value']
-        return (total, ids)
-
-    async def _es_get_by_person(self, person_id: UUID) -> Dict[Roles, List[UUID]]:
+        if filters:
+            body = _build_filter_query(filters)
+        total, docs, next_cursor = await search_page_with_total('film_list', self.cache.redis_cache.redis,
+                                                                self.elastic, FILMS_INDEX, body, params,
+                                                                sort, sort_key, offset, limit, cursor)
+        return (total, docs['hits']['hits'], next_cursor)
+
+    async def _es_get_by_persons(self, person_ids: List[UUID]) -> Dict[UUID, Dict[str, List[UUID]]]:
         """
-        Возвращает список id фильмов из elasticsearch в которых участовала
-        указанная персона
+        Возвращает id фильмов из elasticsearch, в которых участвовали
+        указанные персоны, в разрезе по ролям. Все запросы идут одним msearch.
         """
-        body = _build_person_role_query(person_id)
+        body = []
+        for person_id in person_ids:
+            body.extend(_build_person_role_query(person_id))
         docs = await self.elastic.msearch(index=FILMS_INDEX, body=body)
-        actor, writer, director = docs['responses']
+        responses = iter(docs['responses'])
         films = {}
-        films[Roles.ACTOR.value] = [UUID(doc['_id'])
-                                    for doc in actor['hits']['hits']]
-        films[Roles.WRITER.value] = [UUID(doc['_id'])
-                                     for doc in writer['hits']['hits']]
-        films[Roles.DIRECTOR.value] = [UUID(doc['_id'])
-                                       for doc in director['hits']['hits']]
+        for person_id in person_ids:
+            # ответы идут в порядке запросов: по персонам, внутри - по Roles
+            films[person_id] = {role.value: [UUID(doc['_id']) for doc in next(responses)['hits']['hits']]
+                                for role in Roles}
         return films
 
 
@@ -330,6 +504,18 @@ def get_film_service(
         redis: Redis = Depends(get_redis),
         elastic: AsyncElasticsearch = Depends(get_elastic),
 ) -> FilmService:
-    return FilmService(RedisCache(redis=redis,
-                                  keybuilder=films_keybuilder),
-                       elastic)
+    return FilmService(TieredCache(memory=get_memory_cache('film'),
+                                   redis_cache=RedisCache(redis=redis,
+                                                          keybuilder=films_keybuilder,
+                                                          ttl=config.OBJECT_CACHE_TTL),
+                                   model=Film,
+                                   flight=get_single_flight(redis)),
+                       elastic,
+                       TieredCache(memory=get_memory_cache('film_short'),
+                                   redis_cache=RedisCache(redis=redis,
+                                                          keybuilder=films_short_keybuilder,
+                                                          ttl=config.OBJECT_CACHE_TTL),
+                                   model=FilmShort,
+                                   flight=get_single_flight(redis),
+                                   entity='film'),
+                       get_person_films_index(redis) if config.PERSON_FILMS_INDEX_ENABLED else None)
@@ -1,6 +1,6 @@
 from functools import lru_cache
 from uuid import UUID
-from typing import Optional, List, Tuple
+from typing import Optional, List, Tuple, AsyncIterator, Callable, Union
 from collections import OrderedDict
 
 from aioredis import Redis
@@ -8,12 +8,23 @@ from elasticsearch import AsyncElasticsearch
 from fastapi import Depends
 
 
+from core import config
 from db.elastic import get_elastic
 from db.redis import get_redis
+from cache.memory import get_memory_cache
 from cache.redis import RedisCache
+from cache.singleflight import get_single_flight
+from cache.tags import add_response_tags, collection_tag
+from cache.tiered import TieredCache
 from models.genre import Genre
+from models.fast import construct
+from services.count import Total, search_page_with_total
+from services.cursor import scan_by_id
+from services.fetch import FetchStrategy, get_fetch_planner, source_params
 
 GENRES_INDEX = 'genres'
+# поля, которые попадают в выгрузку каталога
+EXPORT_FIELDS = ['id', 'name']
 
 
 def genres_keybuilder(genre_id: UUID) -> str:
@@ -21,7 +32,7 @@ def genres_keybuilder(genre_id: UUID) -> str:
 
 
 class GenreService:
-    def __init__(self, cache: RedisCache, elastic: AsyncElasticsearch):
+    def __init__(self, cache: TieredCache, elastic: AsyncElasticsearch):
         self.cache = cache
         self.elastic = elastic
 
@@ -30,44 +41,64 @@ class GenreService:
         Возвращает объект жанра. Он опционален, так как
         жанр может отсутствовать в базе
         """
-        data = await self.cache.get(genre_id)
-        if data:
-            return Genre.parse_raw(data)
-
-        docs = await self._es_get_by_ids([genre_id, ])
-        if not docs:
-            return None
-        genre = Genre(**docs[0])
-        await self.cache.put(genre.id, genre.json())
+        genres = await self.cache.get_or_load([genre_id, ], self._load_from_elastic)
+        return genres.get(genre_id)
 
     async def list(self,
                    page_number: int,
-                   page_size: int) -> Tuple[int, List[Genre]]:
+                   page_size: int,
+                   cursor: Optional[str] = None) -> Tuple[Total, List[Genre], Optional[str]]:
         """
         Возвращает все жанры
         """
-        # получаем только ID жанров
         limit = page_size
         offset = page_size * (page_number - 1)
-        genres_total, genre_ids = await self._es_get_all(offset, limit)
+        add_response_tags([collection_tag('genre')])
+        planner = get_fetch_planner('genre_list')
+        if planner.choose() is FetchStrategy.SOURCE:
+            # жанры приходят сразу в ответе поиска
+            genres_total, hits, next_cursor = await self._es_get_all(offset, limit, cursor, source=True)
+            genres = [construct(Genre, hit['_source']) for hit in hits]
+            await self.cache.put_many(genres)
+            return (genres_total, genres, next_cursor)
+
+        # получаем только ID жанров, сами жанры - из кеша
+        genres_total, hits, next_cursor = await self._es_get_all(offset, limit, cursor)
+        genre_ids = [UUID(hit['_id']) for hit in hits]
+        genres = await self.get_by_ids(genre_ids, on_lookup=planner.record)
+        return (genres_total, genres, next_cursor)
+
+    async def get_by_ids(self,
+                         genre_ids: List[UUID],
+                         on_lookup: Optional[Callable[[int, int], None]] = None) -> List[Genre]:
+        """
+        Возвращает жанры по списку id.
+        on_lookup - получает количество найденных в кеше и запрошенных жанров.
+        """
         genres = OrderedDict.fromkeys(genre_ids, None)
 
-        # проверяем есть ли полученные жанры в кеше по их ID
-        for genre_id in genres.keys():
-            data = await self.cache.get(genre_id)
-            if data:
-                genres[genre_id] = Genre.parse_raw(data)
-
-        # не найденные в кеше жанры запрашиваем в эластике и кладём в кеш
-        not_found = [genre_id for genre_id in genres.keys()
-                     if genres[genre_id] is None]
-        if not_found:
-            docs = await self._es_get_by_ids(not_found)
-            for doc in docs:
-                genre = Genre(**doc)
-                await self.cache.put(genre.id, genre.json())
-                genres[genre.id] = genre
-        return (genres_total, list(genres.values()))
+        # ищем жанры сначала в памяти воркера, недостающие - одним MGET в редисе,
+        # не найденные в кеше запрашиваем в эластике и кладём в кеш пачкой
+        genres.update(await self.cache.get_or_load(list(genres.keys()), self._load_from_elastic, on_lookup))
+        return list(genres.values())
+
+    async def export(self, after: Optional[UUID] = None) -> AsyncIterator[List[dict]]:
+        """
+        Выгружает все жанры пачками в порядке id, начиная после after.
+        Документы отдаются как есть из эластика, только с полями EXPORT_FIELDS,
+        без разбора в модели и без кеша.
+        """
+        params = {'_source_includes': ','.join(EXPORT_FIELDS)}
+        after_id = str(after) if after else None
+        async for hits in scan_by_id(self.elastic, GENRES_INDEX, config.EXPORT_BATCH_SIZE, after_id, params=params):
+            yield [hit['_source'] for hit in hits]
+
+    async def _load_from_elastic(self, genre_ids: List[UUID]) -> List[Genre]:
+        """
+        Загружает жанры из elasticsearch по списку id, для кеша.
+        """
+        docs = await self._es_get_by_ids(genre_ids)
+        return [construct(Genre, doc) for doc in docs]
 
     async def _es_get_by_ids(self, genre_ids: List[UUID]) -> List[dict]:
         """
@@ -75,25 +106,24 @@ class GenreService:
         """
         doc_ids = [{'_id': genre_id} for genre_id in genre_ids]
         resp = await self.elastic.mget(index=GENRES_INDEX, body={'docs': doc_ids})
-        docs = [doc['_source'] for doc in resp['docs']]
+        docs = [doc['_source'] for doc in resp['docs'] if doc.get('found')]
         return docs
 
     async def _es_get_all(self,
                           offset: int,
-                          limit: int) -> Tuple[int, List[UUID]]:
+                          limit: int,
+                          cursor: Optional[str] = None,
+                          source: Union[bool, List[str]] = False) -> Tuple[Total, List[dict], Optional[str]]:
         """
-        Возвращает список id фильмов из elasticsearch с учётом сортировки и фильтрации
+        Возвращает общее кол-во жанров, найденные документы из elasticsearch,
+        отсортированные по id, и курсор следующей страницы.
+        source - False (только id), True (документ целиком) или список полей документа.
         """
-        params = {
-            "_source": False,
-            "size": limit,
-            "from": offset,
-            "sort": "id"
-        }
-        docs = await self.elastic.search(index=GENRES_INDEX, params=params)
-        ids = [UUID(doc['_id']) for doc in docs['hits']['hits']]
-        total = docs['hits']['total']['value']
-        return (total, ids)
+        params = source_params(source)
+        total, docs, next_cursor = await search_page_with_total('genre_list', self.cache.redis_cache.redis,
+                                                                self.elastic, GENRES_INDEX, None, params,
+                                                                [{'id': 'asc'}], 'id:asc', offset, limit, cursor)
+        return (total, docs['hits']['hits'], next_cursor)
 
 
 @lru_cache()
@@ -101,6 +131,10 @@ def get_genre_service(
         redis: Redis = Depends(get_redis),
         elastic: AsyncElasticsearch = Depends(get_elastic),
 ) -> GenreService:
-    return GenreService(RedisCache(redis=redis,
-                                   keybuilder=genres_keybuilder),
+    return GenreService(TieredCache(memory=get_memory_cache('genre'),
+                                    redis_cache=RedisCache(redis=redis,
+                                                           keybuilder=genres_keybuilder,
+                                                           ttl=config.OBJECT_CACHE_TTL),
+                                    model=Genre,
+                                    flight=get_single_flight(redis)),
                         elastic)
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import sys
+from typing import Iterable, List
+from uuid import UUID
+
+import aioredis
+import orjson
+from aioredis import Redis
+from elasticsearch import AsyncElasticsearch
+
+from cache.memory import get_memory_cache
+from cache.tags import collection_tag, evict_tags, object_tag
+from core import config
+from db.elastic import create_elastic
+from db.redis import create_redis
+from services.film import get_film_service
+from services.genre import get_genre_service
+from services.person import get_person_service
+
+logger = logging.getLogger(__name__)
+
+ENTITIES = ('film', 'person', 'genre')
+# L1-кеши воркера, в которых лежат объекты каждого типа
+MEMORY_CACHES = {
+    'film': ('film', 'film_short'),
+    'person': ('person', ),
+    'genre': ('genre', ),
+}
+
+
+async def publish_changes(redis: Redis, elastic: AsyncElasticsearch, entity: str, obj_ids: Iterable[UUID]):
+    """
+    Удаляет изменившиеся объекты из общего кеша и сообщает воркерам API,
+    чтобы они удалили свои копии в памяти. Вызывается загрузчиком данных
+    после записи в индекс.
+
+    Общая работа (Redis, индекс персона -> фильмы, ответы по тегам) делается
+    здесь один раз, а не в каждом воркере, и до публикации: воркер, удаливший
+    объект из памяти, уже не прочитает его старую копию из Redis.
+
+    Сообщение в канале INVALIDATION_CHANNEL: {"entity": "film", "ids": ["<uuid>", ...]}
+    """
+    if entity not in ENTITIES:
+        raise ValueError(f'unknown entity {entity!r}')
+    obj_ids = list(obj_ids)
+    await Invalidator(redis, elastic).invalidate(entity, obj_ids)
+    message = orjson.dumps({'entity': entity, 'ids': [str(obj_id) for obj_id in obj_ids]})
+    await redis.publish(config.INVALIDATION_CHANNEL, message)
+
+
+class Invalidator:
+    """
+    Удаляет из общего кеша изменившиеся объекты: ключи объектов в Redis
+    и ответы API, привязанные к тегам объектов и коллекции.
+    При изменении фильмов обновляет индекс персона -> фильмы и удаляет
+    ответы, зависящие от персон, у которых изменился список фильмов.
+    """
+
+    def __init__(self, redis: Redis, elastic: AsyncElasticsearch):
+        self.redis = redis
+        self.elastic = elastic
+
+    async def invalidate(self, entity: str, obj_ids: List[UUID]):
+        tags = [object_tag(entity, obj_id) for obj_id in obj_ids]
+        tags.append(collection_tag(entity))
+
+        if entity == 'film':
+            film_service = get_film_service(self.redis, self.elastic)
+            await film_service.cache.delete_many(obj_ids)
+            await film_service.short_cache.delete_many(obj_ids)
+            if film_service.person_films is not None:
+                person_ids = await film_service.person_films.refresh_films(self.elastic, obj_ids)
+                tags.extend(object_tag('person', person_id) for person_id in person_ids)
+        elif entity == 'person':
+            await get_person_service(self.redis, self.elastic).cache.delete_many(obj_ids)
+        elif entity == 'genre':
+            await get_genre_service(self.redis, self.elastic).cache.delete_many(obj_ids)
+        else:
+            raise ValueError(f'unknown entity {entity!r}')
+
+        evicted = await evict_tags(self.redis, tags)
+        logger.debug('invalidated %d %s objects and %d responses', len(obj_ids), entity, evicted)
+
+
+def drop_local(entity: str, obj_ids: List[UUID]):
+    """
+    Удаляет копии объектов из памяти воркера.
+    """
+    if entity not in MEMORY_CACHES:
+        raise ValueError(f'unknown entity {entity!r}')
+    for name in MEMORY_CACHES[entity]:
+        memory = get_memory_cache(name)
+        for obj_id in obj_ids:
+            memory.delete(obj_id)
+
+
+async def listen():
+    """
+    Фоновая задача воркера: слушает канал INVALIDATION_CHANNEL и удаляет
+    изменившиеся объекты из памяти воркера. Канал слушает каждый воркер, потому что
+    у каждого своя копия объектов в памяти; общий кеш к этому моменту уже
+    очищен в publish_changes.
+
+    Pub/sub не хранит сообщения: пропущенные при разрыве соединения события
+    не доставляются, такие записи устаревают по TTL.
+    """
+    while True:
+        conn = None
+        try:
+            # подписка занимает соединение целиком, поэтому отдельное от пула
+            conn = await aioredis.create_redis((config.REDIS_HOST, config.REDIS_PORT))
+            channel, = await conn.subscribe(config.INVALIDATION_CHANNEL)
+            async for message in channel.iter():
+                try:
+                    data = orjson.loads(message)
+                    drop_local(data['entity'], [UUID(obj_id) for obj_id in data['ids']])
+                except Exception:
+                    logger.exception('bad invalidation message %r', message)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('invalidation listener failed, reconnecting')
+        finally:
+            if conn is not None:
+                conn.close()
+                await conn.wait_closed()
+        await asyncio.sleep(1)
+
+
+async def _publish_once(entity: str, obj_ids: List[UUID]):
+    redis = await create_redis()
+    elastic = create_elastic()
+    try:
+        await publish_changes(redis, elastic, entity, obj_ids)
+    finally:
+        redis.close()
+        await redis.wait_closed()
+        await elastic.close()
+
+
+if __name__ == '__main__':
+    # для загрузчика: python -m services.invalidation film <id> [<id> ...]
+    asyncio.run(_publish_once(sys.argv[1], [UUID(obj_id) for obj_id in sys.argv[2:]]))
@@ -1,6 +1,6 @@
 from enum import Enum
 from uuid import UUID
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple, AsyncIterator, Callable, Union
 from functools import lru_cache
 from collections import OrderedDict
 
@@ -8,12 +8,24 @@ from fastapi import Depends
 from aioredis import Redis
 from elasticsearch import AsyncElasticsearch
 
+from core import config
 from db.elastic import get_elastic
 from db.redis import get_redis
+from cache.memory import get_memory_cache
 from cache.redis import RedisCache
+from cache.singleflight import get_single_flight
+from cache.tags import add_response_tags, collection_tag
+from cache.tiered import TieredCache
 from models.person import Person
+from models.fast import construct
+from services.count import Total, search_page_with_total
+from services.cursor import scan_by_id
+from services.fetch import FetchStrategy, get_fetch_planner, source_params
+from services.prefix_index import get_prefix_index
 
 PERSONS_INDEX = 'persons'
+# поля, которые попадают в выгрузку каталога
+EXPORT_FIELDS = ['id', 'name']
 
 
 class Roles(Enum):
@@ -42,24 +54,45 @@ def _build_person_serch_query(name: UUID) -> List:
     return query
 
 
+def _build_person_suggest_query(prefix: str, size: int) -> Dict:
+    return {
+        'size': size,
+        'query': {
+            'match_phrase_prefix': {
+                'name': prefix
+            }
+        }
+    }
+
+
 class PersonService:
 
-    def __init__(self, cache: RedisCache, elastic: AsyncElasticsearch):
+    def __init__(self, cache: TieredCache, elastic: AsyncElasticsearch):
         self.cache = cache
         self.elastic = elastic
 
     async def list(self,
                    page_number: int,
-                   page_size: int) -> Tuple[int, List[Person]]:
+                   page_size: int,
+                   cursor: Optional[str] = None) -> Tuple[Total, List[Person], Optional[str]]:
         """
         Возвращает все персоны
         """
-        # получаем только ID персон
         limit = page_size
         offset = page_size * (page_number - 1)
-        persons_total, person_ids = await self._es_get_all(offset, limit)
-        persons = await self.get_by_ids(person_ids)
-        return (persons_total, persons)
+        add_response_tags([collection_tag('person')])
+        planner = get_fetch_planner('person_list')
+        if planner.choose() is FetchStrategy.SOURCE:
+            # персоны приходят сразу в ответе поиска
+            persons_total, hits, next_cursor = await self._es_get_all(offset, limit, cursor, source=True)
+            persons = await self._cache_hits(hits)
+            return (persons_total, persons, next_cursor)
+
+        # получаем только ID персон, сами персоны - из кеша
+        persons_total, hits, next_cursor = await self._es_get_all(offset, limit, cursor)
+        person_ids = [UUID(hit['_id']) for hit in hits]
+        persons = await self.get_by_ids(person_ids, on_lookup=planner.record)
+        return (persons_total, persons, next_cursor)
 
     async def get_by_id(self, person_id: UUID) -> List[Person]:
 
@@ -68,59 +101,95 @@ class PersonService:
         персона может отсутствовать в базе
         """
 
-        data = await self.cache.get(person_id)
-        if data:
-            return Person.parse_raw(data)
-
-        docs = await self._es_get_by_ids([person_id, ])
-        if not docs:
-            return None
-        person = Person(**docs[0])
-        await self.cache.put(person.id, person.json())
-        return person
+        persons = await self.cache.get_or_load([person_id, ], self._load_from_elastic)
+        return persons.get(person_id)
 
-    async def get_by_ids(self, person_ids: List[UUID]) -> Optional[List[Person]]:
+    async def get_by_ids(self,
+                         person_ids: List[UUID],
+                         on_lookup: Optional[Callable[[int, int], None]] = None) -> Optional[List[Person]]:
         """
         Возвращает персоны по списку id.
+        on_lookup - получает количество найденных в кеше и запрошенных персон.
         """
         persons = OrderedDict.fromkeys(person_ids, None)
 
-        # проверяем есть ли полученные жанры в кеше по их ID
-        for person_id in persons.keys():
-            data = await self.cache.get(person_id)
-            if data:
-                persons[person_id] = Person.parse_raw(data)
-
-        # не найденные в кеше персоны запрашиваем в эластике и кладём в кеш
-        not_found = [person_id for person_id in persons.keys()
-                     if persons[person_id] is None]
-        if not_found:
-            docs = await self._es_get_by_ids(not_found)
-            for doc in docs:
-                person = Person(**doc)
-                await self.cache.put(person.id, person.json())
-                persons[person.id] = person
+        # ищем персоны сначала в памяти воркера, недостающие - одним MGET в редисе,
+        # не найденные в кеше запрашиваем в эластике и кладём в кеш пачкой
+        persons.update(await self.cache.get_or_load(list(persons.keys()), self._load_from_elastic, on_lookup))
         return list(persons.values())
 
+    async def _cache_hits(self, hits: List[dict]) -> List[Person]:
+        """
+        Разбирает персоны из ответа поиска и кладёт их в кеш по id.
+        """
+        persons = [construct(Person, hit['_source']) for hit in hits]
+        await self.cache.put_many(persons)
+        return persons
+
     async def search(self, query: str) -> Optional[List[Person]]:
         """
         Поиск по персонам.
         """
-        person_ids = await self._es_search_by_query(query)
-        if not person_ids:
+        add_response_tags([collection_tag('person')])
+        planner = get_fetch_planner('person_search')
+        if planner.choose() is FetchStrategy.SOURCE:
+            hits = await self._es_search_by_query(query, source=True)
+            if not hits:
+                return None
+            return await self._cache_hits(hits)
+
+        hits = await self._es_search_by_query(query)
+        if not hits:
             return None
 
-        return await self.get_by_ids(person_ids)
+        person_ids = [UUID(hit['_id']) for hit in hits]
+        return await self.get_by_ids(person_ids, on_lookup=planner.record)
 
-    async def _es_search_by_query(self, query: str) -> List[dict]:
+    async def suggest(self, prefix: str, size: int) -> List[Person]:
+        """
+        Автодополнение имён персон. Если включён префиксный индекс в памяти
+        воркера, отвечает он (совпадение с началом любого слова имени), иначе
+        или когда индекс ничего не нашёл - префиксный запрос по имени в эластик.
+        """
+        add_response_tags([collection_tag('person')])
+        if config.SEARCH_PREFIX_INDEX_ENABLED:
+            person_ids = get_prefix_index('person').search(prefix, size)
+            if person_ids:
+                persons = [person for person in await self.get_by_ids(person_ids) if person]
+                if persons:
+                    return persons
+
+        docs = await self.elastic.search(index=PERSONS_INDEX, body=_build_person_suggest_query(prefix, size),
+                                         params=source_params(True))
+        return await self._cache_hits(docs['hits']['hits'])
+
+    async def _es_search_by_query(self, query: str, source: Union[bool, List[str]] = False) -> List[dict]:
         """
-        Отправляет поисковый запрос в эластик и возвращает полученные персоны.
+        Отправляет поисковый запрос в эластик и возвращает найденные документы.
+        source - False (только id), True (документ целиком) или список полей документа.
         """
-        params = {"_source": False}
+        params = source_params(source)
         body = _build_person_serch_query(query)
         docs = await self.elastic.search(index=PERSONS_INDEX, body=body, params=params)
-        ids = [UUID(doc['_id']) for doc in docs['hits']['hits']]
-        return ids
+        return docs['hits']['hits']
+
+    async def export(self, after: Optional[UUID] = None) -> AsyncIterator[List[dict]]:
+        """
+        Выгружает все персоны пачками в порядке id, начиная после after.
+        Документы отдаются как есть из эластика, только с полями EXPORT_FIELDS,
+        без разбора в модели и без кеша.
+        """
+        params = {'_source_includes': ','.join(EXPORT_FIELDS)}
+        after_id = str(after) if after else None
+        async for hits in scan_by_id(self.elastic, PERSONS_INDEX, config.EXPORT_BATCH_SIZE, after_id, params=params):
+            yield [hit['_source'] for hit in hits]
+
+    async def _load_from_elastic(self, person_ids: List[UUID]) -> List[Person]:
+        """
+        Загружает персоны из elasticsearch по списку id, для кеша.
+        """
+        docs = await self._es_get_by_ids(person_ids)
+        return [construct(Person, doc) for doc in docs]
 
     async def _es_get_by_ids(self, person_ids: List[UUID]) -> List[dict]:
         """
@@ -128,25 +197,24 @@ class PersonService:
         """
         doc_ids = [{'_id': person_id} for person_id in person_ids]
         resp = await self.elastic.mget(index=PERSONS_INDEX, body={'docs': doc_ids})
-        docs = [doc['_source'] for doc in resp['docs']]
+        docs = [doc['_source'] for doc in resp['docs'] if doc.get('found')]
         return docs
 
     async def _es_get_all(self,
                           offset: int,
-                          limit: int) -> Tuple[int, List[UUID]]:
+                          limit: int,
+                          cursor: Optional[str] = None,
+                          source: Union[bool, List[str]] = False) -> Tuple[Total, List[dict], Optional[str]]:
         """
-        Возвращает список id персон из elasticsearch с учётом сортировки и фильтрации
+        Возвращает общее кол-во персон, найденные документы из elasticsearch,
+        отсортированные по id, и курсор следующей страницы.
+        source - False (только id), True (документ целиком) или список полей документа.
         """
-        params = {
-            "_source": False,
-            "size": limit,
-            "from": offset,
-            "sort": "id"
-        }
-        docs = await self.elastic.search(index=PERSONS_INDEX, params=params)
-        ids = [UUID(doc['_id']) for doc in docs['hits']['hits']]
-        total = docs['hits']['total']['value']
-        return (total, ids)
+        params = source_params(source)
+        total, docs, next_cursor = await search_page_with_total('person_list', self.cache.redis_cache.redis,
+                                                                self.elastic, PERSONS_INDEX, None, params,
+                                                                [{'id': 'asc'}], 'id:asc', offset, limit, cursor)
+        return (total, docs['hits']['hits'], next_cursor)
 
 
 @ lru_cache()
@@ -156,6 +224,10 @@ def get_person_service(
 
 
 ) -> PersonService:
-    return PersonService(RedisCache(redis=redis,
-                                    keybuilder=persons_keybuilder),
+    return PersonService(TieredCache(memory=get_memory_cache('person'),
+                                     redis_cache=RedisCache(redis=redis,
+                                                            keybuilder=persons_keybuilder,
+                                                            ttl=config.OBJECT_CACHE_TTL),
+                                     model=Person,
+                                     flight=get_single_flight(redis)),
                          elastic)
@@ -0,0 +1,222 @@
+import asyncio
+import logging
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from uuid import UUID
+
+from aioredis import Redis
+from elasticsearch import AsyncElasticsearch
+
+from core import config
+from db.elastic import create_elastic
+from db.redis import create_redis
+from services.cursor import scan_by_id
+
+logger = logging.getLogger(__name__)
+
+FILMS_INDEX = 'movies'
+ROLES = ('actors', 'writers', 'directors')
+# поля фильма, из которых строится индекс
+SOURCE_FIELDS = ['id'] + [f'{role}.id' for role in ROLES]
+
+# person_films:<person_id> - хеш с полями <роль>:<film_id>
+PERSON_PREFIX = 'person_films:'
+# film_persons:<film_id> - множество <роль>:<person_id>, чтобы при изменении
+# фильма убрать его у тех персон, которых в нём больше нет
+FILM_PREFIX = 'film_persons:'
+# id всех проиндексированных фильмов, чтобы при перестроении убрать удалённые
+FILMS_KEY = 'person_films:films'
+# выставляется после первого полного построения, до этого читать индекс нельзя
+BUILT_KEY = 'person_films:built'
+REBUILD_LOCK_KEY = 'lock:person_films:rebuild'
+
+# Заменяет состав участников фильма и записывает разницу в хеши персон.
+# Чтение прежнего состава и запись разницы идут одним скриптом, поэтому
+# обновление по инвалидации и перестроение индекса не перемешиваются.
+# KEYS[1] - film_persons:<film_id>, KEYS[2] - FILMS_KEY,
+# ARGV[1] - id фильма, ARGV[2] - '1', если фильм есть в каталоге, '0' - если удалён,
+# ARGV[3] - PERSON_PREFIX, ARGV[4..] - текущие участники '<роль>:<person_id>'.
+# Возвращает id персон, у которых изменился список фильмов
+SET_FILM_PERSONS_SCRIPT = """
+local film_id, person_prefix = ARGV[1], ARGV[3]
+local old, new, changed = {}, {}, {}
+for _, member in ipairs(redis.call('smembers', KEYS[1])) do old[member] = true end
+for i = 4, #ARGV do new[ARGV[i]] = true end
+local function apply(command, member)
+    local sep = string.find(member, ':', 1, true)
+    local person_id = string.sub(member, sep + 1)
+    local field = string.sub(member, 1, sep) .. film_id
+    if command == 'hset' then
+        redis.call('hset', person_prefix .. person_id, field, '1')
+    else
+        redis.call('hdel', person_prefix .. person_id, field)
+    end
+    table.insert(changed, person_id)
+end
+for member in pairs(old) do
+    if not new[member] then apply('hdel', member) end
+end
+for member in pairs(new) do
+    if not old[member] then apply('hset', member) end
+end
+if #changed > 0 then
+    redis.call('del', KEYS[1])
+    if #ARGV > 3 then redis.call('sadd', KEYS[1], unpack(ARGV, 4)) end
+end
+if ARGV[2] == '1' then
+    redis.call('sadd', KEYS[2], film_id)
+else
+    redis.call('srem', KEYS[2], film_id)
+end
+return changed
+"""
+
+
+def film_roles(doc: dict) -> Set[str]:
+    """
+    Возвращает участников фильма в виде множества '<роль>:<person_id>'.
+    """
+    return {f'{role}:{person["id"]}' for role in ROLES for person in doc.get(role) or []}
+
+
+class PersonFilmsIndex:
+    """
+    Денормализованный индекс персона -> роль -> id фильмов в Redis.
+    Персона читается одним HGETALL вместо nested-запросов по индексу фильмов,
+    поэтому стоимость не зависит от размера каталога.
+    """
+
+    def __init__(self, redis: Redis):
+        self.redis = redis
+
+    async def get_many(self, person_ids: List[UUID]) -> Optional[Dict[UUID, Dict[str, List[UUID]]]]:
+        """
+        Возвращает id фильмов персон в разрезе по ролям за один round-trip.
+        None - индекс ещё не построен, фильмы нужно искать в эластике.
+        """
+        pipe = self.redis.pipeline()
+        built = pipe.exists(BUILT_KEY)
+        fields = [pipe.hgetall(f'{PERSON_PREFIX}{person_id}', encoding='utf-8') for person_id in person_ids]
+        await pipe.execute()
+        if not await built:
+            return None
+
+        films = {}
+        for person_id, person_fields in zip(person_ids, fields):
+            films_by_role = {role: [] for role in ROLES}
+            for field in sorted(await person_fields):
+                role, film_id = field.split(':', 1)
+                films_by_role[role].append(UUID(film_id))
+            films[person_id] = films_by_role
+        return films
+
+    async def update_films(self, docs: List[dict]) -> Set[str]:
+        """
+        Обновляет индекс по изменившимся фильмам: записывает только разницу
+        между прежним и текущим составом участников.
+        Возвращает id персон, у которых изменился список фильмов.
+        """
+        return await self._set_film_persons([(doc['id'], film_roles(doc)) for doc in docs], in_catalogue=True)
+
+    async def remove_films(self, film_ids: Iterable[str]) -> Set[str]:
+        """
+        Убирает удалённые фильмы из индекса.
+        Возвращает id персон, у которых изменился список фильмов.
+        """
+        return await self._set_film_persons([(str(film_id), set()) for film_id in film_ids], in_catalogue=False)
+
+    async def refresh_films(self, elastic: AsyncElasticsearch, film_ids: List[UUID]) -> Set[str]:
+        """
+        Перечитывает фильмы из эластика и обновляет по ним индекс,
+        отсутствующие в эластике фильмы убирает.
+        Возвращает id персон, у которых изменился список фильмов.
+        """
+        if not film_ids:
+            return set()
+        resp = await elastic.mget(index=FILMS_INDEX,
+                                  body={'docs': [{'_id': film_id} for film_id in film_ids]},
+                                  params={'_source_includes': ','.join(SOURCE_FIELDS)})
+        docs = [doc['_source'] for doc in resp['docs'] if doc.get('found')]
+        found = {doc['id'] for doc in docs}
+        changed = await self.update_films(docs)
+        changed |= await self.remove_films(str(film_id) for film_id in film_ids if str(film_id) not in found)
+        return changed
+
+    async def rebuild(self, elastic: AsyncElasticsearch):
+        """
+        Обходит индекс фильмов и приводит индекс персон в соответствие с ним.
+        Пишется только разница, поэтому повторное перестроение дешёвое.
+        """
+        params = {'_source_includes': ','.join(SOURCE_FIELDS)}
+        seen = set()
+        async for hits in scan_by_id(elastic, FILMS_INDEX, config.PERSON_FILMS_INDEX_BATCH_SIZE, params=params):
+            docs = [hit['_source'] for hit in hits]
+            await self.update_films(docs)
+            seen.update(doc['id'] for doc in docs)
+
+        indexed = set(await self.redis.smembers(FILMS_KEY, encoding='utf-8'))
+        await self.remove_films(indexed - seen)
+        await self.redis.set(BUILT_KEY, '1')
+        logger.info('person films index rebuilt: %d films', len(seen))
+
+    async def _set_film_persons(self, films: List[Tuple[str, Set[str]]], in_catalogue: bool) -> Set[str]:
+        """
+        Записывает составы участников фильмов: каждый фильм - отдельным
+        атомарным скриптом, все фильмы - одним пайплайном.
+        """
+        if not films:
+            return set()
+        pipe = self.redis.pipeline()
+        results = [pipe.eval(SET_FILM_PERSONS_SCRIPT,
+                             keys=[f'{FILM_PREFIX}{film_id}', FILMS_KEY],
+                             args=[film_id, '1' if in_catalogue else '0', PERSON_PREFIX, *members])
+                   for film_id, members in films]
+        await pipe.execute()
+        changed = set()
+        for result in results:
+            changed.update(person_id.decode() if isinstance(person_id, bytes) else person_id
+                           for person_id in await result)
+        return changed
+
+
+@lru_cache()
+def get_person_films_index(redis: Redis) -> PersonFilmsIndex:
+    return PersonFilmsIndex(redis)
+
+
+async def refresh_periodically(redis: Redis, elastic: AsyncElasticsearch):
+    """
+    Фоновая задача воркера: раз в PERSON_FILMS_INDEX_REFRESH секунд
+    перестраивает индекс. Перестроением занимается один воркер -
+    тот, кто взял блокировку в Redis.
+    """
+    index = get_person_films_index(redis)
+    while True:
+        try:
+            acquired = await redis.set(REBUILD_LOCK_KEY, '1',
+                                       expire=config.PERSON_FILMS_INDEX_REFRESH,
+                                       exist=Redis.SET_IF_NOT_EXIST)
+            if acquired:
+                await index.rebuild(elastic)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('person films index rebuild failed')
+        await asyncio.sleep(config.PERSON_FILMS_INDEX_REFRESH)
+
+
+async def _rebuild_once():
+    redis = await create_redis()
+    elastic = create_elastic()
+    try:
+        await PersonFilmsIndex(redis).rebuild(elastic)
+    finally:
+        redis.close()
+        await redis.wait_closed()
+        await elastic.close()
+
+
+if __name__ == '__main__':
+    # разовое перестроение индекса: python -m services.person_films
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_rebuild_once())
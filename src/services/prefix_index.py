@@ -0,0 +1,119 @@
+"""
+Префиксный индекс названий фильмов и имён персон в памяти воркера для автодополнения.
+
+Автодополнение вызывается на каждую набранную букву (typeahead), поэтому
+индекс отвечает на него локально, без запроса в эластик: это
+отсортированный массив ключей, где ключ - название, начиная с каждого
+его слова ("звёздные войны" -> "звёздные войны", "войны"), поэтому
+префикс любого слова названия находится бисекцией.
+Полнотекстовый поиск индекс не заменяет: он не ищет по описанию,
+жанрам и участникам и не исправляет опечатки, поэтому отвечает только
+на автодополнение, а если ничего не нашёл - запрос уходит в эластик.
+Индекс перестраивается из эластика раз в SEARCH_PREFIX_INDEX_REFRESH секунд.
+"""
+import asyncio
+import bisect
+import logging
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import UUID
+
+from elasticsearch import AsyncElasticsearch
+
+from cache.redis import normalize_search_text
+from core import config
+from services.cursor import scan_by_id
+
+logger = logging.getLogger(__name__)
+
+# имя индекса -> индекс эластика, поле с текстом и поле для порядка одинаковых ключей
+INDEXES = {
+    'film': ('movies', 'title', 'imdb_rating'),
+    'person': ('persons', 'name', None),
+}
+
+
+class PrefixIndex:
+    """
+    Отсортированный массив ключей и параллельный массив id документов.
+    Пока индекс ни разу не построен, search возвращает None.
+    """
+
+    def __init__(self, name: str, index: str, field: str, rank_field: Optional[str] = None):
+        self.name = name
+        self.index = index
+        self.field = field
+        self.rank_field = rank_field
+        self.built_at: Optional[float] = None
+        # ключи и id меняются одним присваиванием: build выполняется в потоке,
+        # и search не должен увидеть новые ключи со старыми id
+        self._data: Tuple[List[str], List[UUID]] = ([], [])
+
+    def __len__(self) -> int:
+        return len(self._data[0])
+
+    def build(self, docs: Iterable[dict]):
+        entries: List[Tuple[str, float, UUID]] = []
+        for doc in docs:
+            words = normalize_search_text(doc.get(self.field) or '').split(' ')
+            doc_id = UUID(doc['id'])
+            # при одинаковых ключах первыми идут документы с большим рангом
+            rank = -(doc.get(self.rank_field) or 0) if self.rank_field else 0
+            for i in range(len(words)):
+                if words[i]:
+                    entries.append((' '.join(words[i:]), rank, doc_id))
+        entries.sort()
+        self._data = ([key for key, _, _ in entries], [doc_id for _, _, doc_id in entries])
+        self.built_at = time.time()
+
+    async def refresh(self, elastic: AsyncElasticsearch):
+        fields = ['id', self.field] + ([self.rank_field] if self.rank_field else [])
+        params = {'_source_includes': ','.join(fields)}
+        docs = []
+        async for hits in scan_by_id(elastic, self.index, config.SEARCH_PREFIX_INDEX_BATCH_SIZE, params=params):
+            docs.extend(hit['_source'] for hit in hits)
+        # сортировка сотен тысяч ключей - в потоке, чтобы не задерживать запросы воркера
+        await asyncio.get_event_loop().run_in_executor(None, self.build, docs)
+        logger.info('%s prefix index rebuilt: %d documents, %d keys', self.name, len(docs), len(self))
+
+    def search(self, prefix: str, limit: int) -> Optional[List[UUID]]:
+        """
+        Возвращает до limit id документов, у которых слово названия
+        (с последующими словами) начинается с prefix, в порядке ключей.
+        None - индекс ещё не построен.
+        """
+        if self.built_at is None:
+            return None
+        keys, ids = self._data
+        prefix = normalize_search_text(prefix)
+        found = {}
+        position = bisect.bisect_left(keys, prefix)
+        while position < len(keys) and len(found) < limit and keys[position].startswith(prefix):
+            found.setdefault(ids[position], None)
+            position += 1
+        return list(found)
+
+
+_indexes: Dict[str, PrefixIndex] = {}
+
+
+def get_prefix_index(name: str) -> PrefixIndex:
+    if name not in _indexes:
+        _indexes[name] = PrefixIndex(name, *INDEXES[name])
+    return _indexes[name]
+
+
+async def refresh_periodically(elastic: AsyncElasticsearch):
+    """
+    Фоновая задача воркера: раз в SEARCH_PREFIX_INDEX_REFRESH секунд
+    перестраивает все префиксные индексы. Индекс у каждого воркера свой.
+    """
+    while True:
+        for name in INDEXES:
+            try:
+                await get_prefix_index(name).refresh(elastic)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('%s prefix index refresh failed', name)
+        await asyncio.sleep(config.SEARCH_PREFIX_INDEX_REFRESH)
@@ -0,0 +1,149 @@
+"""
+Прогрев кеша после запуска или деплоя, чтобы первые минуты трафика
+не уходили целиком в эластик.
+
+Прогревается:
+- список жанров и топ фильмов по рейтингу - пачкой из эластика
+  и пайплайном в редис, через сервисы;
+- первые WARMUP_LIST_PAGES страниц списков и самые популярные запросы
+  по счётчикам обращений - запросами к приложению внутри процесса,
+  так ответы попадают в кеш под теми же ключами, что и при обычных запросах.
+
+Запуск вручную: python warmup.py
+"""
+import asyncio
+import logging
+import math
+import time
+from collections import Counter
+from typing import Dict, List
+
+from aioredis import Redis
+from elasticsearch import AsyncElasticsearch
+
+from cache.access import WARMUP_HEADER, top_paths
+from core import config
+from db import elastic, redis
+from services.film import SortBy, get_film_service
+from services.genre import get_genre_service
+
+logger = logging.getLogger(__name__)
+
+LIST_PATHS = ['/v1/film/', '/v1/genre/', '/v1/person/']
+LOCK_KEY = 'lock:warmup'
+
+
+def _list_page_paths(pages: int) -> List[str]:
+    paths = []
+    for path in LIST_PATHS:
+        paths.append(path)
+        paths.extend(f'{path}?page[number]={page}' for page in range(2, pages + 1))
+    return paths
+
+
+async def _warm_genres(redis: Redis, elastic: AsyncElasticsearch):
+    await get_genre_service(redis, elastic).list(1, config.WARMUP_GENRES_LIMIT)
+
+
+async def _warm_top_films(redis: Redis, elastic: AsyncElasticsearch):
+    film_service = get_film_service(redis, elastic)
+    # краткие формы для списков и полные - для страниц фильмов
+    _, films, _ = await film_service.list(1, config.WARMUP_TOP_FILMS, sort_by=SortBy.from_query(None), short=True)
+    await film_service.get_by_ids([film.id for film in films])
+
+
+async def _replay(app, path: str) -> int:
+    """
+    Выполняет GET-запрос к приложению внутри процесса и возвращает код ответа.
+    """
+    path, _, query = path.partition('?')
+    scope = {
+        'type': 'http',
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'root_path': '',
+        'query_string': query.encode(),
+        'headers': [(b'host', b'localhost'), (WARMUP_HEADER.encode(), b'1')],
+        'client': None,
+        'server': None,
+    }
+    status = None
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await app(scope, receive, send)
+    return status
+
+
+async def warm_up(app, redis: Redis, elastic: AsyncElasticsearch) -> Dict[str, int]:
+    """
+    Прогревает кеш не дольше WARMUP_BUDGET секунд, выполняя не больше
+    WARMUP_CONCURRENCY задач одновременно. Возвращает количество
+    выполненных задач каждого вида.
+    """
+    semaphore = asyncio.Semaphore(config.WARMUP_CONCURRENCY)
+    done = Counter()
+
+    async def limited(kind: str, fn, *args):
+        async with semaphore:
+            try:
+                await fn(*args)
+                done[kind] += 1
+            except Exception:
+                logger.warning('cache warm-up task %s failed', kind, exc_info=True)
+
+    async def run():
+        paths = _list_page_paths(config.WARMUP_LIST_PAGES)
+        for path in await top_paths(redis, config.WARMUP_TOP_PATHS):
+            if path not in paths:
+                paths.append(path)
+        await asyncio.gather(limited('genres', _warm_genres, redis, elastic),
+                             limited('top_films', _warm_top_films, redis, elastic),
+                             *(limited('paths', _replay, app, path) for path in paths))
+
+    started = time.monotonic()
+    try:
+        await asyncio.wait_for(run(), timeout=config.WARMUP_BUDGET)
+    except asyncio.TimeoutError:
+        logger.warning('cache warm-up stopped after %s s budget', config.WARMUP_BUDGET)
+    logger.info('cache warm-up finished in %.2f s: %s', time.monotonic() - started, dict(done))
+    return dict(done)
+
+
+async def warm_up_once(app, redis: Redis, elastic: AsyncElasticsearch):
+    """
+    Прогрев при старте воркера. Общий кеш в редисе прогревает только один
+    воркер - тот, кто взял блокировку, остальные стартуют сразу.
+    """
+    acquired = await redis.set(LOCK_KEY, '1',
+                               expire=math.ceil(config.WARMUP_BUDGET),
+                               exist=Redis.SET_IF_NOT_EXIST)
+    if acquired:
+        await warm_up(app, redis, elastic)
+
+
+async def _warm_up_standalone():
+    from main import app
+
+    redis.redis = await redis.create_redis()
+    elastic.es = elastic.create_elastic()
+    try:
+        await warm_up(app, redis.redis, elastic.es)
+    finally:
+        redis.redis.close()
+        await redis.redis.wait_closed()
+        await elastic.es.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_warm_up_standalone())